@@ -0,0 +1,495 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from datetime import datetime
+
+from generator import generate_import
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+
+def load_app():
+    '''Import the server with a database in a fresh temporary folder.
+
+    Returns:
+        main: module of the server
+    '''
+
+    os.chdir(tempfile.mkdtemp())
+    import main
+    return main
+
+
+def measure(function, repeat=3):
+    '''Best wall time of several runs of the function.'''
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def legacy_birthdays(manager, import_id):
+    '''Birthdays counted with two queries per relation (old way).'''
+
+    rel_query = '''SELECT citizen_id, relative
+                   FROM relatives
+                   WHERE import_id = ?'''
+    birthday_query = '''SELECT birth_date FROM citizens
+                        WHERE import_id = ? AND citizen_id = ?'''
+
+    cursor = manager.cursor
+    relatives = cursor.execute(rel_query, (import_id,)).fetchall()
+    answer = {month: {} for month in range(1, 13)}
+    for pair in relatives:
+        for (giver, taker) in [(pair[0], pair[1]), (pair[1], pair[0])]:
+            params = (import_id, taker)
+            date = cursor.execute(birthday_query, params).fetchone()
+            if date:
+                month = datetime.strptime(date[0], '%d.%m.%Y').month
+                answer[month][giver] = answer[month].get(giver, 0) + 1
+    return answer
+
+
+def benchmark_birthdays(citizens=10000, relations=50000):
+    '''Compare per-relation and set-based counting of birthdays.'''
+
+    main = load_app()
+    data = generate_import(citizens=citizens, relations=relations)
+
+    # Count every time instead of answering from the cache.
+    main.manager.snapshots.max_bytes = 0
+
+    with main.app.app_context():
+        response = main.manager.import_data(data['citizens'])
+        import_id = response.get_json()['data']['import_id']
+
+        legacy = measure(lambda: legacy_birthdays(main.manager, import_id), 1)
+        current = measure(lambda: main.manager.get_birthdays(import_id))
+
+    print(f'birthdays: {citizens} citizens, {2 * relations} relatives rows')
+    print(f'  per-relation queries: {legacy:.3f} s')
+    print(f'  set-based query:      {current:.3f} s')
+    print(f'  speedup:              {legacy / current:.1f}x')
+
+
+def benchmark_import(citizens=50000, relations=100000):
+    '''Rows per second of POST /imports with different batch sizes.'''
+
+    main = load_app()
+    data = generate_import(citizens=citizens, relations=relations)
+    body = json.dumps(data)
+    rows = citizens + 2 * relations
+    client = main.app.test_client()
+
+    print(f'import: {citizens} citizens, {2 * relations} relatives rows')
+    for batch_size in [100, 1000, 10000]:
+        main.manager.IMPORT_BATCH_SIZE = batch_size
+        with main.app.app_context():
+            insert = measure(lambda: main.manager.import_data(
+                data['citizens']))
+        request = measure(lambda: client.post('/imports', data=body))
+        print(f'  batch {batch_size:>5}: insert {rows / insert:>9.0f} rows/s,'
+              f' parse + check + insert {rows / request:>9.0f} rows/s')
+
+
+def benchmark_update(sizes=(1000, 10000, 100000), updates=200):
+    '''Latency of changing relatives of a citizen for imports of
+    different sizes.'''
+
+    main = load_app()
+    client = main.app.test_client()
+
+    print(f'update: {updates} relatives changes')
+    for citizens in sizes:
+        data = generate_import(citizens=citizens, relations=citizens)
+        r = client.post('/imports', data=json.dumps(data))
+        import_id = r.get_json()['data']['import_id']
+
+        def update():
+            for i in range(updates):
+                relatives = [(i + shift) % citizens + 1 for shift in (1, 2, 3)]
+                r = client.post(f'/imports/{import_id}/citizens/1',
+                                data=json.dumps({'relatives': relatives}))
+                assert r.status_code == 200, r.data
+
+        def update_many():
+            changes = [{'citizen_id': i + 1,
+                        'relatives': [(i + 1) % citizens + 1]}
+                       for i in range(0, updates * 2, 2)]
+            r = client.patch(f'/imports/{import_id}/citizens',
+                             data=json.dumps({'citizens': changes}))
+            assert r.status_code == 200, r.data
+
+        elapsed = measure(update, 1)
+        batch = measure(update_many, 1)
+        print(f'  {citizens:>6} citizens: {1000 * elapsed / updates:.2f} ms'
+              f' per update, {1000 * batch / updates:.2f} ms in one batch')
+
+
+def benchmark_queries(citizens=10000, relations=20000, lookups=20000):
+    '''Cost of one query with inlined values and with bound parameters.'''
+
+    main = load_app()
+    data = generate_import(citizens=citizens, relations=relations)
+    with main.app.app_context():
+        import_id = main.manager.import_data(data['citizens']).get_json()[
+            'data']['import_id']
+
+    import queries
+    pool = main.manager.pool
+    pairs = pool.reader().execute(queries.RELATION_ROWS,
+                                  (import_id,)).fetchall()[:lookups]
+
+    def inlined(connection):
+        for citizen_id, relative in pairs:
+            connection.execute(f'''SELECT * FROM citizens
+                                   WHERE import_id = {import_id}
+                                   AND citizen_id = {relative}''').fetchone()
+
+    def bound(connection):
+        for citizen_id, relative in pairs:
+            connection.execute(queries.SELECT_CITIZEN,
+                               (import_id, relative)).fetchone()
+
+    def citizen_relatives(connection):
+        for citizen_id, relative in pairs:
+            connection.execute(queries.CITIZEN_RELATIVES,
+                               (import_id, citizen_id,
+                                import_id, citizen_id)).fetchall()
+
+    def inlined_relatives(connection):
+        for citizen_id, relative in pairs:
+            connection.execute(f'''SELECT relative
+                                   FROM relatives
+                                   WHERE import_id = {import_id}
+                                   AND citizen_id = {citizen_id}
+                                   UNION
+                                   SELECT citizen_id
+                                   FROM relatives
+                                   WHERE import_id = {import_id}
+                                   AND relative = {citizen_id}''').fetchall()
+
+    uncached = sqlite3.connect(pool.database, cached_statements=0)
+    cached = pool.connect()
+
+    print(f'queries: {len(pairs)} lookups, microseconds per query')
+    for name, run, connection in [
+            ('citizen, inlined values', inlined, cached),
+            ('citizen, bound, no cache', bound, uncached),
+            ('citizen, bound, cached', bound, cached),
+            ('relatives, inlined values', inlined_relatives, cached),
+            ('relatives, bound, no cache', citizen_relatives, uncached),
+            ('relatives, bound, cached', citizen_relatives, cached)]:
+        elapsed = measure(lambda: run(connection))
+        print(f'  {name:<28} {1e6 * elapsed / len(pairs):6.1f}')
+
+
+def benchmark_pages(citizens=100000, relations=100000):
+    '''Time and size of the whole import, of a page and of one field.'''
+
+    main = load_app()
+    client = main.app.test_client()
+    data = generate_import(citizens=citizens, relations=relations)
+    r = client.post('/imports', data=json.dumps(data))
+    import_id = r.get_json()['data']['import_id']
+
+    # Read from the database every time.
+    main.manager.snapshots.max_bytes = 0
+
+    print(f'pages: {citizens} citizens, {2 * relations} relatives rows')
+    for query in ['', f'after_citizen_id={citizens // 2}&limit=100',
+                  'fields=citizen_id,town', 'fields=citizen_id,relatives']:
+        url = f'/imports/{import_id}/citizens?{query}'
+        elapsed = measure(lambda: client.get(url).data)
+        size = len(client.get(url).data)
+        print(f'  {query or "all":<40} {1000 * elapsed:8.1f} ms'
+              f' {size / 1024:8.0f} KB')
+
+
+def load_rows(manager, import_id):
+    '''Citizens as a dict of tuples and relatives as a dict of tuples
+    (old snapshots).'''
+
+    import queries
+    connection = manager.pool.reader()
+    citizens = {row[1]: row[1:] for row in connection.execute(
+        queries.SELECT_CITIZENS, (import_id,))}
+    relatives = {}
+    for citizen_id, relative in connection.execute(
+            queries.IMPORT_RELATIVES, (import_id, import_id)):
+        relatives.setdefault(citizen_id, []).append(relative)
+    return citizens, {citizen_id: tuple(citizen_relatives) for
+                      citizen_id, citizen_relatives in relatives.items()}
+
+
+def traced_bytes(function):
+    '''Bytes allocated by the function and still taken by its result.'''
+
+    tracemalloc.start()
+    result = function()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def benchmark_memory(citizens=100000, relations=100000):
+    '''Memory of an import kept as rows and as columns.'''
+
+    main = load_app()
+    client = main.app.test_client()
+    data = generate_import(citizens=citizens, relations=relations)
+    r = client.post('/imports', data=json.dumps(data))
+    import_id = r.get_json()['data']['import_id']
+    manager = main.manager
+
+    rows = traced_bytes(lambda: load_rows(manager, import_id))
+    columns = traced_bytes(lambda: manager.load_snapshot(import_id))
+    snapshot = manager.load_snapshot(import_id)
+
+    print(f'memory: {citizens} citizens, {2 * relations} relatives rows')
+    print(f'  rows    {rows / 2 ** 20:8.1f} MB')
+    print(f'  columns {columns / 2 ** 20:8.1f} MB'
+          f' (estimated {snapshot.size / 2 ** 20:.1f} MB),'
+          f' {rows / columns:.1f} times less')
+
+    manager.snapshots.put(snapshot)
+    elapsed = measure(lambda: client.get(
+        f'/imports/{import_id}/citizens').data)
+    print(f'  GET citizens from columns {1000 * elapsed:8.1f} ms')
+
+
+def benchmark_relations(citizens=10000, relations=100000):
+    '''Time of checking relations against the whole import.'''
+
+    main = load_app()
+    client = main.app.test_client()
+    data = generate_import(citizens=citizens, relations=relations)
+    body = json.dumps(data)
+    parser = main.parser
+
+    def check(strict):
+        parser.STRICT_RELATIVES = strict
+        for _ in parser.iter_checked(data['citizens']):
+            pass
+
+    def check_relations(strict):
+        parser.STRICT_RELATIVES = strict
+        ids, pairs_from, pairs_to = array('q'), array('q'), array('q')
+        for citizen in data['citizens']:
+            relatives = citizen['relatives']
+            ids.append(citizen['citizen_id'])
+            pairs_to.extend(relatives)
+            pairs_from.extend([citizen['citizen_id']] * len(relatives))
+        start = time.perf_counter()
+        assert parser.check_relations(ids, pairs_from, pairs_to) is True
+        return time.perf_counter() - start
+
+    print(f'relations: {citizens} citizens, {2 * relations} relatives')
+    for strict in [False, True]:
+        relations_check = min(check_relations(strict) for _ in range(3))
+        whole_check = measure(lambda: check(strict))
+        parser.STRICT_RELATIVES = strict
+        request = measure(lambda: client.post('/imports', data=body))
+        print(f'  strict={strict!s:<5}: relations'
+              f' {1000 * relations_check:6.1f} ms,'
+              f' all checks {1000 * whole_check:6.1f} ms,'
+              f' POST /imports {1000 * request:7.1f} ms')
+
+
+def benchmark_validation(citizens=10000):
+    '''Check-functions per field against the compiled check.'''
+
+    main = load_app()
+    parser = main.parser
+    data = generate_import(citizens=citizens, relations=citizens)['citizens']
+
+    def per_field():
+        for citizen in data:
+            assert parser.check_citizen(citizen) is True
+
+    def compiled():
+        check = parser.compile_check()
+        for citizen in data:
+            assert check(citizen) is True
+
+    legacy = measure(per_field)
+    fast = measure(compiled)
+    print(f'validation: {citizens} citizens')
+    print(f'  per-field check-functions: {1000 * legacy:7.1f} ms')
+    print(f'  compiled check:            {1000 * fast:7.1f} ms'
+          f' ({legacy / fast:.1f} times faster)')
+
+
+def benchmark_compression(citizens=100000, relations=100000):
+    '''Time and size of the whole import with every encoding.'''
+
+    main = load_app()
+    import compression
+    client = main.app.test_client()
+    data = generate_import(citizens=citizens, relations=relations)
+    r = client.post('/imports', data=json.dumps(data))
+    url = f'/imports/{r.get_json()["data"]["import_id"]}/citizens'
+
+    print(f'compression: {citizens} citizens, {2 * relations} relatives rows')
+    for encoding in ['identity'] + compression.ENCODINGS:
+        headers = {'Accept-Encoding': encoding}
+        main.compressed.answers.clear()
+        main.compressed.size = 0
+        start = time.perf_counter()
+        size = len(client.get(url, headers=headers).data)
+        first = time.perf_counter() - start
+        cached = measure(lambda: client.get(url, headers=headers).data)
+        print(f'  {encoding:<8} {size / 1024:8.0f} KB,'
+              f' first {1000 * first:7.1f} ms,'
+              f' repeated {1000 * cached:7.1f} ms')
+
+
+def benchmark_export(citizens=100000, relations=100000):
+    '''Size, time of the answer and of decoding for every format.'''
+
+    main = load_app()
+    import export
+    client = main.app.test_client()
+    data = generate_import(citizens=citizens, relations=relations)
+    r = client.post('/imports', data=json.dumps(data))
+    url = f'/imports/{r.get_json()["data"]["import_id"]}/citizens'
+    client.get(url).data
+
+    decoders = {
+        'application/json': lambda body: json.loads(body)['data'],
+        export.NDJSON_MIMETYPE: lambda body: [json.loads(line) for line in
+                                              body.splitlines()],
+        export.COLUMNS_MIMETYPE: export.decode_columns,
+    }
+
+    print(f'export: {citizens} citizens, {2 * relations} relatives rows')
+    for mimetype, decode in decoders.items():
+        headers = {'Accept': mimetype}
+        main.compressed.answers.clear()
+        main.compressed.size = 0
+        body = client.get(url, headers=headers).data
+        answer = measure(lambda: client.get(url, headers=headers).data)
+        decoding = measure(lambda: decode(body))
+        print(f'  {mimetype:<32} {len(body) / 1024:8.0f} KB,'
+              f' answer {1000 * answer:7.1f} ms,'
+              f' decoding {1000 * decoding:7.1f} ms')
+
+
+def benchmark_retries(citizens=50000, relations=50000):
+    '''Time of a repeated POST /imports and number of stored imports.'''
+
+    main = load_app()
+    client = main.app.test_client()
+    body = json.dumps(generate_import(citizens=citizens,
+                                      relations=relations))
+
+    def count():
+        return main.manager.cursor.execute(
+            '''SELECT COUNT(*) FROM imports''').fetchone()[0]
+
+    print(f'retries: {citizens} citizens, {2 * relations} relatives rows')
+    for name, deduplicate, headers in [
+            ('new import', False, {}),
+            ('same Idempotency-Key', False, {'Idempotency-Key': 'key'}),
+            ('same body hash', True, {})]:
+        main.manager.DEDUPLICATE_IMPORTS = deduplicate
+        client.post('/imports', data=body, headers=headers)
+        before = count()
+        seconds = measure(lambda: client.post('/imports', data=body,
+                                              headers=headers))
+        print(f'  {name:<22} {1000 * seconds:8.1f} ms,'
+              f' {count() - before} more imports')
+
+
+def start_server(command, port):
+    '''Start a server of the service on a temporary database.
+
+    Returns:
+        process: process of the server answering on the port
+    '''
+
+    import requests
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(root))
+    process = subprocess.Popen(command, cwd=tempfile.mkdtemp(), env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/')
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('Server did not start: ' + ' '.join(command))
+
+
+def benchmark_servers(clients=16, requests=200, port=8091):
+    '''Throughput of gunicorn and of the ASGI mode under concurrent
+    clients.'''
+
+    from load_test import load_test
+
+    servers = {
+        'gunicorn -w 4': ['gunicorn', '-w', '4', '-b', f'127.0.0.1:{port}',
+                          'main:app'],
+        'gunicorn -w 4 --threads 4': ['gunicorn', '-w', '4', '--threads',
+                                      '4', '-b', f'127.0.0.1:{port}',
+                                      'main:app'],
+        'uvicorn --workers 4 asgi:app': ['uvicorn', '--workers', '4',
+                                         '--port', str(port),
+                                         '--log-level', 'warning',
+                                         'asgi:app'],
+    }
+
+    print(f'servers: {clients} clients, {requests} requests to every '
+          f'endpoint, requests per second')
+    for name, command in servers.items():
+        process = start_server(command, port)
+        try:
+            report = load_test('http', f'http://127.0.0.1:{port}', clients,
+                               requests=requests)
+        finally:
+            process.terminate()
+            process.wait()
+
+        results = report['results']
+        print(f'  {name:<30} mixed {report["throughput"]:7.1f}, ' +
+              ', '.join(f'{endpoint.split()[1].split("/")[-1]} p99 '
+                        f'{stats["p99_ms"]} ms'
+                        for endpoint, stats in results.items()
+                        if endpoint.startswith('GET')))
+
+
+BENCHMARKS = {
+    'birthdays': benchmark_birthdays,
+    'import': benchmark_import,
+    'update': benchmark_update,
+    'queries': benchmark_queries,
+    'pages': benchmark_pages,
+    'memory': benchmark_memory,
+    'relations': benchmark_relations,
+    'validation': benchmark_validation,
+    'compression': benchmark_compression,
+    'export': benchmark_export,
+    'retries': benchmark_retries,
+    'servers': benchmark_servers,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,37 @@
+'''Fixtures of the tests: the server with a database in a temporary
+folder.'''
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+# Load test against a running server, not a test module.
+collect_ignore = ['load_test.py']
+
+
+@pytest.fixture(scope='session')
+def main(tmp_path_factory):
+    '''Module of the server, its databases are in a temporary folder.'''
+
+    os.chdir(str(tmp_path_factory.mktemp('server')))
+    import main
+    return main
+
+
+@pytest.fixture
+def client(main):
+    '''Test client of the server.'''
+
+    return main.app.test_client()
+
+
+def post_import(client, citizens):
+    '''Import citizens and return the new import_id.'''
+
+    response = client.post('/imports', json={'citizens': citizens})
+    assert response.status_code == 201, response.data
+    return response.get_json()['data']['import_id']
@@ -0,0 +1,53 @@
+import random
+from datetime import date, timedelta
+
+
+TOWNS = ['Москва', 'Санкт-Петербург', 'Керчь', 'Казань', 'Тула',
+         'Новосибирск', 'Екатеринбург', 'Самара', 'Омск', 'Пермь']
+STREETS = ['Льва Толстого', 'Иванова', 'Ленина', 'Заборная', 'Садовая']
+
+
+def generate_import(citizens=1000, towns=10, relations=2000, seed=0):
+    '''Generate a valid import with symmetric relatives.
+
+    Args:
+        citizens (int): number of citizens
+        towns (int): number of different towns
+        relations (int): number of relations (pairs of relatives)
+        seed (int): seed of the random generator
+
+    Returns:
+        data: json-serializable data for POST /imports
+    '''
+
+    rng = random.Random(seed)
+    town_names = [TOWNS[i % len(TOWNS)] + ('' if i < len(TOWNS) else
+                                            ' ' + str(i))
+                  for i in range(towns)]
+    first_day = date(1940, 1, 1)
+
+    data = []
+    for citizen_id in range(1, citizens + 1):
+        birth_date = first_day + timedelta(days=rng.randrange(25000))
+        data.append({'citizen_id': citizen_id,
+                     'town': rng.choice(town_names),
+                     'street': rng.choice(STREETS),
+                     'building': str(rng.randint(1, 200)),
+                     'apartment': rng.randint(1, 500),
+                     'name': 'Гражданин ' + str(citizen_id),
+                     'birth_date': birth_date.strftime('%d.%m.%Y'),
+                     'gender': rng.choice(['male', 'female']),
+                     'relatives': []})
+
+    # Relations are added to both sides.
+    relations = min(relations, citizens * (citizens - 1) // 2)
+    pairs = set()
+    while len(pairs) < relations:
+        first, second = rng.sample(range(citizens), 2)
+        pair = (min(first, second), max(first, second))
+        if pair not in pairs:
+            pairs.add(pair)
+            data[first]['relatives'].append(second + 1)
+            data[second]['relatives'].append(first + 1)
+
+    return {'citizens': data}
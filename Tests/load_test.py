@@ -0,0 +1,249 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from generator import TOWNS, generate_import
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+
+ENDPOINTS = ['POST /imports',
+             'PATCH /imports/$import_id/citizens/$citizen_id',
+             'GET /imports/$import_id/citizens',
+             'GET /imports/$import_id/birthdays',
+             'GET /imports/$import_id/towns/stat/percentile/age']
+
+
+class TestClient:
+    '''Server running in this process behind the Flask test client.'''
+
+    def __init__(self):
+        '''Import the server with a database in a temporary folder.'''
+
+        os.chdir(tempfile.mkdtemp())
+        import main
+        self.client = main.app.test_client()
+
+    def request(self, method, url, data=None):
+        '''Send a request and read the whole response.
+
+        Returns:
+            status_code (int): status code of the response
+            body (bytes): body of the response
+        '''
+
+        response = self.client.open(url, method=method, data=data)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    '''Server running separately, e.g. with gunicorn.'''
+
+    def __init__(self, base_url):
+        '''Initialize client instance.
+
+        Args:
+            base_url (str): address of the server
+        '''
+
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def request(self, method, url, data=None):
+        '''Send a request and read the whole response.
+
+        Returns:
+            status_code (int): status code of the response
+            body (bytes): body of the response
+        '''
+
+        response = self.session.request(method, self.base_url + url,
+                                        data=data)
+        return response.status_code, response.content
+
+
+def make_requests(import_ids, citizens, count, seed):
+    '''Requests to the endpoints except uploads.
+
+    Args:
+        import_ids: ids of uploaded imports
+        citizens (int): number of citizens in every import
+        count (int): number of requests to every endpoint
+        seed (int): seed of the random generator
+
+    Returns:
+        requests: shuffled list of (endpoint, method, url, data)
+    '''
+
+    rng = random.Random(seed)
+    requests = []
+    for i in range(count):
+        import_id = rng.choice(import_ids)
+        citizen_id = rng.randint(1, citizens)
+        change = json.dumps({'town': rng.choice(TOWNS),
+                             'apartment': rng.randint(1, 500),
+                             'name': 'Гражданин ' + str(i)})
+        requests += [
+            (ENDPOINTS[1], 'POST',
+             f'/imports/{import_id}/citizens/{citizen_id}', change),
+            (ENDPOINTS[2], 'GET', f'/imports/{import_id}/citizens', None),
+            (ENDPOINTS[3], 'GET', f'/imports/{import_id}/birthdays', None),
+            (ENDPOINTS[4], 'GET',
+             f'/imports/{import_id}/towns/stat/percentile/age', None)]
+    rng.shuffle(requests)
+    return requests
+
+
+def run_requests(client, requests):
+    '''Send requests one after another and time them.
+
+    Returns:
+        timings: list of (endpoint, status_code, seconds)
+    '''
+
+    timings = []
+    for endpoint, method, url, data in requests:
+        start = time.perf_counter()
+        status_code, _ = client.request(method, url, data)
+        timings.append((endpoint, status_code, time.perf_counter() - start))
+    return timings
+
+
+def run_worker(args):
+    '''Send a share of requests from a separate process.'''
+
+    base_url, requests = args
+    return run_requests(HttpClient(base_url), requests)
+
+
+def summary(timings, elapsed=None):
+    '''Latency percentiles of every endpoint.
+
+    Args:
+        timings: list of (endpoint, status_code, seconds)
+        elapsed (float): wall time of the run in seconds, only if the
+            run had requests to one endpoint, then its throughput
+            is counted
+
+    Returns:
+        results: dict endpoint -> statistics
+    '''
+
+    results = {}
+    for endpoint in ENDPOINTS:
+        times = [seconds for name, _, seconds in timings if name == endpoint]
+        if not times:
+            continue
+        errors = sum(1 for name, status_code, _ in timings
+                     if name == endpoint and status_code >= 400)
+        p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1000
+        results[endpoint] = {'requests': len(times),
+                             'errors': errors,
+                             'p50_ms': round(p50, 2),
+                             'p95_ms': round(p95, 2),
+                             'p99_ms': round(p99, 2)}
+        if elapsed is not None:
+            results[endpoint]['throughput'] = round(len(times) / elapsed, 1)
+    return results
+
+
+def load_test(mode='client', base_url='http://0.0.0.0:8080', processes=4,
+              citizens=1000, towns=10, relations=2000, imports=5,
+              requests=100, seed=0):
+    '''Upload imports and load all endpoints of the service.
+
+    Uploads are sent one after another, then `requests` requests to
+    every other endpoint are sent in a random order: by one process
+    in the `client` mode and by `processes` processes at once in the
+    `http` mode.
+
+    Returns:
+        report: settings of the run and statistics of every endpoint
+    '''
+
+    client = TestClient() if mode == 'client' else HttpClient(base_url)
+
+    uploads = []
+    import_ids = []
+    for i in range(imports):
+        data = json.dumps(generate_import(citizens, towns, relations,
+                                          seed + i))
+        start = time.perf_counter()
+        status_code, body = client.request('POST', '/imports', data)
+        uploads.append((ENDPOINTS[0], status_code,
+                        time.perf_counter() - start))
+        assert status_code == 201, body
+        import_ids.append(json.loads(body)['data']['import_id'])
+    results = summary(uploads, sum(seconds for _, _, seconds in uploads))
+
+    load = make_requests(import_ids, citizens, requests, seed)
+    start = time.perf_counter()
+    if mode == 'client':
+        timings = run_requests(client, load)
+    else:
+        shares = [(base_url, load[i::processes]) for i in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            timings = [timing for share in pool.map(run_worker, shares)
+                       for timing in share]
+    elapsed = time.perf_counter() - start
+
+    # Endpoints share the time of the mixed run, only the whole run has
+    # a throughput.
+    results.update(summary(timings))
+
+    return {'settings': {'mode': mode,
+                         'processes': processes if mode == 'http' else 1,
+                         'citizens': citizens,
+                         'towns': towns,
+                         'relations': relations,
+                         'imports': imports,
+                         'requests': requests,
+                         'seed': seed},
+            'throughput': round(len(timings) / elapsed, 1),
+            'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of the service.')
+    parser.add_argument('--mode', choices=['client', 'http'],
+                        default='client',
+                        help='server in this process or a running server')
+    parser.add_argument('--url', default='http://0.0.0.0:8080',
+                        help='address of the running server')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='number of processes sending requests')
+    parser.add_argument('--citizens', type=int, default=1000)
+    parser.add_argument('--towns', type=int, default=10)
+    parser.add_argument('--relations', type=int, default=2000)
+    parser.add_argument('--imports', type=int, default=5)
+    parser.add_argument('--requests', type=int, default=100,
+                        help='number of requests to every endpoint')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_test.json',
+                        help='file to write the report to')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    report = load_test(args.mode, args.url, args.processes, args.citizens,
+                       args.towns, args.relations, args.imports,
+                       args.requests, args.seed)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+
+    for endpoint, stats in report['results'].items():
+        throughput = f'{stats["throughput"]} req/s, '\
+            if 'throughput' in stats else ''
+        print(f'{endpoint}: {throughput}'
+              f'p50 {stats["p50_ms"]} ms, p95 {stats["p95_ms"]} ms, '
+              f'p99 {stats["p99_ms"]} ms, errors {stats["errors"]}')
+    print(f'Mixed load: {report["throughput"]} req/s')
+    print(f'Report is written to {output}')
@@ -0,0 +1,74 @@
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from generator import generate_import
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+
+def run_worker(args):
+    '''Upload imports from a separate process with its own server.
+
+    Args:
+        args: (folder with the database, worker number, number of imports)
+
+    Returns:
+        uploads: list of (import_id, seed) for every upload
+    '''
+
+    folder, worker, imports = args
+    os.chdir(folder)
+    import main
+    client = main.app.test_client()
+
+    uploads = []
+    for i in range(imports):
+        seed = worker * imports + i
+        data = generate_import(citizens=50, relations=60, seed=seed)
+        r = client.post('/imports', data=json.dumps(data))
+        assert r.status_code == 201, r.data
+        uploads.append((r.get_json()['data']['import_id'], seed))
+    return uploads
+
+
+def stress_imports(workers=4, imports=10):
+    '''Upload imports from parallel processes at once.
+
+    Checks that every upload got its own import_id and that every
+    import holds exactly the data that was sent with it.
+    '''
+
+    folder = tempfile.mkdtemp()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        results = pool.map(run_worker, [(folder, worker, imports)
+                                        for worker in range(workers)])
+    uploads = [upload for result in results for upload in result]
+
+    ids = [import_id for import_id, _ in uploads]
+    assert len(set(ids)) == len(ids), 'Same import_id for different uploads'
+
+    os.chdir(folder)
+    import main
+    client = main.app.test_client()
+    for import_id, seed in uploads:
+        expected = generate_import(citizens=50, relations=60, seed=seed)
+        expected = sorted(expected['citizens'],
+                          key=lambda citizen: citizen['citizen_id'])
+        for citizen in expected:
+            citizen['relatives'].sort()
+
+        r = client.get(f'/imports/{import_id}/citizens')
+        assert r.get_json()['data'] == expected, \
+            f'Import {import_id} has data of another upload'
+
+    return f'{len(uploads)} parallel imports from {workers} processes are ' +\
+        'isolated !'
+
+
+if __name__ == '__main__':
+    print(stress_imports())
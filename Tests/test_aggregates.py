@@ -0,0 +1,118 @@
+import random
+from collections import Counter
+from datetime import datetime
+
+import pytest
+
+import aggregates
+import queries
+from conftest import post_import
+from generator import TOWNS, generate_import
+
+
+class Rollback(Exception):
+    '''Ends a transaction which must not be saved.'''
+
+
+def read_aggregates(cursor, import_id):
+    presents = list(aggregates.read_presents(cursor, import_id))
+    towns = dict(cursor.execute(queries.IMPORT_TOWN_BIRTHS,
+                                (import_id,)).fetchall())
+    return presents, towns
+
+
+def current_and_rebuilt(main, import_id):
+    '''Aggregates of the import and the same ones built from scratch.'''
+
+    with pytest.raises(Rollback):
+        with main.manager.pool.writer() as connection:
+            cursor = connection.cursor()
+            current = read_aggregates(cursor, import_id)
+            for table in ('presents', 'town_births', 'age_stats'):
+                cursor.execute(f'''DELETE FROM {table} WHERE import_id = ?''',
+                               (import_id,))
+            aggregates.build(cursor, import_id)
+            rebuilt = read_aggregates(cursor, import_id)
+            raise Rollback()
+    return current, rebuilt
+
+
+def random_change(rng, citizen_id, citizens, relatives=True):
+    '''Random new values of some fields of the citizen.'''
+
+    change = {'name': 'Гражданин %d' % rng.randrange(1000)}
+    if rng.random() < 0.5:
+        change['town'] = rng.choice(TOWNS[:4])
+    if rng.random() < 0.5:
+        day, month = rng.randint(1, 28), rng.randint(1, 12)
+        year = rng.randint(1940, 2010)
+        change['birth_date'] = rng.choice(['%02d.%02d.%d', '%d.%d.%d'])\
+            % (day, month, year)
+    if relatives and rng.random() < 0.6:
+        others = [other for other in range(1, citizens + 1)
+                  if other != citizen_id]
+        change['relatives'] = rng.sample(others, rng.randint(0, 4))
+    return change
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_updates_keep_aggregates_equal_to_a_rebuild(main, client, seed):
+    rng = random.Random(seed)
+    citizens = 40
+    data = generate_import(citizens=citizens, towns=4, relations=60,
+                           seed=seed)
+    import_id = post_import(client, data['citizens'])
+    url = f'/imports/{import_id}/citizens'
+
+    # The import is cached, so its snapshot is patched too.
+    client.get(url).get_data()
+
+    for step in range(30):
+        if rng.random() < 0.5:
+            citizen_id = rng.randint(1, citizens)
+            response = client.post(f'{url}/{citizen_id}', json=random_change(
+                rng, citizen_id, citizens))
+        else:
+            ids = rng.sample(range(1, citizens + 1), rng.randint(1, 5))
+            # Relatives changed together must agree, only the first
+            # citizen changes them.
+            changes = [dict(random_change(rng, citizen_id, citizens,
+                                          relatives=i == 0),
+                            citizen_id=citizen_id)
+                       for i, citizen_id in enumerate(ids)]
+            response = client.patch(url, json={'citizens': changes})
+        assert response.status_code == 200, response.data
+
+        current, rebuilt = current_and_rebuilt(main, import_id)
+        assert current == rebuilt, f'step {step}'
+
+    # Snapshot patched on every step matches the database.
+    cached = client.get(url).get_json()['data']
+    with main.manager.snapshots.lock:
+        main.manager.snapshots.remove(import_id)
+    limit = main.manager.snapshots.max_bytes
+    main.manager.snapshots.max_bytes = 0
+    try:
+        assert client.get(url).get_json()['data'] == cached
+    finally:
+        main.manager.snapshots.max_bytes = limit
+
+    relatives = {citizen['citizen_id']: set(citizen['relatives'])
+                 for citizen in cached}
+    for citizen_id, others in relatives.items():
+        for other in others:
+            assert citizen_id in relatives[other]
+
+    # Birthdays counted independently from the final citizens, every
+    # relation row makes both of its citizens buy a present.
+    months = {citizen['citizen_id']: datetime.strptime(
+        citizen['birth_date'], '%d.%m.%Y').month for citizen in cached}
+    expected = Counter()
+    for citizen in cached:
+        for relative in citizen['relatives']:
+            expected[(months[relative], citizen['citizen_id'])] += 1
+            expected[(months[citizen['citizen_id']], relative)] += 1
+    birthdays = client.get(f'/imports/{import_id}/birthdays').get_json()
+    assert {(int(month), giver['citizen_id']): giver['presents']
+            for month, givers in birthdays['data'].items()
+            for giver in givers} == dict(expected)
@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from analytics import date_keys
+from conftest import post_import
+from generator import generate_import
+
+
+def citizen(citizen_id, town, birth_date, relatives):
+    return {'citizen_id': citizen_id, 'town': town, 'street': 'Ленина',
+            'building': '1', 'apartment': citizen_id, 'name': 'Иван',
+            'birth_date': birth_date, 'gender': 'male',
+            'relatives': relatives}
+
+
+def test_date_keys_of_padded_and_unpadded_dates():
+    dates = ['01.04.1990', '1.4.1990', '7.12.2000', '31.1.2019',
+             '9.10.1950', ' 3. 2.1999']
+    assert date_keys(dates).tolist() == [19900401, 19900401, 20001207,
+                                         20190131, 19501009, 19990203]
+    assert date_keys([]).tolist() == []
+
+
+def test_date_keys_match_strptime():
+    rng = random.Random(0)
+    days = [date(1900, 1, 1) + timedelta(days=rng.randrange(45000))
+            for _ in range(500)]
+    dates = [day.strftime('%d.%m.%Y') for day in days]
+    dates += ['%d.%d.%d' % (day.day, day.month, day.year) for day in days]
+    expected = []
+    for text in dates:
+        day = datetime.strptime(text, '%d.%m.%Y').date()
+        expected.append(day.year * 10000 + day.month * 100 + day.day)
+    assert np.array_equal(date_keys(dates), expected)
+
+
+def test_statistics_of_dates_without_leading_zeros(client):
+    citizens = [citizen(1, 'A', '1.4.1990', [2]),
+                citizen(2, 'B', '7.12.2000', [1])]
+    import_id = post_import(client, citizens)
+
+    response = client.get(f'/imports/{import_id}/birthdays')
+    assert response.status_code == 200
+    birthdays = response.get_json()['data']
+    assert birthdays['4'] == [{'citizen_id': 2, 'presents': 2}]
+    assert birthdays['12'] == [{'citizen_id': 1, 'presents': 2}]
+    assert sum(len(month) for month in birthdays.values()) == 2
+
+    today = datetime.utcnow().date()
+    response = client.get(f'/imports/{import_id}/towns/stat/percentile/age')
+    assert response.status_code == 200
+    for town in response.get_json()['data']:
+        birth_date = date(1990, 4, 1) if town['town'] == 'A' else\
+            date(2000, 12, 7)
+        age = relativedelta(today, birth_date).years
+        assert town['p50'] == town['p75'] == town['p99'] == age
+
+
+def test_presents_after_changes_to_unpadded_dates(client):
+    citizens = generate_import(citizens=20, relations=30, seed=1)['citizens']
+    import_id = post_import(client, citizens)
+
+    response = client.post(f'/imports/{import_id}/citizens/3',
+                           json={'birth_date': '5.3.1980'})
+    assert response.status_code == 200
+    response = client.patch(f'/imports/{import_id}/citizens',
+                            json={'citizens': [
+                                {'citizen_id': 4, 'birth_date': '9.11.1970'},
+                                {'citizen_id': 5, 'birth_date': '1.1.2001'}]})
+    assert response.status_code == 200
+
+    changed = client.get(f'/imports/{import_id}/birthdays')
+    assert changed.status_code == 200
+
+    citizens[2]['birth_date'] = '5.3.1980'
+    citizens[3]['birth_date'] = '9.11.1970'
+    citizens[4]['birth_date'] = '1.1.2001'
+    fresh_id = post_import(client, citizens)
+    fresh = client.get(f'/imports/{fresh_id}/birthdays')
+    assert changed.get_json() == fresh.get_json()
+    assert set(fresh.get_json()['data']) == {str(month)
+                                             for month in range(1, 13)}
+
+
+def test_percentiles_do_not_wait_for_the_writer(main, client):
+    import_id = post_import(client, generate_import(citizens=50)['citizens'])
+    url = f'/imports/{import_id}/towns/stat/percentile/age'
+    with main.manager.snapshots.lock:
+        main.manager.snapshots.remove(import_id)
+    with main.manager.pool.writer() as connection:
+        connection.execute('''DELETE FROM age_stats''')
+
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold_writer():
+        with main.manager.pool.writer():
+            held.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold_writer)
+    thread.start()
+    held.wait(5)
+    try:
+        start = time.perf_counter()
+        response = client.get(url)
+        assert time.perf_counter() - start < 1
+        assert response.status_code == 200
+    finally:
+        release.set()
+        thread.join()
+
+    saved = main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM age_stats WHERE import_id = ?''',
+        (import_id,)).fetchone()[0]
+    assert saved == 0
+
+    with main.manager.snapshots.lock:
+        main.manager.snapshots.remove(import_id)
+    assert client.get(url).get_json() == response.get_json()
+    saved = main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM age_stats WHERE import_id = ?''',
+        (import_id,)).fetchone()[0]
+    assert saved == 1
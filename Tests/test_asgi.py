@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+from generator import generate_import
+
+
+@pytest.fixture
+def asgi(main):
+    '''ASGI module, imported after the server got its temporary
+    folder.'''
+
+    import asgi
+    return asgi
+
+
+def call(asgi, method, path, body=b'', chunk_size=None, query=b''):
+    '''Send a request to the ASGI application.
+
+    Args:
+        body (bytes): body of the request sent in pieces of `chunk_size`
+
+    Returns:
+        status, headers, body: parts of the response
+    '''
+
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query, 'http_version': '1.1',
+             'headers': [(b'content-type', b'application/json'),
+                         (b'content-length', str(len(body)).encode())]}
+    chunk_size = chunk_size or max(len(body), 1)
+    chunks = [body[start:start + chunk_size]
+              for start in range(0, len(body), chunk_size)] or [b'']
+    messages = [{'type': 'http.request', 'body': chunk,
+                 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(asgi.app(scope, receive, send))
+    finally:
+        loop.close()
+
+    assert not messages
+    assert sent[0]['type'] == 'http.response.start'
+    assert all(message['type'] == 'http.response.body'
+               for message in sent[1:])
+    assert not sent[-1].get('more_body', False)
+    return (sent[0]['status'], dict(sent[0]['headers']),
+            b''.join(message['body'] for message in sent[1:]))
+
+
+def test_streamed_import_and_get(asgi, client):
+    data = generate_import(citizens=200, relations=150)
+    body = json.dumps(data).encode()
+    status, headers, answer = call(asgi, 'POST', '/imports', body, 1000)
+    assert status == 201
+    assert headers[b'content-type'] == b'application/json'
+    import_id = json.loads(answer)['data']['import_id']
+
+    url = f'/imports/{import_id}/citizens'
+    status, _, answer = call(asgi, 'GET', url)
+    assert status == 200
+    assert json.loads(answer) == client.get(url).get_json()
+    assert len(json.loads(answer)['data']) == 200
+
+    status, _, answer = call(asgi, 'GET', url, query=b'limit=2')
+    assert [citizen['citizen_id'] for citizen in
+            json.loads(answer)['data']] == [1, 2]
+    assert call(asgi, 'GET', f'/imports/{import_id + 1}/citizens')[0] == 404
@@ -0,0 +1,80 @@
+import pytest
+
+from conftest import post_import
+from generator import generate_import
+
+
+def new_import(client):
+    citizens = generate_import(citizens=6, relations=0)['citizens']
+    citizens[0]['relatives'] = [2]
+    citizens[1]['relatives'] = [1]
+    return post_import(client, citizens)
+
+
+def citizens_of(client, import_id):
+    answer = client.get(f'/imports/{import_id}/citizens').get_json()['data']
+    return {citizen['citizen_id']: citizen for citizen in answer}
+
+
+def test_relatives_are_changed_on_both_sides(client):
+    import_id = new_import(client)
+    response = client.patch(f'/imports/{import_id}/citizens', json={
+        'citizens': [{'citizen_id': 1, 'relatives': [3, 4]},
+                     {'citizen_id': 5, 'name': 'Новое имя', 'town': 'Керчь'},
+                     {'citizen_id': 6, 'relatives': [3]}]})
+    assert response.status_code == 200
+
+    answer = response.get_json()['data']
+    assert [citizen['citizen_id'] for citizen in answer] == [1, 5, 6]
+    assert answer[0]['relatives'] == [3, 4] and answer[2]['relatives'] == [3]
+
+    citizens = citizens_of(client, import_id)
+    assert citizens[1]['relatives'] == [3, 4]
+    assert citizens[2]['relatives'] == []
+    assert citizens[3]['relatives'] == [1, 6]
+    assert citizens[4]['relatives'] == [1]
+    assert citizens[5]['name'] == 'Новое имя'
+    assert citizens[5]['town'] == 'Керчь'
+    assert answer[1] == citizens[5]
+
+
+@pytest.mark.parametrize('changes, status_code', [
+    # Citizen is not in the import.
+    ([{'citizen_id': 1, 'name': 'Другое имя'},
+      {'citizen_id': 60, 'name': 'Другое имя'}], 404),
+    # Wrong fields, unknown relatives and changes which do not agree.
+    ([{'citizen_id': 1, 'name': 'Другое имя'},
+      {'citizen_id': 2, 'relatives': [60]}], 400),
+    ([{'citizen_id': 1, 'name': 'Другое имя'},
+      {'citizen_id': 2, 'gender': 'unknown'}], 400),
+    ([{'citizen_id': 1, 'name': 'Другое имя'},
+      {'citizen_id': 2, 'unknown': 1}], 400),
+    ([{'citizen_id': 1, 'name': 'Другое имя'}, {'name': 'Другое имя'}], 400),
+    ([{'citizen_id': 1, 'name': 'Другое имя'},
+      {'citizen_id': 1, 'town': 'Керчь'}], 400),
+    ([{'citizen_id': 1, 'relatives': [3]},
+      {'citizen_id': 3, 'relatives': []}], 400),
+])
+def test_wrong_batch_changes_nothing(client, changes, status_code):
+    import_id = new_import(client)
+    before = citizens_of(client, import_id)
+
+    response = client.patch(f'/imports/{import_id}/citizens',
+                            json={'citizens': changes})
+    assert response.status_code == status_code
+    assert citizens_of(client, import_id) == before
+
+
+def test_unknown_import(client):
+    import_id = new_import(client)
+    response = client.patch(f'/imports/{import_id + 1}/citizens', json={
+        'citizens': [{'citizen_id': 1, 'name': 'Другое имя'}]})
+    assert response.status_code == 404
+
+
+def test_unknown_field_of_one_citizen(main, client):
+    import_id = new_import(client)
+    response = client.post(f'/imports/{import_id}/citizens/1',
+                           json={'unknown': 1})
+    assert response.status_code == 400
+    assert response.get_json()['message'] == main.parser.STUB_ERROR_MSG
@@ -0,0 +1,92 @@
+import random
+
+import pytest
+
+import columnar
+from generator import generate_import
+
+
+COLUMNS = ['citizen_id', 'town', 'street', 'building', 'apartment', 'name',
+           'birth_date', 'gender']
+
+
+def row(citizen):
+    return tuple(citizen[field] for field in COLUMNS)
+
+
+def columnar_import(citizens):
+    data = columnar.ColumnarImport(COLUMNS)
+    for citizen in citizens:
+        data.add(row(citizen))
+    for pair in sorted((citizen['citizen_id'], relative)
+                       for citizen in citizens
+                       for relative in citizen['relatives']):
+        data.add_relative(*pair)
+    data.finish()
+    return data
+
+
+def with_sorted_relatives(citizens):
+    return [dict(citizen, relatives=sorted(citizen['relatives']))
+            for citizen in citizens]
+
+
+def test_columns_give_back_the_citizens():
+    citizens = with_sorted_relatives(
+        generate_import(citizens=60, relations=80)['citizens'])
+    data = columnar_import(citizens)
+
+    assert list(data.iter_citizens()) == citizens
+    assert list(data.iter_citizens(10, 5, ['name', 'relatives'])) == [
+        {'name': citizen['name'], 'relatives': citizen['relatives']}
+        for citizen in citizens[10:15]]
+    assert list(data.iter_citizens(60)) == []
+    assert data.row(7) == 6 and data.row(61) is None
+
+
+def test_patches_change_both_sides_of_relations(monkeypatch):
+    # Changed rows are merged into the arrays several times.
+    monkeypatch.setattr(columnar, 'MAX_CHANGED_ROWS', 4)
+    rng = random.Random(1)
+    citizens = with_sorted_relatives(
+        generate_import(citizens=30, relations=20)['citizens'])
+    data = columnar_import(citizens)
+    expected = {citizen['citizen_id']: citizen for citizen in citizens}
+
+    for step in range(40):
+        citizen_id = rng.randint(1, 30)
+        relatives = set(rng.sample(range(1, 31), rng.randint(0, 3)))
+        relatives.discard(citizen_id)
+
+        old = set(expected[citizen_id]['relatives'])
+        for other in old ^ relatives:
+            others = set(expected[other]['relatives']) ^ {citizen_id}
+            expected[other] = dict(expected[other],
+                                   relatives=sorted(others))
+        expected[citizen_id] = dict(expected[citizen_id],
+                                    name='Имя %d' % step,
+                                    town=rng.choice(['Москва', 'Керчь']),
+                                    relatives=sorted(relatives))
+
+        data.patch(row(expected[citizen_id]), relatives)
+        assert list(data.iter_citizens()) == [expected[key]
+                                              for key in range(1, 31)]
+
+
+@pytest.mark.parametrize('max_changed_rows', [1024, 0])
+def test_patches_of_a_copy_leave_the_import(monkeypatch, max_changed_rows):
+    monkeypatch.setattr(columnar, 'MAX_CHANGED_ROWS', max_changed_rows)
+    citizens = with_sorted_relatives(
+        generate_import(citizens=20, relations=0)['citizens'])
+    data = columnar_import(citizens)
+    patched = data.copy()
+
+    changed = dict(citizens[4], name='Другое имя', town='Новый город',
+                   apartment=1000, gender='female')
+    patched.patch(row(changed), [])
+    assert list(data.iter_citizens()) == citizens
+    assert list(patched.iter_citizens()) ==\
+        citizens[:4] + [changed] + citizens[5:]
+
+    # Arrays are copied only when patched rows are merged into them.
+    assert (patched.names is data.names) == (max_changed_rows > 0)
@@ -0,0 +1,63 @@
+import gzip
+import json
+
+import pytest
+from flask import Response
+
+import compression
+from conftest import post_import
+from generator import generate_import
+
+
+def test_compressed_answers_are_cached_until_the_import_changes(main,
+                                                                client):
+    import_id = post_import(client, generate_import(citizens=300,
+                                                    relations=200)['citizens'])
+    url = f'/imports/{import_id}/citizens'
+    gzipped = {'Accept-Encoding': 'gzip'}
+    plain = client.get(url).get_data()
+
+    first = client.get(url, headers=gzipped)
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert first.headers['ETag'].endswith('-gzip"')
+    assert gzip.decompress(first.get_data()) == plain
+
+    hits = main.compressed.stats()['hits']
+    second = client.get(url, headers=gzipped)
+    assert main.compressed.stats()['hits'] == hits + 1
+    assert second.get_data() == first.get_data()
+    assert client.get(url, headers=dict(
+        gzipped, **{'If-None-Match': first.headers['ETag']})).status_code ==\
+        304
+
+    client.post(f'{url}/2', json={'name': 'Другое имя'})
+    changed = client.get(url, headers=gzipped)
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert gzip.decompress(changed.get_data()) == client.get(url).get_data()
+    answer = json.loads(gzip.decompress(changed.get_data()))
+    assert answer['data'][1]['name'] == 'Другое имя'
+
+
+def test_choose_encoding():
+    assert compression.choose_encoding(None) is None
+    assert compression.choose_encoding('identity') is None
+    assert compression.choose_encoding('gzip;q=0, deflate') is None
+    assert compression.choose_encoding('gzip') == 'gzip'
+    assert compression.choose_encoding('*') == compression.ENCODINGS[0]
+
+
+@pytest.mark.parametrize('max_store_bytes, stored', [(None, True),
+                                                     (100000, True),
+                                                     (1000, False)])
+def test_only_small_streamed_answers_are_stored(max_store_bytes, stored):
+    text = json.dumps(generate_import(citizens=300, relations=200))
+    pieces = [text[start:start + 4096]
+              for start in range(0, len(text), 4096)]
+    response = Response(iter(pieces))
+    saved = []
+
+    compression.compress_response(response, 'gzip', saved.append,
+                                  max_store_bytes)
+    body = b''.join(response.response)
+    assert gzip.decompress(body) == text.encode()
+    assert saved == ([body] if stored else [])
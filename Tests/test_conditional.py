@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+from conftest import post_import
+from generator import generate_import
+
+
+ROUTES = ['citizens', 'birthdays', 'towns/stat/percentile/age']
+
+
+def test_not_modified_until_the_import_changes(client):
+    import_id = post_import(client, generate_import(citizens=30)['citizens'])
+    url = f'/imports/{import_id}'
+
+    tags = {}
+    for route in ROUTES:
+        response = client.get(f'{url}/{route}')
+        assert response.status_code == 200
+        tags[route] = response.headers['ETag']
+        assert response.headers['Last-Modified']
+
+        again = client.get(f'{url}/{route}',
+                           headers={'If-None-Match': tags[route]})
+        assert again.status_code == 304 and again.get_data() == b''
+
+    response = client.post(f'{url}/citizens/1', json={'name': 'Новое имя'})
+    assert response.status_code == 200
+
+    for route in ROUTES:
+        response = client.get(f'{url}/{route}',
+                              headers={'If-None-Match': tags[route]})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != tags[route]
+    assert client.get(f'{url}/citizens').get_json()['data'][0]['name'] ==\
+        'Новое имя'
+
+
+
+
+def frozen(now):
+    '''Datetime class whose now() is always `now`.'''
+
+    class Frozen(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    return Frozen
+
+
+def test_modified_since_is_not_trusted_in_the_same_second(main, client,
+                                                          monkeypatch):
+    import_id = post_import(client, generate_import(citizens=10)['citizens'])
+    url = f'/imports/{import_id}/citizens'
+    response = client.get(url)
+    headers = {'If-Modified-Since': response.headers['Last-Modified']}
+
+    # The import may change again in the second of its last change.
+    for delay, status_code in [(0.5, 200), (1, 304)]:
+        now = response.last_modified + timedelta(seconds=delay)
+        monkeypatch.setattr(main, 'datetime', frozen(now))
+        assert client.get(url, headers=headers).status_code == status_code
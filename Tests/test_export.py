@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import export
+from conftest import post_import
+from generator import generate_import
+
+
+FIELDS = ['citizen_id', 'town', 'street', 'building', 'apartment', 'name',
+          'birth_date', 'gender', 'relatives']
+
+
+def test_columns_round_trip(monkeypatch):
+    monkeypatch.setattr(export, 'BLOCK_ROWS', 7)
+    citizens = generate_import(citizens=50, relations=80)['citizens']
+    citizens[3]['name'] = ''
+    citizens[4]['relatives'] = []
+    data = b''.join(export.iter_columns(citizens, FIELDS))
+    assert export.decode_columns(data) == citizens
+
+    assert export.decode_columns(b''.join(export.iter_columns(
+        [], FIELDS))) == []
+    with pytest.raises(ValueError):
+        export.decode_columns(b'XXXX' + data[4:])
+
+
+def test_ndjson_lines():
+    citizens = generate_import(citizens=30)['citizens']
+    text = ''.join(export.iter_ndjson(citizens, chunk_size=100))
+    assert [json.loads(line) for line in text.splitlines()] == citizens
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_formats_of_citizens(main, client, monkeypatch, cached):
+    citizens = generate_import(citizens=120, relations=100)['citizens']
+    import_id = post_import(client, citizens)
+    url = f'/imports/{import_id}/citizens'
+    if not cached:
+        monkeypatch.setattr(main.manager.snapshots, 'max_bytes', 0)
+        with main.manager.snapshots.lock:
+            main.manager.snapshots.remove(import_id)
+
+    answer = client.get(url).get_json()['data']
+    assert answer == [dict(citizen, relatives=sorted(citizen['relatives']))
+                      for citizen in citizens]
+
+    response = client.get(url, headers={'Accept': export.NDJSON_MIMETYPE})
+    assert response.mimetype == export.NDJSON_MIMETYPE
+    assert [json.loads(line) for line in
+            response.get_data(as_text=True).splitlines()] == answer
+
+    response = client.get(url, headers={'Accept': export.COLUMNS_MIMETYPE})
+    assert response.mimetype == export.COLUMNS_MIMETYPE
+    assert export.decode_columns(response.get_data()) == answer
+
+    page = client.get(url + '?after_citizen_id=10&limit=5&fields=name,'
+                      'relatives', headers={'Accept':
+                                            export.COLUMNS_MIMETYPE})
+    assert export.decode_columns(page.get_data()) == [
+        {'name': citizen['name'], 'relatives': citizen['relatives']}
+        for citizen in answer[10:15]]
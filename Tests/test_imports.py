@@ -0,0 +1,36 @@
+from conftest import post_import
+from generator import generate_import
+
+
+def test_citizens_are_read_without_the_write_lock(main):
+    lock = main.manager.pool.write_lock
+    free = []
+
+    def citizens():
+        for citizen in generate_import(citizens=30, relations=20)['citizens']:
+            free.append(lock.acquire(blocking=False))
+            if free[-1]:
+                lock.release()
+            yield citizen
+
+    import_id = main.manager.insert_import(citizens(), batch_size=7)
+    assert free and all(free)
+
+    rows = main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM citizens WHERE import_id = ?''',
+        (import_id,)).fetchone()[0]
+    assert rows == 30
+
+
+def test_wrong_import_leaves_no_rows(main, client):
+    before = main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM imports''').fetchone()[0]
+    citizens = generate_import(citizens=10, relations=5)['citizens']
+    citizens[-1]['gender'] = 'unknown'
+    response = client.post('/imports', json={'citizens': citizens})
+    assert response.status_code == 400
+    after = main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM imports''').fetchone()[0]
+    assert after == before
+
+    post_import(client, citizens[:-1])
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+import jobs
+import queries
+from generator import generate_import
+
+
+MAKE_OLD = '''UPDATE jobs
+              SET heartbeat = heartbeat - 100, updated = updated - 100
+              WHERE job_id = ?'''
+
+
+@pytest.fixture
+def import_jobs(main, tmp_path):
+    return jobs.ImportJobs(main.manager, main.parser, workers=1,
+                           database=str(tmp_path / 'jobs.db'))
+
+
+def test_job_is_done(import_jobs):
+    body = json.dumps(generate_import(citizens=20)).encode()
+    job_id = import_jobs.submit(body)
+    import_jobs.queue.join()
+
+    job = import_jobs.get(job_id)
+    assert job['status'] == 'done' and job['citizens'] == 20
+    assert job['import_id'] is not None
+
+
+@pytest.mark.parametrize('body', [b'{"citizens": [1]}', b'{"citizens": [',
+                                  b'{}'])
+def test_wrong_import_fails(import_jobs, body):
+    job_id = import_jobs.submit(body)
+    import_jobs.queue.join()
+
+    job = import_jobs.get(job_id)
+    assert job['status'] == 'failed' and job['import_id'] is None
+    assert job['message']
+    assert import_jobs.get('unknown') is None
+
+
+def test_jobs_of_a_lost_process_fail(import_jobs):
+    import_jobs.save(queries.INSERT_JOB, ('lost', 'restarted-worker'))
+    import_jobs.save(MAKE_OLD, ('lost',))
+    import_jobs.save(queries.INSERT_JOB, ('alive', 'other-worker'))
+
+    job = import_jobs.get('lost')
+    assert job['status'] == 'failed'
+    assert job['message'] == jobs.ORPHANED_MESSAGE
+    assert import_jobs.get('alive')['status'] == 'queued'
+
+
+def test_heartbeat_keeps_jobs_of_the_process(import_jobs):
+    import_jobs.save(queries.INSERT_JOB, ('own', import_jobs.owner))
+    import_jobs.save(MAKE_OLD, ('own',))
+    import_jobs.save(queries.JOBS_HEARTBEAT, (import_jobs.owner,))
+    assert import_jobs.get('own')['status'] == 'queued'
+
+
+def test_restarted_process_fails_old_jobs(main, import_jobs, tmp_path):
+    import_jobs.save(queries.INSERT_JOB, ('old', import_jobs.owner))
+    import_jobs.save(MAKE_OLD, ('old',))
+
+    jobs.ImportJobs(main.manager, main.parser, workers=1,
+                    database=str(tmp_path / 'jobs.db'))
+    row = import_jobs.pool.reader().execute(
+        '''SELECT status FROM jobs WHERE job_id = ?''', ('old',)).fetchone()
+    assert row[0] == 'failed'
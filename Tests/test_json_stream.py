@@ -0,0 +1,56 @@
+import io
+import json
+
+import pytest
+
+from json_stream import HashingStream, NoCitizensError, body_hash,\
+    iter_citizens
+
+
+DOCUMENT = ('{"before": [1, {"a": "}]"}], "citizens": [\n'
+            '  {"citizen_id": 12345678901234, "name": "Иван \\"Ё\\" \\u2603",'
+            ' "apartment": -17, "x": 1.5e+10, "y": [], "z": {}},\n'
+            '  7, -0.25, 1E-3, 123456789, true, null, "строка 😀", [2, [3]]\n'
+            '], "after": 10.75}')
+
+
+def read(data, chunk_size):
+    return list(iter_citizens(io.BytesIO(data), chunk_size))
+
+
+def test_every_split_of_the_document():
+    data = DOCUMENT.encode()
+    expected = json.loads(DOCUMENT)['citizens']
+
+    # Every chunk size puts boundaries inside numbers, strings and
+    # multibyte characters somewhere.
+    for chunk_size in range(1, len(data) + 2):
+        assert read(data, chunk_size) == expected, chunk_size
+
+
+@pytest.mark.parametrize('document', ['{"citizens": [1, 23', '{"citizens": ',
+                                      '{"citizens": [1] 2}', '[1, 2]',
+                                      '{"citizens": [1]} x',
+                                      '{"citizens": [1,]}', ''])
+def test_broken_documents(document):
+    for chunk_size in [1, 2, 3, 64]:
+        with pytest.raises(ValueError):
+            read(document.encode(), chunk_size)
+
+
+@pytest.mark.parametrize('document', ['{}', '{"people": []}',
+                                      '{"citizens": {"a": 1}}'])
+def test_documents_without_citizens(document):
+    with pytest.raises(NoCitizensError):
+        read(document.encode(), 2)
+
+
+def test_empty_citizens():
+    assert read(b' { "citizens" : [ ] } \n', 1) == []
+
+
+def test_hash_of_the_read_body():
+    data = DOCUMENT.encode()
+    stream = HashingStream(io.BytesIO(data))
+    list(iter_citizens(stream, 5))
+    assert stream.digest() == body_hash(data)
@@ -0,0 +1,81 @@
+import logging
+import re
+import sqlite3
+
+import pytest
+
+import metrics
+from conftest import post_import
+from generator import generate_import
+
+
+ROUTE = 'route="/imports/<int:import_id>/birthdays"'
+
+
+def sample(text, name, labels):
+    '''Value of the metric line with the name and all the labels.'''
+
+    for line in text.splitlines():
+        match = re.fullmatch(r'(\w+)\{(.*)\} (\S+)', line)
+        if match and match.group(1) == name and\
+                all(label in match.group(2).split(',') for label in labels):
+            return float(match.group(3))
+    return 0
+
+
+def test_requests_are_in_the_metrics(client):
+    import_id = post_import(client, generate_import(citizens=20)['citizens'])
+    labels = ['method="GET"', ROUTE, 'status="200"']
+
+    before = client.get('/metrics').get_data(as_text=True)
+    # Statistics are added when the answer is closed.
+    client.get(f'/imports/{import_id}/birthdays').close()
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert '# TYPE sql_queries_total counter' in text
+    for name in ['http_request_duration_seconds_count',
+                 'http_request_sql_queries_count']:
+        assert sample(text, name, labels[1:2]) ==\
+            sample(before, name, labels[1:2]) + 1
+    assert sample(text, 'http_request_duration_seconds_bucket',
+                  labels + ['le="+Inf"']) ==\
+        sample(text, 'http_request_duration_seconds_count', labels)
+    assert sample(text, 'http_request_duration_seconds_sum', labels) > 0
+    assert sample(text, 'sql_queries_total', [ROUTE]) >\
+        sample(before, 'sql_queries_total', [ROUTE])
+
+
+def request_stats(seconds):
+    '''Statistics of a request with one statement, started `seconds`
+    ago.'''
+
+    stats = metrics.RequestStats()
+    stats.start -= seconds
+    stats.status = 200
+    statement = stats.statements['SELECT * FROM citizens WHERE town = ?']
+    statement.count = 1
+    statement.seconds = seconds
+    statement.params = ('Москва',)
+    return stats
+
+
+@pytest.mark.parametrize('slow_seconds, slow', [(0, False), (5, False),
+                                                (0.5, True)])
+def test_only_slow_requests_are_explained(caplog, slow_seconds, slow):
+    connections = []
+
+    def connect():
+        connection = sqlite3.connect(':memory:')
+        connection.execute('''CREATE TABLE citizens (town TEXT)''')
+        connections.append(connection)
+        return connection
+
+    with caplog.at_level(logging.WARNING, logger='slow_requests'):
+        metrics.observe_request('GET', '/slow', request_stats(1),
+                                slow_seconds, connect)
+    assert bool(connections) == slow
+    assert ('SCAN citizens' in caplog.text) == slow
+    assert ('GET /slow 200 took' in caplog.text) == slow
@@ -0,0 +1,91 @@
+import sqlite3
+
+import aggregates
+import migrations
+
+
+# Tables as the server created them before the schema had versions.
+V1_TABLES = ['''CREATE TABLE IF NOT EXISTS citizens
+                (import_id INTEGER,
+                 citizen_id INTEGER,
+                 town TEXT,
+                 street TEXT,
+                 building TEXT,
+                 apartment INTEGER,
+                 name TEXT,
+                 birth_date TEXT,
+                 gender TEXT)''',
+             '''CREATE TABLE IF NOT EXISTS relatives
+                (import_id INTEGER,
+                 citizen_id INTEGER,
+                 relative INTEGER)''']
+
+CITIZENS = [(0, 1, 'Москва', 'Ленина', '1', 7, 'Иван', '01.04.1990', 'male'),
+            (0, 2, 'Москва', 'Ленина', '1', 7, 'Мария', '17.12.1992',
+             'female'),
+            (0, 3, 'Керчь', 'Мира', '5к1', 2, 'Олег', '26.12.1986', 'male'),
+            (1, 1, 'Самара', 'Заводская', '3', 11, 'Анна', '5.5.2005',
+             'female')]
+
+# Rows of a relation, the last one was inserted twice.
+RELATIVES = [(0, 1, 2), (0, 2, 1), (0, 2, 3), (0, 3, 2), (0, 3, 2)]
+
+
+def old_database(path):
+    '''Database with citizens written by the server before versions.'''
+
+    connection = sqlite3.connect(str(path))
+    for statement in V1_TABLES:
+        connection.execute(statement)
+    connection.executemany('''INSERT INTO citizens
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', CITIZENS)
+    connection.executemany('''INSERT INTO relatives VALUES (?, ?, ?)''',
+                           RELATIVES)
+    connection.commit()
+    return connection
+
+
+def test_old_database_is_upgraded(tmp_path):
+    connection = old_database(tmp_path / 'citizens.db')
+    assert migrations.migrate(connection) == migrations.SCHEMA_VERSION
+
+    cursor = connection.cursor()
+    assert cursor.execute('''SELECT * FROM citizens
+                             ORDER BY import_id, citizen_id''').fetchall() ==\
+        CITIZENS
+    assert cursor.execute('''SELECT * FROM relatives
+                             ORDER BY import_id, citizen_id, relative'''
+                          ).fetchall() == sorted(set(RELATIVES))
+    assert cursor.execute('''SELECT import_id FROM imports
+                             ORDER BY import_id''').fetchall() == [(0,), (1,)]
+    assert cursor.execute('''SELECT version FROM schema_version'''
+                          ).fetchall() == [(migrations.SCHEMA_VERSION,)]
+
+    # Upgraded database is left as it is.
+    assert migrations.migrate(connection) == migrations.SCHEMA_VERSION
+    assert cursor.execute('''SELECT COUNT(*) FROM citizens''').fetchone() ==\
+        (len(CITIZENS),)
+
+
+def read_aggregates(cursor):
+    presents = cursor.execute('''SELECT * FROM presents
+                                 ORDER BY import_id, month, citizen_id'''
+                              ).fetchall()
+    towns = cursor.execute('''SELECT * FROM town_births
+                              ORDER BY import_id, town''').fetchall()
+    return presents, towns
+
+
+def test_upgraded_aggregates_match_a_build(tmp_path):
+    connection = old_database(tmp_path / 'citizens.db')
+    migrations.migrate(connection)
+
+    cursor = connection.cursor()
+    upgraded = read_aggregates(cursor)
+    assert (0, 12, 1, 2) in upgraded[0] and (0, 4, 2, 2) in upgraded[0]
+
+    for table in ('presents', 'town_births'):
+        cursor.execute(f'''DELETE FROM {table}''')
+    for import_id in (0, 1):
+        aggregates.build(cursor, import_id)
+    assert read_aggregates(cursor) == upgraded
@@ -0,0 +1,69 @@
+import pytest
+
+import export
+from conftest import post_import
+from generator import generate_import
+
+
+def whole_import(main, client, cached):
+    '''Url and citizens of a new import, kept in the cache if `cached`.'''
+
+    import_id = post_import(client, generate_import(citizens=25,
+                                                    relations=30)['citizens'])
+    url = f'/imports/{import_id}/citizens'
+    citizens = client.get(url).get_json()['data']
+    if not cached:
+        with main.manager.snapshots.lock:
+            main.manager.snapshots.remove(import_id)
+    return url, citizens
+
+
+@pytest.mark.parametrize('cached', [True, False])
+def test_pages_make_up_the_import(main, client, cached):
+    url, citizens = whole_import(main, client, cached)
+
+    pages = []
+    page = client.get(f'{url}?limit=7').get_json()['data']
+    while page:
+        pages.append(page)
+        page = client.get(f'{url}?limit=7&after_citizen_id='
+                          f'{page[-1]["citizen_id"]}').get_json()['data']
+    assert [len(page) for page in pages] == [7, 7, 7, 4]
+    assert sum(pages, []) == citizens
+
+    after = citizens[2]['citizen_id']
+    page = client.get(f'{url}?after_citizen_id={after}&limit=5'
+                      '&fields=name,relatives').get_json()['data']
+    assert page == [{'name': citizen['name'],
+                     'relatives': citizen['relatives']}
+                    for citizen in citizens[3:8]]
+    page = client.get(f'{url}?fields=citizen_id,town').get_json()['data']
+    assert page == [{'citizen_id': citizen['citizen_id'],
+                     'town': citizen['town']} for citizen in citizens]
+
+
+@pytest.mark.parametrize('fields', ['name,name', 'relatives,town,name'])
+def test_hot_and_cold_pages_are_the_same(main, client, fields):
+    url, citizens = whole_import(main, client, True)
+    query = f'{url}?after_citizen_id=2&limit=10&fields={fields}'
+    headers = {'Accept': export.COLUMNS_MIMETYPE}
+
+    hot = client.get(query, headers=headers).data
+    with main.manager.snapshots.lock:
+        main.manager.snapshots.remove(int(url.split('/')[2]))
+    cold = client.get(query, headers=headers).data
+    assert hot == cold
+
+    # Fields are given once each in the order of the table.
+    names = [name for name in ['town', 'name', 'relatives']
+             if name in fields]
+    assert export.decode_columns(cold) == [
+        {name: citizen[name] for name in names} for citizen in citizens
+        if citizen['citizen_id'] > 2][:10]
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=x', 'after_citizen_id=-1',
+                                   'fields=name,,town', 'fields=age'])
+def test_wrong_arguments(main, client, query):
+    url, _ = whole_import(main, client, True)
+    assert client.get(f'{url}?{query}').status_code == 400
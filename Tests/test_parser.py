@@ -0,0 +1,96 @@
+import random
+
+import pytest
+
+from generator import generate_import
+
+
+def citizens_with(relatives):
+    '''Citizens 1-4 with the given relatives, others have none.'''
+
+    citizens = generate_import(citizens=4, relations=0)['citizens']
+    for citizen in citizens:
+        citizen['relatives'] = relatives.get(citizen['citizen_id'], [])
+    return citizens
+
+
+# Relatives and citizens reported in the strict mode.
+WRONG = {
+    'one-sided': ({1: [2, 3], 2: [1]}, '1, 3'),
+    'missing': ({1: [2, 9], 2: [1]}, '1'),
+    'self': ({1: [2], 2: [1], 4: [4]}, '4'),
+}
+
+
+@pytest.mark.parametrize('strict', [True, False])
+@pytest.mark.parametrize('kind', list(WRONG))
+def test_wrong_relations(main, client, monkeypatch, strict, kind):
+    relatives, wrong = WRONG[kind]
+    monkeypatch.setattr(main.parser, 'STRICT_RELATIVES', strict)
+
+    response = client.post('/imports', json={
+        'citizens': citizens_with(relatives)})
+    if strict:
+        assert response.status_code == 400
+        assert response.get_json()['message'] ==\
+            main.parser.RELATIONS_ERROR_MSG % wrong
+    else:
+        assert response.status_code == 201
+
+
+@pytest.mark.parametrize('strict', [True, False])
+def test_correct_and_repeated_relations(main, client, monkeypatch, strict):
+    monkeypatch.setattr(main.parser, 'STRICT_RELATIVES', strict)
+
+    response = client.post('/imports', json={
+        'citizens': citizens_with({1: [2, 3], 2: [1], 3: [1]})})
+    assert response.status_code == 201
+    response = client.post('/imports', json={
+        'citizens': citizens_with({1: [2, 2], 2: [1]})})
+    assert response.status_code == 400
+
+
+# Wrong (and some unusual but correct) values of every field.
+VALUES = {
+    'citizen_id': [-1, '1', 1.5, None, True, 2 ** 70],
+    'town': ['', '__', 100, 'x' * 257, 'null', None, ' ', '-а', 'Москва-2'],
+    'street': ['', '+-', 78, 'y' * 256, 'null', ['Ленина']],
+    'building': ['', '+-=', -1, '16к7стр5', 'z' * 300],
+    'apartment': [-190, '128', 1.0, None, 0, False],
+    'name': ['', 119, 'n' * 257, None, '++1', ' '],
+    'birth_date': ['', 119, '30.02.1901', '1986.26.12', '20-08-2019',
+                   '01.01.2999', '29.02.1900', '29.02.2000', '1.4.1990',
+                   ' 3. 2.1999', '31.04.2000', '00.01.2000', '01.13.2000',
+                   '01.01.0000', '1.1.1', None],
+    'gender': ['', 0, 'Male', 'fefemale', None],
+    'relatives': ['', None, [1, 1], ['1'], [1.5], {}, [2, 3]],
+}
+
+
+def test_compiled_check_agrees_with_the_fields_checks(main):
+    parser = main.parser
+    check = parser.compile_check()
+    citizens = generate_import(citizens=300, relations=200)['citizens']
+    for citizen in citizens:
+        assert check(citizen) is True
+        assert parser.check_citizen(citizen) is True
+
+    changed = []
+    for field, values in VALUES.items():
+        for value in values:
+            changed.append(dict(citizens[0], **{field: value}))
+        missing = dict(citizens[0])
+        del missing[field]
+        changed.append(missing)
+    changed += [dict(citizens[0], extra=1), [citizens[0]], None, 'citizen']
+
+    # Random citizens with several wrong values at once.
+    rng = random.Random(5)
+    for citizen in citizens:
+        citizen = dict(citizen)
+        for field in rng.sample(list(VALUES), rng.randint(1, 3)):
+            citizen[field] = rng.choice(VALUES[field])
+        changed.append(citizen)
+
+    for citizen in changed:
+        assert check(citizen) == parser.check_citizen(citizen), citizen
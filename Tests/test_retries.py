@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from generator import generate_import
+
+
+def body(seed=1):
+    return json.dumps(generate_import(citizens=20, seed=seed)).encode()
+
+
+def post(client, data, key=None):
+    headers = {} if key is None else {'Idempotency-Key': key}
+    response = client.post('/imports', data=data, headers=headers,
+                           content_type='application/json')
+    assert response.status_code == 201, response.data
+    return response.get_json()['data']['import_id']
+
+
+def imports(main):
+    return main.manager.cursor.execute(
+        '''SELECT COUNT(*) FROM imports''').fetchone()[0]
+
+
+def test_same_key_gets_the_same_import(main, client):
+    import_id = post(client, body(), 'retried-upload')
+    before = imports(main)
+    assert post(client, body(), 'retried-upload') == import_id
+    assert imports(main) == before
+
+    assert post(client, body(), 'other-upload') != import_id
+    response = client.post('/imports', data=body(),
+                           headers={'Idempotency-Key': 'k' * 256},
+                           content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_key_of_a_wrong_import_is_not_saved(client):
+    data = generate_import(citizens=5)
+    data['citizens'][0]['gender'] = 'unknown'
+    response = client.post('/imports', json=data,
+                           headers={'Idempotency-Key': 'wrong-upload'})
+    assert response.status_code == 400
+
+    import_id = post(client, body(), 'wrong-upload')
+    assert post(client, body(), 'wrong-upload') == import_id
+
+
+def test_key_with_another_body_is_rejected(main, client):
+    import_id = post(client, body(6), 'changed-upload')
+    before = imports(main)
+
+    response = client.post('/imports', data=body(7),
+                           headers={'Idempotency-Key': 'changed-upload'},
+                           content_type='application/json')
+    assert response.status_code == 422
+    assert imports(main) == before
+    assert post(client, body(6), 'changed-upload') == import_id
+
+    # Import of a job finding the key only when it is inserted.
+    citizens = generate_import(citizens=5, seed=7)['citizens']
+    with pytest.raises(main.KeyReusedError):
+        main.manager.insert_import(citizens, idempotency_key='changed-upload',
+                                   content_hash=lambda: b'other')
+    assert imports(main) == before
+
+
+@pytest.mark.parametrize('deduplicate', [True, False])
+def test_same_body(main, client, monkeypatch, deduplicate):
+    monkeypatch.setattr(main.manager, 'DEDUPLICATE_IMPORTS', deduplicate)
+    data = body(3)
+    import_id = post(client, data)
+    before = imports(main)
+
+    assert (post(client, data) == import_id) == deduplicate
+    assert imports(main) == before + (not deduplicate)
+    assert post(client, body(4)) != import_id
+
+
+def test_changed_import_is_not_a_duplicate(main, client, monkeypatch):
+    monkeypatch.setattr(main.manager, 'DEDUPLICATE_IMPORTS', True)
+    data = body(5)
+    import_id = post(client, data)
+    assert post(client, data) == import_id
+
+    response = client.post(f'/imports/{import_id}/citizens/1',
+                           json={'name': 'Другое имя'})
+    assert response.status_code == 200
+    hashes = main.manager.cursor.execute(
+        '''SELECT content_hash FROM imports WHERE import_id = ?''',
+        (import_id,)).fetchone()
+    assert hashes == (None,)
+    assert post(client, data) != import_id
@@ -0,0 +1,161 @@
+import pytest
+
+from conftest import post_import
+from generator import generate_import
+from snapshot_cache import SnapshotCache
+
+
+STATISTICS = ['birthdays', 'towns/stat/percentile/age']
+
+
+class Snapshot:
+    '''Snapshot of the given size without data.'''
+
+    def __init__(self, import_id, version, size):
+        self.import_id = import_id
+        self.version = version
+        self.size = size
+
+
+def test_least_recently_used_snapshots_are_evicted():
+    cache = SnapshotCache(100)
+    for import_id in range(3):
+        cache.put(Snapshot(import_id, 0, 40))
+    assert list(cache.snapshots) == [1, 2] and cache.size == 80
+
+    assert cache.get(1, 0) is not None
+    cache.put(Snapshot(3, 0, 40))
+    assert list(cache.snapshots) == [1, 3]
+
+    # Other versions and too big snapshots are not returned.
+    assert cache.get(1, 1) is None
+    cache.put(Snapshot(4, 0, 101))
+    assert list(cache.snapshots) == [1, 3] and cache.get(4, 0) is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 2, 2)
+    assert stats['bytes'] == 80
+
+
+@pytest.mark.parametrize('route', STATISTICS)
+def test_statistics_do_not_load_the_import(main, client, route):
+    import_id = post_import(client, generate_import(citizens=50)['citizens'])
+    snapshots = main.manager.snapshots
+    with snapshots.lock:
+        snapshots.remove(import_id)
+
+    assert client.get(f'/imports/{import_id}/{route}').status_code == 200
+    assert import_id not in snapshots.snapshots
+
+
+def test_too_big_import_is_read_once_per_version(main, client, monkeypatch):
+    citizens = generate_import(citizens=300, relations=100)['citizens']
+    import_id = post_import(client, citizens)
+    manager = main.manager
+    monkeypatch.setattr(manager.snapshots, 'max_bytes', 1024)
+
+    loads = []
+    load_snapshot = manager.load_snapshot
+    monkeypatch.setattr(manager, 'load_snapshot', lambda import_id: (
+        loads.append(import_id), load_snapshot(import_id))[1])
+
+    url = f'/imports/{import_id}/citizens'
+    first = client.get(url).get_json()
+    assert client.get(url).get_json() == first
+    assert len(first['data']) == 300
+    assert loads == [import_id]
+
+    response = client.post(f'{url}/1', json={'name': 'Другое имя'})
+    assert response.status_code == 200
+    client.get(url).get_data()
+    assert loads == [import_id, import_id]
+
+
+def cached_bytes(snapshots):
+    with snapshots.lock:
+        return sum(snapshot.size for snapshot in snapshots.snapshots.values())
+
+
+@pytest.mark.parametrize('route', STATISTICS)
+def test_saved_answers_count_in_the_budget(main, client, route):
+    import_id = post_import(client, generate_import(citizens=200)['citizens'])
+    url = f'/imports/{import_id}'
+    snapshots = main.manager.snapshots
+    client.get(f'{url}/citizens').get_data()
+
+    snapshot = snapshots.snapshots[import_id]
+    columns = snapshot.data.size
+    answer = client.get(f'{url}/{route}')
+    assert snapshot.size == columns + len(answer.get_data())
+    assert snapshots.size == cached_bytes(snapshots)
+    assert client.get(f'{url}/{route}').get_data() == answer.get_data()
+
+    # Answer which does not fit into the budget is not saved.
+    client.post(f'{url}/citizens/1', json={'name': 'Другое имя'})
+    snapshot = snapshots.snapshots[import_id]
+    assert snapshot.size == snapshot.data.size
+    limit = snapshots.max_bytes
+    snapshots.max_bytes = snapshot.size + 10
+    try:
+        assert client.get(f'{url}/{route}').status_code == 200
+        assert snapshot.size == snapshot.data.size
+        assert snapshots.size == cached_bytes(snapshots)
+    finally:
+        snapshots.max_bytes = limit
+
+
+def test_patch_does_not_change_a_snapshot_being_read(main, client):
+    citizens = generate_import(citizens=40, relations=0)['citizens']
+    citizens[0]['relatives'] = [2]
+    citizens[1]['relatives'] = [1]
+    import_id = post_import(client, citizens)
+    url = f'/imports/{import_id}/citizens'
+    before = client.get(url).get_json()['data']
+
+    snapshots = main.manager.snapshots
+    old = snapshots.snapshots[import_id]
+    reading = old.iter_citizens()
+    first = next(reading)
+
+    response = client.patch(url, json={'citizens': [
+        {'citizen_id': 1, 'relatives': [3]},
+        {'citizen_id': 5, 'name': 'Новое имя'}]})
+    assert response.status_code == 200
+
+    assert [first] + list(reading) == before
+    assert list(old.iter_citizens()) == before
+
+    new = snapshots.snapshots[import_id]
+    assert new is not old
+    relatives = {citizen['citizen_id']: citizen['relatives']
+                 for citizen in new.iter_citizens()}
+    assert relatives[1] == [3] and relatives[3] == [1] and relatives[2] == []
+    assert client.get(url).get_json()['data'] == list(new.iter_citizens())
+
+
+def test_many_patches_merge_relations_of_the_copy(main, client,
+                                                  monkeypatch):
+    import columnar
+    monkeypatch.setattr(columnar, 'MAX_CHANGED_ROWS', 16)
+    citizens = generate_import(citizens=300, relations=200, seed=3)
+    import_id = post_import(client, citizens['citizens'])
+    url = f'/imports/{import_id}/citizens'
+    client.get(url).get_data()
+    old = main.manager.snapshots.snapshots[import_id]
+    before = list(old.iter_citizens())
+
+    # More changed rows than are kept aside before merging.
+    changes = [{'citizen_id': citizen_id, 'relatives': []}
+               for citizen_id in range(1, 301)]
+    assert client.patch(url, json={'citizens': changes}).status_code == 200
+    changes = [{'citizen_id': citizen_id, 'relatives': [citizen_id + 1]}
+               for citizen_id in range(1, 300, 2)]
+    assert client.patch(url, json={'citizens': changes}).status_code == 200
+    assert list(old.iter_citizens()) == before
+
+    # Same citizens are read from the database.
+    cached = client.get(url).get_json()['data']
+    monkeypatch.setattr(main.manager.snapshots, 'max_bytes', 0)
+    with main.manager.snapshots.lock:
+        main.manager.snapshots.remove(import_id)
+    assert client.get(url).get_json()['data'] == cached
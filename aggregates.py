@@ -0,0 +1,250 @@
+'''Per-import aggregates for the statistics endpoints.
+
+The aggregates are built once when an import is uploaded and then only
+corrected for the changed citizen on every update:
+
+- presents: number of presents each citizen buys in each month
+- town_births: sorted birth date keys of citizens of every town
+- age_stats: age percentiles answer, valid for one calendar day
+'''
+
+import json
+from collections import Counter
+
+import numpy as np
+
+import queries
+from analytics import (birth_months, count_presents, date_keys,
+                       town_age_percentiles, town_birth_keys)
+
+
+# Birth date keys are stored as little-endian int64 blobs.
+KEYS_DTYPE = '<i8'
+
+
+def build(cursor, import_id):
+    '''Compute all aggregates of the import from scratch.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+    '''
+
+    citizens = cursor.execute(queries.CITIZEN_BIRTHS,
+                              (import_id,)).fetchall()
+    pairs = cursor.execute(queries.RELATION_ROWS, (import_id,)).fetchall()
+
+    ids = [citizen[0] for citizen in citizens]
+    towns = [citizen[1] for citizen in citizens]
+    dates = [citizen[2] for citizen in citizens]
+
+    months, givers, counts = count_presents(ids, dates, pairs)
+    cursor.executemany(queries.INSERT_PRESENTS,
+                       [(import_id, month, giver, count) for
+                        month, giver, count in zip(months.tolist(),
+                                                   givers.tolist(),
+                                                   counts.tolist())])
+
+    names, first, keys = town_birth_keys(towns, dates)
+    cursor.executemany(queries.INSERT_TOWN_BIRTHS,
+                       [(import_id, town, ids[index],
+                         town_keys.astype(KEYS_DTYPE).tobytes())
+                        for town, index, town_keys in zip(names, first, keys)])
+
+
+def citizen_presents(cursor, import_id, citizen_id):
+    '''Presents counted from relation rows of one citizen.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        citizen_id (int): id of a citizen
+
+    Returns:
+        presents: Counter (month, giver) -> number of presents
+    '''
+
+    params = (import_id, citizen_id, import_id, citizen_id)
+    pairs = cursor.execute(queries.CITIZEN_RELATION_ROWS, params).fetchall()
+
+    people = {citizen_id}
+    for pair in pairs:
+        people.update(pair)
+    people = list(people)
+
+    rows = cursor.execute(queries.BIRTH_DATES,
+                          (import_id, json.dumps(people))).fetchall()
+    months = dict(zip([row[0] for row in rows],
+                      birth_months([row[1] for row in rows]).tolist()))
+
+    # Each pair is counted from both sides.
+    presents = Counter()
+    for first, second in pairs:
+        for giver, taker in [(first, second), (second, first)]:
+            if taker in months:
+                presents[(months[taker], giver)] += 1
+
+    return presents
+
+
+def add_presents(cursor, import_id, presents, sign=1):
+    '''Add (or subtract with `sign` = -1) presents to the aggregate.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        presents: Counter (month, giver) -> number of presents
+        sign (int): 1 to add presents, -1 to subtract them
+    '''
+
+    keys = [(import_id, month, giver) for month, giver in presents]
+    cursor.executemany(queries.ADD_PRESENTS_KEY, keys)
+    cursor.executemany(queries.ADD_PRESENTS,
+                       [(sign * presents[key[1:]],) + key for key in keys])
+    cursor.executemany(queries.DELETE_NO_PRESENTS, keys)
+
+
+def move_birth(cursor, import_id, citizen_id, sign=1):
+    '''Add (or remove with `sign` = -1) citizen's birth date to its town.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        citizen_id (int): id of a citizen
+        sign (int): 1 to add the birth date, -1 to remove it
+    '''
+
+    town, birth_date = cursor.execute(queries.CITIZEN_BIRTH,
+                                      (import_id, citizen_id)).fetchone()
+    key = int(date_keys([birth_date])[0])
+
+    row = cursor.execute(queries.SELECT_TOWN_BIRTHS,
+                         (import_id, town)).fetchone()
+    keys = np.frombuffer(row[0], dtype=KEYS_DTYPE) if row is not None\
+        else np.zeros(0, dtype=KEYS_DTYPE)
+
+    position = np.searchsorted(keys, key)
+    if sign > 0:
+        keys = np.insert(keys, position, key)
+    else:
+        keys = np.delete(keys, position)
+
+    if row is None:
+        cursor.execute(queries.INSERT_TOWN_BIRTHS,
+                       (import_id, town, citizen_id, keys.tobytes()))
+    elif len(keys):
+        cursor.execute(queries.UPDATE_TOWN_BIRTHS,
+                       (keys.tobytes(), import_id, town))
+    else:
+        cursor.execute(queries.DELETE_TOWN_BIRTHS, (import_id, town))
+
+
+def exclude_citizen(cursor, import_id, citizen_id, presents=True,
+                    births=True):
+    '''Remove everything the citizen adds to the aggregates.
+
+    Call it before the citizen or its relatives are changed and
+    `include_citizen` after the change.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        citizen_id (int): id of a citizen
+        presents (bool): remove presents of the citizen and its relatives
+        births (bool): remove the birth date from its town
+    '''
+
+    if presents:
+        add_presents(cursor, import_id,
+                     citizen_presents(cursor, import_id, citizen_id), -1)
+    if births:
+        move_birth(cursor, import_id, citizen_id, -1)
+        cursor.execute(queries.DELETE_AGE_STATS, (import_id,))
+
+
+def include_citizen(cursor, import_id, citizen_id, presents=True,
+                    births=True):
+    '''Add everything the citizen adds to the aggregates.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        citizen_id (int): id of a citizen
+        presents (bool): add presents of the citizen and its relatives
+        births (bool): add the birth date to its town
+    '''
+
+    if presents:
+        add_presents(cursor, import_id,
+                     citizen_presents(cursor, import_id, citizen_id))
+    if births:
+        move_birth(cursor, import_id, citizen_id)
+
+
+def read_presents(cursor, import_id):
+    '''Presents of the import.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+
+    Returns:
+        presents: (month, citizen_id, presents) rows ordered
+        by month and citizen_id
+    '''
+
+    return cursor.execute(queries.SELECT_PRESENTS, (import_id,))
+
+
+def cached_age_percentiles(cursor, import_id, today):
+    '''Age percentiles of the import saved earlier the same day.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        today (datetime.date): date to count ages on
+
+    Returns:
+        answer: list of {'town': ..., 'p50': ..., ...} for every town
+        or None if there is no answer for this day
+    '''
+
+    row = cursor.execute(queries.SELECT_AGE_STATS,
+                         (import_id, today.isoformat())).fetchone()
+
+    return json.loads(row[0]) if row is not None else None
+
+
+def age_percentiles(cursor, import_id, today):
+    '''Age percentiles of the import from sorted birth dates of towns.
+
+    Args:
+        cursor: cursor of the database
+        import_id (int): id of an import
+        today (datetime.date): date to count ages on
+
+    Returns:
+        answer: list of {'town': ..., 'p50': ..., ...} for every town
+    '''
+
+    rows = cursor.execute(queries.IMPORT_TOWN_BIRTHS,
+                          (import_id,)).fetchall()
+
+    return town_age_percentiles(
+        [row[0] for row in rows],
+        [np.frombuffer(row[1], dtype=KEYS_DTYPE) for row in rows],
+        today)
+
+
+def cache_age_percentiles(cursor, import_id, today, answer):
+    '''Save age percentiles of the import for the day.
+
+    Args:
+        cursor: cursor of a write transaction
+        import_id (int): id of an import
+        today (datetime.date): date the ages were counted on
+        answer: age percentiles of the import
+    '''
+
+    cursor.execute(queries.SAVE_AGE_STATS,
+                   (import_id, today.isoformat(), json.dumps(answer)))
@@ -0,0 +1,231 @@
+'''Array-based computations for the statistics endpoints.
+
+Dates are handled as `yyyymmdd` integers (date keys): their order
+is the order of the dates and the number of full years between two
+dates is simply `(later - earlier) // 10000`.
+'''
+
+from calendar import isleap
+
+import numpy as np
+
+
+PERCENTILES = (50, 75, 99)
+
+
+def date_keys(dates):
+    '''Convert dates in dd.mm.yyyy format to date keys.
+
+    Day and month may also be written without a leading zero (or with
+    a space instead of it), as `strptime` accepts them.
+
+    Args:
+        dates: sequence of date strings
+
+    Returns:
+        keys: int64 array of yyyymmdd values
+    '''
+
+    # Every character becomes its own uint32 code point.
+    text = np.array(dates, dtype='U10')
+    digits = text.view(np.uint32).reshape(-1, 10)
+    digits = digits.astype(np.int64) - ord('0')
+
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 3] * 10 + digits[:, 4]
+    year = (digits[:, 6] * 1000 + digits[:, 7] * 100 +
+            digits[:, 8] * 10 + digits[:, 9])
+    keys = year * 10000 + month * 100 + day
+
+    # Dates which are not zero-padded are split by their dots.
+    positions = digits[:, [0, 1, 3, 4, 6, 7, 8, 9]]
+    unpadded = ~((positions >= 0) & (positions <= 9)).all(axis=1)
+    for index in np.flatnonzero(unpadded).tolist():
+        day, month, year = str(text[index]).split('.')
+        keys[index] = int(year) * 10000 + int(month) * 100 + int(day)
+
+    return keys
+
+
+def birth_months(dates):
+    '''Months (1-12) of dates in the formats of `date_keys`.'''
+
+    return date_keys(dates) // 100 % 100
+
+
+def date_key(date):
+    '''Date key of a `datetime.date`.'''
+
+    return date.year * 10000 + date.month * 100 + date.day
+
+
+def ages(keys, today):
+    '''Full years from the dates to `today`.
+
+    Args:
+        keys: date keys of birthdays
+        today (datetime.date): date to count ages on
+
+    Returns:
+        ages: int64 array of ages
+    '''
+
+    today_key = date_key(today)
+
+    # In a non-leap year people born on the 29th of February
+    # become a year older on the 28th (as relativedelta counts).
+    if (today.month, today.day) == (2, 28) and not isleap(today.year):
+        today_key += 1
+
+    return (today_key - np.asarray(keys, dtype=np.int64)) // 10000
+
+
+def count_presents(citizen_ids, birth_dates, pairs):
+    '''Number of presents every citizen buys in each month.
+
+    Every relation pair (citizen, relative) makes the citizen buy a
+    present in the month of the relative's birthday and vice versa.
+    Pairs whose taker is not among the citizens are skipped.
+
+    Args:
+        citizen_ids: ids of the citizens
+        birth_dates: birth date (dd.mm.yyyy) of every citizen
+        pairs: sequence of (citizen_id, relative) pairs
+
+    Returns:
+        months, givers, presents: int64 arrays sorted by month and giver
+    '''
+
+    citizen_ids = np.asarray(citizen_ids, dtype=np.int64)
+    order = np.argsort(citizen_ids)
+    citizen_ids = citizen_ids[order]
+    taker_months = birth_months(birth_dates)[order]
+
+    # Each pair is counted from both sides.
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    givers = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    takers = np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+    # Find the month of each taker's birthday.
+    positions = np.searchsorted(citizen_ids, takers)
+    positions = np.minimum(positions, max(len(citizen_ids) - 1, 0))
+    known = citizen_ids[positions] == takers if len(citizen_ids) else\
+        np.zeros(len(takers), dtype=bool)
+    givers = givers[known]
+    months = taker_months[positions[known]]
+
+    # Count equal (month, giver) pairs after sorting.
+    order = np.lexsort((givers, months))
+    months = months[order]
+    givers = givers[order]
+    starts = np.flatnonzero(np.concatenate([
+        [True], (months[1:] != months[:-1]) | (givers[1:] != givers[:-1])
+    ])) if len(months) else np.zeros(0, dtype=np.int64)
+    presents = np.diff(np.append(starts, len(months)))
+
+    return months[starts], givers[starts], presents
+
+
+def group_percentiles(values, starts, counts, percentile):
+    '''Linear percentile of each group of the sorted values.
+
+    Matches `np.percentile(group, percentile)` for every group.
+
+    Args:
+        values: values sorted inside every group
+        starts: index of the first value of each group
+        counts: number of values in each group (at least 1)
+        percentile (float): percentile to compute
+
+    Returns:
+        result: float64 array with a percentile per group
+    '''
+
+    virtual = (counts - 1) * np.true_divide(percentile, 100)
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+
+    previous = previous.astype(np.int64)
+    following = previous + 1
+
+    # Percentile falls on the last value.
+    last = virtual >= counts - 1
+    previous[last] = counts[last] - 1
+    following[last] = counts[last] - 1
+
+    below = values[starts + previous]
+    above = values[starts + following]
+
+    # Same interpolation as numpy does.
+    diff = above - below
+    result = below + diff * gamma
+    return np.where(gamma >= 0.5, above - diff * (1 - gamma), result)
+
+
+def town_birth_keys(towns, birth_dates):
+    '''Sorted birth date keys of citizens of every town.
+
+    Args:
+        towns: town of every citizen
+        birth_dates: birth date (dd.mm.yyyy) of every citizen
+
+    Returns:
+        names: towns in order of their first appearance
+        first: index of the first citizen of every town
+        keys: sorted int64 array of birth date keys for every town
+    '''
+
+    if len(towns) == 0:
+        return [], [], []
+
+    names, first, groups = np.unique(np.array(towns, dtype=object),
+                                     return_index=True, return_inverse=True)
+    groups = groups.reshape(-1)
+    birth_keys = date_keys(birth_dates)
+
+    # Sort by town, then by birth date inside each town.
+    order = np.lexsort((birth_keys, groups))
+    bounds = np.cumsum(np.bincount(groups, minlength=len(names)))
+    keys = np.split(birth_keys[order], bounds[:-1])
+
+    towns_order = np.argsort(first, kind='stable')
+    return ([names[town] for town in towns_order],
+            [int(first[town]) for town in towns_order],
+            [keys[town] for town in towns_order])
+
+
+def town_age_percentiles(towns, keys, today, percentiles=PERCENTILES):
+    '''Age percentiles for each town.
+
+    Args:
+        towns: names of towns
+        keys: sorted non-empty array of birth date keys for every town
+        today (datetime.date): date to count ages on
+        percentiles: percentiles to compute
+
+    Returns:
+        answer: list of {'town': ..., 'p50': ..., ...} for every town
+    '''
+
+    if len(towns) == 0:
+        return []
+
+    counts = np.array([len(town_keys) for town_keys in keys], dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+
+    # The latest birth date is the youngest age.
+    citizen_ages = ages(np.concatenate([town_keys[::-1]
+                                        for town_keys in keys]), today)
+
+    values = np.column_stack([
+        np.round(group_percentiles(citizen_ages, starts, counts, p), 2)
+        for p in percentiles])
+
+    answer = []
+    for town, town_values in zip(towns, values.tolist()):
+        town_output = {'town': town}
+        for p, value in zip(percentiles, town_values):
+            town_output['p%d' % p] = value
+        answer.append(town_output)
+
+    return answer
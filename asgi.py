@@ -0,0 +1,200 @@
+'''Serving the API from asyncio with an ASGI server.
+
+`uvicorn --workers 4 asgi:app` answers the same routes with the same
+responses as `main.app`. Connections and request bodies are read by
+the event loop, a thread of `executor` is taken only when the whole
+request is there: it runs the Flask view (checks and SQL_Manager calls)
+and hands pieces of the response to the loop, which sends them. A
+request keeps its thread until its response is produced, because read
+connections of the pool and contexts of streamed responses belong to
+one thread.
+'''
+
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import app as flask_app
+
+
+# Number of threads doing database work in every process.
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 8))
+
+# Pieces of a response produced but not sent yet, a thread producing
+# a response for a slow client waits when there are more.
+MAX_PENDING_CHUNKS = 4
+
+executor = ThreadPoolExecutor(ASGI_THREADS, thread_name_prefix='asgi')
+
+
+class Disconnected(Exception):
+    '''Client is gone, the response is not needed.'''
+
+
+async def read_body(receive):
+    '''Read the whole body of a request.
+
+    Returns:
+        body (bytes): body of the request
+
+    Raises:
+        Disconnected: the client closed the connection
+    '''
+
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            raise Disconnected()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def build_environ(scope, body):
+    '''WSGI environment of an ASGI http request.
+
+    Args:
+        scope (dict): ASGI scope of the request
+        body (bytes): whole body of the request
+
+    Returns:
+        environ (dict): environment for the Flask application
+    '''
+
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        if name != 'CONTENT_TYPE':
+            name = 'HTTP_' + name
+        environ[name] = environ[name] + ',' + value if name in environ\
+            else value
+
+    return environ
+
+
+def produce(environ, loop, queue, pending, cancelled):
+    '''Run the Flask application and pass its response to the loop.
+
+    Runs in a thread of `executor`. The status and headers are passed
+    first, then pieces of the body and None at the end.
+
+    Args:
+        environ (dict): WSGI environment of the request
+        loop: event loop sending the response
+        queue: asyncio queue of the loop to put pieces into
+        pending: semaphore limiting pieces which are not sent yet
+        cancelled: event set when the client is gone
+    '''
+
+    def put(item):
+        pending.acquire()
+        if cancelled.is_set():
+            raise Disconnected()
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def start_response(status, headers, exc_info=None):
+        put((int(status.split(' ', 1)[0]), headers))
+
+    try:
+        body = flask_app.wsgi_app(environ, start_response)
+        try:
+            for chunk in body:
+                if chunk:
+                    put(chunk)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    except Disconnected:
+        return
+    finally:
+        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+
+async def send_response(scope, receive, send):
+    '''Answer an http request.'''
+
+    try:
+        body = await read_body(receive)
+    except Disconnected:
+        return
+
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    pending = threading.Semaphore(MAX_PENDING_CHUNKS)
+    cancelled = threading.Event()
+    done = loop.run_in_executor(executor, produce,
+                                build_environ(scope, body), loop, queue,
+                                pending, cancelled)
+
+    try:
+        started = False
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            pending.release()
+
+            if not started:
+                status, headers = item
+                await send({'type': 'http.response.start',
+                            'status': status,
+                            'headers': [(name.lower().encode('latin-1'),
+                                         value.encode('latin-1'))
+                                        for name, value in headers]})
+                started = True
+            else:
+                await send({'type': 'http.response.body', 'body': item,
+                            'more_body': True})
+
+        if started:
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        # Let the thread finish if the response was not sent to the end.
+        cancelled.set()
+        for _ in range(MAX_PENDING_CHUNKS):
+            pending.release()
+        await done
+
+
+async def app(scope, receive, send):
+    '''ASGI application of the service.'''
+
+    if scope['type'] == 'http':
+        await send_response(scope, receive, send)
+
+    elif scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
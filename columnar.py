@@ -0,0 +1,443 @@
+'''Columnar representation of an import in memory.
+
+Every field of the citizens is kept in its own column: integers in numpy
+arrays, repeated strings (towns, streets, buildings, birth dates) as
+codes into tables of distinct strings, and relatives as a CSR adjacency
+(relatives of the citizen in row `i` are
+`targets[offsets[i]:offsets[i + 1]]`). Citizens are stored in the
+order of citizen_id, the row of a citizen is found by binary search.
+'''
+
+import copy
+import sys
+from array import array
+
+import numpy as np
+
+
+GENDERS = ('female', 'male')
+
+# Fields stored as codes into tables of distinct strings.
+INTERNED_FIELDS = ('town', 'street', 'building', 'birth_date')
+
+# Changed citizens and relatives are kept aside and merged into the arrays
+# when there are more of them.
+MAX_CHANGED_ROWS = 1024
+
+
+def wrong_relations(citizen_ids, pairs_from, pairs_to, strict=True):
+    '''Citizens with wrong relatives in a whole import.
+
+    Relations are sorted once and checked with vector operations
+    instead of a set per citizen.
+
+    Args:
+        citizen_ids: int64 array of distinct ids of all citizens
+        pairs_from: int64 array of citizens of the relations
+        pairs_to: int64 array of relatives of the relations
+        strict (bool): besides repeated relatives look for relatives
+            which are not in the import, citizens related to themselves
+            and relations given from one side only
+
+    Returns:
+        citizen_ids: sorted int64 array of citizens with wrong
+        relatives, both sides of one-sided relations are included
+    '''
+
+    order = np.lexsort((pairs_to, pairs_from))
+    pairs_from = pairs_from[order]
+    pairs_to = pairs_to[order]
+
+    # Repeated relatives are neighbours after sorting.
+    repeated = (pairs_from[1:] == pairs_from[:-1]) &\
+        (pairs_to[1:] == pairs_to[:-1])
+    wrong = [pairs_from[1:][repeated]]
+
+    if strict and len(pairs_from):
+        citizen_ids = np.sort(citizen_ids)
+        wrong.append(pairs_from[pairs_from == pairs_to])
+
+        rows_to = np.searchsorted(citizen_ids, pairs_to)
+        known = rows_to < len(citizen_ids)
+        known[known] = citizen_ids[rows_to[known]] == pairs_to[known]
+        wrong.append(pairs_from[~known])
+
+        # Every relation as one sorted key of (row, relative row), the
+        # reverse key must be there too.
+        rows_from = np.searchsorted(citizen_ids, pairs_from[known])
+        rows_to = rows_to[known]
+        keys = rows_from * len(citizen_ids) + rows_to
+        reverse = rows_to * len(citizen_ids) + rows_from
+        positions = np.minimum(np.searchsorted(keys, reverse), len(keys) - 1)
+        one_sided = keys[positions] != reverse
+        wrong.append(pairs_from[known][one_sided])
+        wrong.append(pairs_to[known][one_sided])
+
+    return np.unique(np.concatenate(wrong))
+
+
+class StringTable:
+    '''Distinct strings of a column, every string is stored once.'''
+
+    def __init__(self):
+        '''Initialize table instance.'''
+
+        self.strings = []
+        self.codes = {}
+        self.size = sys.getsizeof(self.strings) + sys.getsizeof(self.codes)
+
+    def code(self, string):
+        '''Code of the string, new strings are added to the table.'''
+
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+            # String, list and dict entries.
+            self.size += sys.getsizeof(string) + 8 + 100
+        return code
+
+    def copy(self):
+        '''Table with the same strings which can be changed separately.'''
+
+        table = copy.copy(self)
+        table.strings = list(self.strings)
+        table.codes = dict(self.codes)
+        return table
+
+
+class Relations:
+    '''Relatives of all citizens as a CSR adjacency.'''
+
+    def __init__(self, offsets, targets):
+        '''Initialize relations instance.
+
+        Args:
+            offsets: int64 array, relatives of row `i` are
+                `targets[offsets[i]:offsets[i + 1]]`
+            targets: int64 array of citizen ids sorted within every row
+        '''
+
+        self.offsets = offsets
+        self.targets = targets
+        self.changed = {}
+
+    @classmethod
+    def from_pairs(cls, citizen_ids, pairs_from, pairs_to):
+        '''Build relations from (citizen_id, relative) pairs.
+
+        Args:
+            citizen_ids: sorted int64 array of citizen ids
+            pairs_from: int64 array of citizen ids of the pairs
+            pairs_to: int64 array of relatives of the pairs, the pairs
+                are sorted by citizen and relative
+
+        Returns:
+            relations: relations of the citizens, pairs of citizens
+            which are not in `citizen_ids` are dropped
+        '''
+
+        rows = np.searchsorted(citizen_ids, pairs_from)
+        known = rows < len(citizen_ids)
+        known[known] = citizen_ids[rows[known]] == pairs_from[known]
+
+        counts = np.bincount(rows[known], minlength=len(citizen_ids))
+        offsets = np.zeros(len(citizen_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(offsets, pairs_to[known].astype(np.int64))
+
+    def copy(self):
+        '''Relations which can be changed separately.
+
+        The arrays are shared, they are only ever replaced.
+        '''
+
+        relations = Relations(self.offsets, self.targets)
+        relations.changed = dict(self.changed)
+        return relations
+
+    @property
+    def size(self):
+        '''Approximate number of bytes taken by the relations.'''
+
+        return self.offsets.nbytes + self.targets.nbytes +\
+            sys.getsizeof(self.changed) +\
+            sum(sys.getsizeof(relatives) + 8 * len(relatives)
+                for relatives in self.changed.values())
+
+    def get(self, row):
+        '''Relatives of the citizen in the row.
+
+        Returns:
+            relatives: sorted list of citizen ids
+        '''
+
+        relatives = self.changed.get(row)
+        if relatives is not None:
+            return list(relatives)
+        return self.targets[self.offsets[row]:self.offsets[row + 1]]\
+            .tolist()
+
+    def get_many(self, start, stop):
+        '''Relatives of citizens in rows from `start` to `stop`.
+
+        Returns:
+            relatives: list of sorted lists of citizen ids
+        '''
+
+        offsets = (self.offsets[start:stop + 1] -
+                   self.offsets[start]).tolist()
+        targets = self.targets[self.offsets[start]:self.offsets[stop]]\
+            .tolist()
+
+        relatives = [targets[offsets[i]:offsets[i + 1]]
+                     for i in range(len(offsets) - 1)]
+        for row, changed in self.changed.items():
+            if start <= row < stop:
+                relatives[row - start] = list(changed)
+        return relatives
+
+    def set(self, row, relatives):
+        '''Replace relatives of the citizen in the row.'''
+
+        self.changed[row] = tuple(sorted(relatives))
+        if len(self.changed) > MAX_CHANGED_ROWS:
+            self.merge()
+
+    def merge(self):
+        '''Move changed relatives into the arrays.'''
+
+        counts = np.diff(self.offsets)
+        parts = []
+        position = 0
+        for row in sorted(self.changed):
+            parts.append(self.targets[self.offsets[position]:
+                                      self.offsets[row]])
+            parts.append(np.array(self.changed[row], dtype=np.int64))
+            counts[row] = len(self.changed[row])
+            position = row + 1
+        parts.append(self.targets[self.offsets[position]:])
+
+        self.targets = np.concatenate(parts).astype(np.int64)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.changed = {}
+
+
+class ColumnarImport:
+    '''Citizens of an import and their relatives stored by columns.'''
+
+    def __init__(self, columns):
+        '''Initialize an empty import, fill it with `add` and `finish`.
+
+        Args:
+            columns: names of the citizen fields in the order of rows,
+                citizen_id first
+        '''
+
+        self.columns = list(columns)
+        self.positions = {field: i for i, field in enumerate(self.columns)}
+        self.tables = {field: StringTable() for field in INTERNED_FIELDS}
+
+        # Columns are collected in compact arrays while reading.
+        self.citizen_ids = array('q')
+        self.apartments = array('q')
+        self.genders = array('B')
+        self.codes = {field: array('l') for field in INTERNED_FIELDS}
+        self.names = []
+
+        self.relations = None
+        self.pairs_from = array('q')
+        self.pairs_to = array('q')
+
+        # Fields of patched rows which are not in the arrays yet.
+        self.changed = {}
+
+        # Bytes of ids, apartment, codes and gender of one citizen.
+        self.row_bytes = 8 + 8 + 1 + 4 * len(INTERNED_FIELDS) + 8
+
+        self.names_size = sys.getsizeof(self.names)
+
+    def add(self, row):
+        '''Add a citizen, citizens must be added in the order of ids.
+
+        Args:
+            row: tuple of the citizen fields in the order of `columns`
+        '''
+
+        positions = self.positions
+        self.citizen_ids.append(row[positions['citizen_id']])
+        self.apartments.append(row[positions['apartment']])
+        self.genders.append(GENDERS.index(row[positions['gender']]))
+        for field in INTERNED_FIELDS:
+            self.codes[field].append(
+                self.tables[field].code(row[positions[field]]))
+        name = row[positions['name']]
+        self.names.append(name)
+        self.names_size += sys.getsizeof(name)
+
+    def add_relative(self, citizen_id, relative):
+        '''Add a relation, relations must be added in the order of
+        (citizen_id, relative).'''
+
+        self.pairs_from.append(citizen_id)
+        self.pairs_to.append(relative)
+
+    def finish(self):
+        '''Turn the collected columns into numpy arrays.'''
+
+        self.citizen_ids = np.array(self.citizen_ids, dtype=np.int64)
+        self.apartments = np.array(self.apartments, dtype=np.int64)
+        self.genders = np.array(self.genders, dtype=np.uint8)
+        self.codes = {field: np.array(codes, dtype=np.int32)
+                      for field, codes in self.codes.items()}
+
+        self.relations = Relations.from_pairs(
+            self.citizen_ids, np.array(self.pairs_from, dtype=np.int64),
+            np.array(self.pairs_to, dtype=np.int64))
+        self.pairs_from = self.pairs_to = None
+
+    @property
+    def size(self):
+        '''Approximate number of bytes taken by the import.'''
+
+        size = len(self.citizen_ids) * self.row_bytes + self.names_size +\
+            sum(table.size for table in self.tables.values()) +\
+            sys.getsizeof(self.changed) +\
+            sum(sys.getsizeof(values) + sys.getsizeof(values['name'])
+                for values in self.changed.values())
+        if self.relations is not None:
+            size += self.relations.size
+        else:
+            size += 16 * len(self.pairs_from)
+        return size
+
+    def row(self, citizen_id):
+        '''Row of the citizen or None if it is not in the import.'''
+
+        row = int(np.searchsorted(self.citizen_ids, citizen_id))
+        if row < len(self.citizen_ids) and\
+                self.citizen_ids[row] == citizen_id:
+            return row
+        return None
+
+    def iter_citizens(self, after_citizen_id=-1, limit=None, fields=None):
+        '''Citizens with their relatives one citizen at a time.
+
+        Args:
+            after_citizen_id (int): only citizens with bigger ids are taken
+            limit (int): maximum number of citizens, all if None
+            fields: names of the fields to take, all if None
+
+        Yields:
+            citizen: dict with info about one citizen
+        '''
+
+        fields = fields or self.columns + ['relatives']
+        start = int(np.searchsorted(self.citizen_ids, after_citizen_id,
+                                    side='right'))
+        stop = len(self.citizen_ids) if limit is None else\
+            min(start + limit, len(self.citizen_ids))
+
+        # Values of the rows are taken column by column.
+        columns = []
+        for field in fields:
+            if field == 'relatives':
+                values = self.relations.get_many(start, stop)
+            elif field == 'citizen_id':
+                values = self.citizen_ids[start:stop].tolist()
+            elif field == 'apartment':
+                values = self.apartments[start:stop].tolist()
+            elif field == 'gender':
+                values = [GENDERS[gender] for gender in
+                          self.genders[start:stop].tolist()]
+            elif field == 'name':
+                values = self.names[start:stop]
+            else:
+                strings = self.tables[field].strings
+                values = [strings[code] for code in
+                          self.codes[field][start:stop].tolist()]
+            columns.append(values)
+
+        # Patched rows are taken as they are.
+        for row, changed in self.changed.items():
+            if start <= row < stop:
+                for field, values in zip(fields, columns):
+                    if field != 'relatives':
+                        values[row - start] = changed[field]
+
+        for values in zip(*columns):
+            yield dict(zip(fields, values))
+
+    def copy(self):
+        '''Finished import which can be patched separately.
+
+        Readers of the original import are not disturbed by patches of
+        the copy. Arrays and tables are shared, they are only ever
+        replaced, so only patched rows are copied and a copy does not
+        grow with the import.
+        '''
+
+        data = copy.copy(self)
+        data.changed = dict(self.changed)
+        data.relations = self.relations.copy()
+        return data
+
+    def patch(self, row, relatives):
+        '''Apply an update of one citizen.
+
+        Args:
+            row: new tuple of the citizen fields
+            relatives: new relatives of the citizen
+        '''
+
+        values = dict(zip(self.columns, row))
+        citizen_id = values['citizen_id']
+        index = self.row(citizen_id)
+
+        self.changed[index] = values
+        if len(self.changed) > MAX_CHANGED_ROWS:
+            self.merge()
+
+        old = set(self.relations.get(index))
+        new = set(relatives)
+
+        # Relations are two-sided.
+        for relative in old ^ new:
+            relative_row = self.row(relative)
+            if relative_row is None or relative_row == index:
+                continue
+            others = set(self.relations.get(relative_row))
+            if relative in new:
+                others.add(citizen_id)
+            else:
+                others.discard(citizen_id)
+            self.relations.set(relative_row, others)
+
+        self.relations.set(index, new)
+
+    def merge(self):
+        '''Move patched rows into new arrays.'''
+
+        apartments = self.apartments.copy()
+        genders = self.genders.copy()
+        codes = {field: codes.copy() for field, codes in self.codes.items()}
+        tables = {field: table.copy() for field, table in self.tables.items()}
+        names = list(self.names)
+
+        for row, values in self.changed.items():
+            apartments[row] = values['apartment']
+            genders[row] = GENDERS.index(values['gender'])
+            for field in INTERNED_FIELDS:
+                codes[field][row] = tables[field].code(values[field])
+            self.names_size += sys.getsizeof(values['name']) -\
+                sys.getsizeof(names[row])
+            names[row] = values['name']
+
+        self.apartments = apartments
+        self.genders = genders
+        self.codes = codes
+        self.tables = tables
+        self.names = names
+        self.changed = {}
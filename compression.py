@@ -0,0 +1,238 @@
+'''Compression of responses negotiated by Accept-Encoding.
+
+gzip is always available, brotli and zstd are offered when the
+`brotli` and `zstandard` packages are installed. Streamed responses are
+compressed piece by piece and every piece is flushed, so clients get
+data while the rest is being read. Compressed answers about imports are
+kept in `CompressedCache` with the ETag of the import version, repeated
+reads of an unchanged import skip both serialization and compression.
+'''
+
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Smaller bodies are sent as they are.
+MIN_COMPRESS_BYTES = 1024
+
+# Limit on the size of cached compressed answers in bytes.
+COMPRESSED_CACHE_BYTES = int(os.environ.get('COMPRESSED_CACHE_BYTES',
+                                            64 * 1024 * 1024))
+
+# Encodings by preference of the server.
+ENCODINGS = [encoding for encoding, available in [('zstd', zstandard),
+                                                  ('br', brotli),
+                                                  ('gzip', zlib)]
+             if available is not None]
+
+
+class Compressor:
+    '''Incremental compressor of one response.'''
+
+    def __init__(self, encoding):
+        '''Initialize compressor instance.
+
+        Args:
+            encoding (str): one of `ENCODINGS`
+        '''
+
+        self.encoding = encoding
+        if encoding == 'gzip':
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        elif encoding == 'br':
+            self.compressor = brotli.Compressor(quality=5)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=3).compressobj()
+
+    def compress(self, data):
+        '''Compress a piece and flush it, so it can be sent at once.'''
+
+        if self.encoding == 'gzip':
+            return self.compressor.compress(data) +\
+                self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == 'br':
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        '''End of the compressed stream.'''
+
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def choose_encoding(accept_encoding):
+    '''Best encoding accepted by the client.
+
+    Args:
+        accept_encoding (str): value of the Accept-Encoding header
+
+    Returns:
+        encoding (str): one of `ENCODINGS` or None to send as it is
+    '''
+
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0:
+            return encoding
+    return None
+
+
+def compress_response(response, encoding, store=None, max_store_bytes=None):
+    '''Compress the body of a response in place.
+
+    Args:
+        response: response with a text body
+        encoding (str): one of `ENCODINGS`
+        store: function called with the whole compressed body when it
+            is sent to the end
+        max_store_bytes (int): bigger streamed bodies are not kept for
+            `store`, no limit if None
+
+    Returns:
+        response: the same response
+    '''
+
+    response.vary.add('Accept-Encoding')
+    compressor = Compressor(encoding)
+
+    if not response.is_streamed:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_BYTES:
+            return response
+        data = compressor.compress(data) + compressor.finish()
+        response.set_data(data)
+        if store is not None:
+            store(data)
+    else:
+        pieces = response.response
+
+        def generate():
+            body = [] if store is not None else None
+            size = 0
+            for piece in pieces:
+                if isinstance(piece, str):
+                    piece = piece.encode(response.charset
+                                         if hasattr(response, 'charset')
+                                         else 'utf-8')
+                data = compressor.compress(piece)
+                size += len(data)
+                if body is not None:
+                    body.append(data)
+
+                    # Body too big to be stored is not collected.
+                    if max_store_bytes is not None and\
+                            size > max_store_bytes:
+                        body = None
+                yield data
+            data = compressor.finish()
+            yield data
+            if body is not None and (max_store_bytes is None or
+                                     size + len(data) <= max_store_bytes):
+                body.append(data)
+                store(b''.join(body))
+
+        response.response = generate()
+        response.headers.pop('Content-Length', None)
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+class CompressedCache:
+    '''Compressed answers with a limit on their total size.
+
+    An answer is found by its key (e.g. path with query and encoding)
+    and is valid only for the ETag it was saved with. The least
+    recently used answers are evicted first.
+    '''
+
+    def __init__(self, max_bytes=COMPRESSED_CACHE_BYTES):
+        '''Initialize cache instance.
+
+        Args:
+            max_bytes (int): limit on the total size of answers
+        '''
+
+        self.max_bytes = max_bytes
+        self.answers = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_answer_bytes(self):
+        '''Bigger answers are not saved.'''
+
+        return self.max_bytes // 4
+
+    def get(self, key, etag):
+        '''Compressed answer saved for the ETag.
+
+        Returns:
+            body (bytes): compressed body or None
+        '''
+
+        with self.lock:
+            answer = self.answers.get(key)
+            if answer is None or answer[0] != etag:
+                self.misses += 1
+                return None
+            self.answers.move_to_end(key)
+            self.hits += 1
+            return answer[1]
+
+    def put(self, key, etag, body):
+        '''Save a compressed answer, old ones are evicted if over the
+        limit.'''
+
+        with self.lock:
+            old = self.answers.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            if len(body) > self.max_answer_bytes:
+                return
+
+            self.answers[key] = (etag, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.answers.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        '''Counters of the cache.'''
+
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'answers': len(self.answers),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes}
@@ -0,0 +1,164 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from metrics import TracedConnection
+from migrations import MIGRATIONS, migrate
+
+
+class ConnectionPool:
+    '''Connections to the SQLite database shared by request threads.
+
+    Every thread reads with its own connection, all writes of the
+    process go through a single writer connection one transaction
+    at a time. In WAL mode readers are not blocked by the writer.
+    '''
+
+    # Seconds to wait for a lock held by another process.
+    TIMEOUT = 30
+
+    # Compiled statements kept by every connection, enough for all
+    # statements of `queries` so none of them is compiled twice.
+    CACHED_STATEMENTS = 256
+
+    PRAGMAS = [
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA cache_size = -16000',
+        'PRAGMA temp_store = MEMORY',
+        'PRAGMA foreign_keys = OFF',
+    ]
+
+    def __init__(self, database='citizens.db', migrations=MIGRATIONS):
+        '''Open the writer connection and upgrade the schema.
+
+        Args:
+            database (str): path to the database file
+            migrations: steps of the schema of the database
+        '''
+
+        self.database = database
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+
+        self.write_connection = self.connect()
+
+        # Create the tables or upgrade them to the current schema.
+        with self.write_lock:
+            migrate(self.write_connection, migrations)
+
+    def connect(self):
+        '''Open a new connection with the pool settings.
+
+        Returns:
+            connection: connection in autocommit mode, transactions
+            are started explicitly
+        '''
+
+        connection = sqlite3.connect(self.database, timeout=self.TIMEOUT,
+                                     isolation_level=None,
+                                     check_same_thread=False,
+                                     cached_statements=self.CACHED_STATEMENTS,
+                                     factory=TracedConnection)
+        for pragma in self.PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    def reader(self):
+        '''Connection for reading owned by the current thread.
+
+        Returns:
+            connection: read connection of the thread
+        '''
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def writer(self):
+        '''Write transaction on the writer connection.
+
+        The transaction takes the database write lock at once, it is
+        committed when the block ends and rolled back on an error.
+
+        Yields:
+            connection: writer connection inside the transaction
+        '''
+
+        with self.write_lock:
+            connection = self.write_connection
+            connection.execute('''BEGIN IMMEDIATE''')
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+
+    @contextmanager
+    def try_writer(self):
+        '''Write transaction only if the write lock is free at once.
+
+        Used for work which may be skipped, e.g. saving an answer
+        which can be computed again, so it never waits for an import.
+
+        Yields:
+            connection: writer connection inside the transaction, None
+            if another transaction of any process holds the lock
+        '''
+
+        if not self.write_lock.acquire(blocking=False):
+            yield None
+            return
+
+        try:
+            connection = self.write_connection
+            with self.pragmas(connection, {'busy_timeout': 0}):
+                try:
+                    connection.execute('''BEGIN IMMEDIATE''')
+                except sqlite3.OperationalError:
+                    connection = None
+
+            if connection is None:
+                yield None
+                return
+
+            try:
+                yield connection
+            except BaseException:
+                connection.rollback()
+                raise
+            connection.commit()
+        finally:
+            self.write_lock.release()
+
+    @contextmanager
+    def pragmas(self, connection, pragmas):
+        '''Change settings of the connection for the block.
+
+        Args:
+            connection: connection to change
+            pragmas (dict): pragma name -> value for the block
+        '''
+
+        old = {name: connection.execute('PRAGMA %s' % name).fetchone()[0]
+               for name in pragmas}
+        for name, value in pragmas.items():
+            connection.execute('PRAGMA %s = %s' % (name, value))
+        try:
+            yield connection
+        finally:
+            for name, value in old.items():
+                connection.execute('PRAGMA %s = %s' % (name, value))
+
+    def close(self):
+        '''Close the writer and the current thread's reader.'''
+
+        self.write_connection.close()
+        connection = getattr(self.local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
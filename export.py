@@ -0,0 +1,202 @@
+'''Formats of citizens export besides one json document.
+
+`application/x-ndjson` has one json object per line. `COLUMNS_MIMETYPE`
+is a binary columnar layout, all numbers are little-endian:
+
+    stream  := b'CTZC' version:u8 block* end:u32 (= 0)
+    block   := length:u32 (bytes of the rest of the block)
+               rows:u32 columns:u16 column*
+    column  := name_length:u16 name:utf-8 kind:u8 data
+    kind i  := rows x i64
+    kind s  := strings:u32 (length:u32 utf-8)* codes: rows x u32
+    kind r  := offsets: (rows + 1) x u32, relatives: offsets[rows] x i64
+
+Integer fields have kind `i`, text fields are `s` (distinct strings of
+the block and a code of the string for every row) and relatives are
+`r` (relatives of row `k` are `relatives[offsets[k]:offsets[k + 1]]`).
+Blocks have at most `BLOCK_ROWS` rows, so a stream is decoded block by
+block. `decode_columns` reads the layout back.
+'''
+
+import struct
+from array import array
+from itertools import islice
+
+from flask import json
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+COLUMNS_MIMETYPE = 'application/x-citizens-columns'
+
+COLUMNS_MAGIC = b'CTZC'
+COLUMNS_VERSION = 1
+
+# Number of citizens in one block of the columnar layout.
+BLOCK_ROWS = 10000
+
+INTEGER_FIELDS = ('citizen_id', 'apartment')
+
+# Arrays of the layout are little-endian.
+LITTLE_ENDIAN = struct.pack('=H', 1) == struct.pack('<H', 1)
+
+
+def iter_ndjson(citizens, chunk_size=64 * 1024):
+    '''Citizens as lines of json.
+
+    Args:
+        citizens: iterable of dicts with info about citizens
+        chunk_size (int): approximate number of characters in a piece
+
+    Yields:
+        piece (str): several whole lines
+    '''
+
+    chunk = []
+    size = 0
+    for citizen in citizens:
+        line = json.dumps(citizen) + '\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def packed_array(typecode, values):
+    '''Little-endian bytes of an array of numbers.'''
+
+    values = array(typecode, values)
+    if not LITTLE_ENDIAN:
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_column(field, values):
+    '''Bytes of one column of a block.
+
+    Args:
+        field (str): name of the field
+        values: values of the field for every row
+
+    Returns:
+        data (bytes): encoded column
+    '''
+
+    name = field.encode()
+    parts = [struct.pack('<H', len(name)), name]
+
+    if field == 'relatives':
+        offsets = [0]
+        for relatives in values:
+            offsets.append(offsets[-1] + len(relatives))
+        parts += [b'r', packed_array('I', offsets),
+                  packed_array('q', [relative for relatives in values
+                                     for relative in relatives])]
+    elif field in INTEGER_FIELDS:
+        parts += [b'i', packed_array('q', values)]
+    else:
+        codes = {}
+        row_codes = [codes.setdefault(value, len(codes)) for value in values]
+        parts += [b's', struct.pack('<I', len(codes))]
+        for string in codes:
+            string = string.encode()
+            parts += [struct.pack('<I', len(string)), string]
+        parts.append(packed_array('I', row_codes))
+
+    return b''.join(parts)
+
+
+def iter_columns(citizens, fields):
+    '''Citizens in the columnar layout.
+
+    Args:
+        citizens: iterable of dicts with info about citizens
+        fields: names of the fields of every citizen in the order
+            of columns
+
+    Yields:
+        piece (bytes): header, blocks and the end of the stream
+    '''
+
+    citizens = iter(citizens)
+    yield COLUMNS_MAGIC + bytes([COLUMNS_VERSION])
+
+    while True:
+        block = list(islice(citizens, BLOCK_ROWS))
+        if not block:
+            break
+
+        body = [struct.pack('<IH', len(block), len(fields))]
+        for field in fields:
+            body.append(encode_column(field, [citizen[field]
+                                              for citizen in block]))
+        body = b''.join(body)
+        yield struct.pack('<I', len(body)) + body
+
+    yield struct.pack('<I', 0)
+
+
+def decode_columns(data):
+    '''Read citizens from the columnar layout.
+
+    Args:
+        data (bytes): whole stream
+
+    Returns:
+        citizens: list of dicts with info about citizens
+    '''
+
+    if data[:4] != COLUMNS_MAGIC or data[4] != COLUMNS_VERSION:
+        raise ValueError('Not a citizens columns stream.')
+
+    def read_array(typecode, position, count):
+        values = array(typecode)
+        end = position + values.itemsize * count
+        values.frombytes(data[position:end])
+        if not LITTLE_ENDIAN:
+            values.byteswap()
+        return values.tolist(), end
+
+    citizens = []
+    position = 5
+    while True:
+        length, = struct.unpack_from('<I', data, position)
+        position += 4
+        if length == 0:
+            return citizens
+
+        rows, columns = struct.unpack_from('<IH', data, position)
+        position += 6
+        block = [{} for _ in range(rows)]
+        for _ in range(columns):
+            name_length, = struct.unpack_from('<H', data, position)
+            position += 2
+            field = data[position:position + name_length].decode()
+            kind = data[position + name_length:position + name_length + 1]
+            position += name_length + 1
+
+            if kind == b'i':
+                values, position = read_array('q', position, rows)
+            elif kind == b'r':
+                offsets, position = read_array('I', position, rows + 1)
+                relatives, position = read_array('q', position, offsets[-1])
+                values = [relatives[offsets[k]:offsets[k + 1]]
+                          for k in range(rows)]
+            else:
+                count, = struct.unpack_from('<I', data, position)
+                position += 4
+                strings = []
+                for _ in range(count):
+                    string_length, = struct.unpack_from('<I', data, position)
+                    position += 4
+                    strings.append(data[position:position + string_length]
+                                   .decode())
+                    position += string_length
+                codes, position = read_array('I', position, rows)
+                values = [strings[code] for code in codes]
+
+            for citizen, value in zip(block, values):
+                citizen[field] = value
+        citizens += block
@@ -0,0 +1,221 @@
+'''Imports running in background threads.
+
+With `IMPORT_WORKERS` set, `POST /imports` with `Prefer: respond-async`
+is answered with 202 and the id of a job as soon as the body is read,
+the import is checked and inserted by one of the worker threads of the
+process. States of jobs are kept in their own database: a running
+import holds the write lock of the citizens database for its whole
+transaction, and jobs must be created and reported meanwhile by any
+gunicorn worker. Every process confirms its unfinished jobs by a
+heartbeat, jobs of a process which stopped confirming them (it was
+restarted or killed with its queue) are reported as failed.
+'''
+
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import queries
+from connection_pool import ConnectionPool
+from json_stream import HashingStream, NoCitizensError, iter_citizens
+from migrations import JOBS_MIGRATIONS
+from my_parser import ValidationError
+from sql_manager import KeyReusedError
+
+
+# Number of threads running imports in every process, 0 turns jobs off.
+IMPORT_WORKERS = int(os.environ.get('IMPORT_WORKERS', 0))
+
+# Number of jobs waiting for a worker in every process, more are
+# rejected.
+IMPORT_QUEUE_SIZE = int(os.environ.get('IMPORT_QUEUE_SIZE', 8))
+
+JOBS_DATABASE = os.environ.get('JOBS_DATABASE', 'jobs.db')
+
+# Progress of a running job is saved every this many citizens.
+PROGRESS_CITIZENS = 10000
+
+# Seconds between heartbeats of unfinished jobs of a process.
+HEARTBEAT_SECONDS = 5
+
+# Unfinished jobs without a heartbeat for so many seconds are failed.
+ORPHANED_SECONDS = 30
+
+ORPHANED_MESSAGE = 'Import was interrupted, try again.'
+
+logger = logging.getLogger('import_jobs')
+
+
+class QueueFullError(Exception):
+    '''All places for waiting jobs are taken.'''
+
+
+class ImportJobs:
+    '''Queue of imports with a fixed number of worker threads.'''
+
+    def __init__(self, manager, parser, workers=IMPORT_WORKERS,
+                 queue_size=IMPORT_QUEUE_SIZE, database=JOBS_DATABASE):
+        '''Initialize jobs instance and start the workers.
+
+        Args:
+            manager: `SQL_Manager` inserting the imports
+            parser: `Parser` checking the imports
+            workers (int): number of worker threads, 0 turns jobs off
+            queue_size (int): number of jobs waiting for a worker
+            database (str): path to the database with states of jobs
+        '''
+
+        self.manager = manager
+        self.parser = parser
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+
+        # Jobs are owned by this process, ids of processes are reused.
+        self.owner = '%d-%s' % (os.getpid(), uuid.uuid4().hex)
+
+        self.pool = None
+        if not self.enabled:
+            return
+        self.pool = ConnectionPool(database, JOBS_MIGRATIONS)
+        self.fail_orphaned()
+
+        for _ in range(workers):
+            threading.Thread(target=self.work, daemon=True).start()
+        threading.Thread(target=self.beat, daemon=True).start()
+
+    @property
+    def enabled(self):
+        '''Imports can be run as jobs.'''
+
+        return self.workers > 0
+
+    def submit(self, body, idempotency_key=None):
+        '''Put an import into the queue.
+
+        Args:
+            body (bytes): json document of the import
+            idempotency_key (str): Idempotency-Key of the request
+
+        Returns:
+            job_id (str): id of the new job
+
+        Raises:
+            QueueFullError: the queue is full, nothing is saved
+        '''
+
+        job_id = uuid.uuid4().hex
+        self.save(queries.INSERT_JOB, (job_id, self.owner))
+        try:
+            self.queue.put_nowait((job_id, body, idempotency_key))
+        except queue.Full:
+            self.save(queries.DELETE_JOB, (job_id,))
+            raise QueueFullError()
+        return job_id
+
+    def get(self, job_id):
+        '''State of a job.
+
+        Returns:
+            job: dict with status, number of checked citizens,
+            import_id and error message of the job, None if there
+            is no such job
+        '''
+
+        if self.pool is None:
+            return None
+
+        row = self.pool.reader().execute(queries.SELECT_JOB,
+                                         (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        # Unfinished job may have lost its process.
+        if row[1] in ('queued', 'running') and self.fail_orphaned():
+            row = self.pool.reader().execute(queries.SELECT_JOB,
+                                             (job_id,)).fetchone()
+
+        return dict(zip(('job_id', 'status', 'citizens', 'import_id',
+                         'message'), row))
+
+    def save(self, query, params):
+        '''Change states of jobs in one transaction.'''
+
+        with self.pool.writer() as connection:
+            connection.execute(query, params)
+
+    def fail_orphaned(self):
+        '''Mark unfinished jobs without a recent heartbeat as failed.
+
+        Returns:
+            failed (int): number of failed jobs
+        '''
+
+        with self.pool.writer() as connection:
+            return connection.execute(queries.FAIL_ORPHANED_JOBS,
+                                      (ORPHANED_MESSAGE,
+                                       ORPHANED_SECONDS)).rowcount
+
+    def beat(self):
+        '''Confirm unfinished jobs of the process while it works.'''
+
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                self.save(queries.JOBS_HEARTBEAT, (self.owner,))
+            except Exception:
+                logger.exception('Heartbeat of jobs failed')
+
+    def work(self):
+        '''Run jobs from the queue one after another.'''
+
+        while True:
+            job_id, body, idempotency_key = self.queue.get()
+            try:
+                self.run(job_id, body, idempotency_key)
+            except Exception:
+                logger.exception('Job %s failed', job_id)
+            finally:
+                self.queue.task_done()
+
+    def run(self, job_id, body, idempotency_key=None):
+        '''Check and insert the import of a job, save the result.
+
+        Args:
+            job_id (str): id of the job
+            body (bytes): json document of the import
+            idempotency_key (str): Idempotency-Key of the request
+        '''
+
+        self.save(queries.START_JOB, (job_id,))
+
+        checked = [0]
+
+        def count(citizens):
+            for citizen in citizens:
+                checked[0] += 1
+                if checked[0] % PROGRESS_CITIZENS == 0:
+                    self.save(queries.JOB_PROGRESS, (checked[0], job_id))
+                yield citizen
+
+        stream = HashingStream(io.BytesIO(body))
+        citizens = self.parser.iter_checked(iter_citizens(stream))
+        status, import_id, message = 'failed', None, None
+        try:
+            import_id = self.manager.insert_import(
+                count(citizens), idempotency_key=idempotency_key,
+                content_hash=stream.digest)
+            status = 'done'
+        except (NoCitizensError, ValidationError, KeyReusedError) as error:
+            message = str(error)
+        except ValueError:
+            message = 'Data is not a correct json.'
+        except Exception:
+            message = 'Import failed.'
+            raise
+        finally:
+            self.save(queries.FINISH_JOB,
+                      (status, checked[0], import_id, message, job_id))
@@ -0,0 +1,207 @@
+'''Incremental reading of a {"citizens": [...]} json document.
+
+Citizens are decoded one at a time while the stream is being read,
+so only the current piece of the document is kept in memory.
+'''
+
+import codecs
+import hashlib
+import json
+
+
+# Number of bytes read from the stream at once.
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+
+# Characters that may continue a json number.
+NUMBER_CHARACTERS = '0123456789.eE+-'
+
+
+class NoCitizensError(ValueError):
+    '''Json document has no "citizens" list.'''
+
+
+def body_hash(data):
+    '''Hash of a whole request body.
+
+    Args:
+        data (bytes): body of the request
+
+    Returns:
+        digest (bytes): sha256 of the body
+    '''
+
+    return hashlib.sha256(data).digest()
+
+
+class HashingStream:
+    '''Byte stream computing the hash of the data read from it.'''
+
+    def __init__(self, stream):
+        '''Initialize stream instance.
+
+        Args:
+            stream: file-like object to read from
+        '''
+
+        self.stream = stream
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        '''Read from the stream and add the data to the hash.'''
+
+        data = self.stream.read(size)
+        self.hash.update(data)
+        return data
+
+    def digest(self):
+        '''Hash of the data read so far, the same as `body_hash` of it.'''
+
+        return self.hash.digest()
+
+    def digest_all(self):
+        '''Read the rest of the stream and return the hash of all data.'''
+
+        while self.read(CHUNK_SIZE):
+            pass
+        return self.digest()
+
+
+class JsonStream:
+    '''Buffer over a byte stream with decoding of json values.'''
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        '''Initialize stream instance.
+
+        Args:
+            stream: file-like object with utf-8 encoded json
+            chunk_size (int): number of bytes to read at once
+        '''
+
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+
+    def read_more(self):
+        '''Append the next chunk of the stream to the buffer.
+
+        Returns:
+            read (bool): False if the stream is over
+        '''
+
+        if self.finished:
+            return False
+
+        chunk = self.stream.read(self.chunk_size)
+        self.finished = not chunk
+        text = self.decoder.decode(chunk, final=self.finished)
+
+        # Drop the part of the buffer which is already parsed.
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        return not self.finished or bool(text)
+
+    def peek(self):
+        '''Next character after whitespace, '' at the end of stream.'''
+
+        while True:
+            while self.position < len(self.buffer) and\
+                    self.buffer[self.position] in WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return ''
+
+    def expect(self, characters):
+        '''Consume the next character, which must be one of `characters`.
+
+        Returns:
+            character (str): consumed character
+        '''
+
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError('Expected one of "%s" at position %d.' %
+                             (characters, self.position))
+        self.position += 1
+        return character
+
+    def value(self):
+        '''Decode the next json value.
+
+        Returns:
+            value: decoded value
+        '''
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer,
+                                                          self.position)
+                # A number may continue in the next chunk.
+                if self.finished or end < len(self.buffer) and\
+                        self.buffer[end] not in NUMBER_CHARACTERS:
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.finished:
+                    raise
+            self.read_more()
+
+
+def iter_citizens(stream, chunk_size=CHUNK_SIZE):
+    '''Citizens from the "citizens" list of the json document.
+
+    Other keys of the document are decoded and skipped.
+
+    Args:
+        stream: file-like object with utf-8 encoded json
+        chunk_size (int): number of bytes to read at once
+
+    Yields:
+        citizen: decoded element of the "citizens" list
+
+    Raises:
+        NoCitizensError: document has no "citizens" list
+        ValueError: document is not a correct json object
+    '''
+
+    reader = JsonStream(stream, chunk_size)
+    has_citizens = False
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.expect('}')
+    else:
+        while True:
+            key = reader.value()
+            if type(key) != str:
+                raise ValueError('Keys of json object must be strings.')
+            reader.expect(':')
+
+            if key == 'citizens' and reader.peek() == '[':
+                has_citizens = True
+                reader.expect('[')
+                if reader.peek() == ']':
+                    reader.expect(']')
+                else:
+                    while True:
+                        yield reader.value()
+                        if reader.expect(',]') == ']':
+                            break
+            else:
+                reader.value()
+
+            if reader.expect(',}') == '}':
+                break
+
+    if reader.peek():
+        raise ValueError('Extra data after json object.')
+    if not has_citizens:
+        raise NoCitizensError('"citizens" is not in json form.')
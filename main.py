@@ -1,12 +1,153 @@
-from flask import Flask, json, request
+from datetime import datetime, timezone
+from functools import wraps
 
-from my_parser import Parser
-from sql_manager import SQL_Manager
+from flask import Flask, Response, json, jsonify, request
+
+import compression
+import export
+import metrics
+from jobs import ImportJobs, QueueFullError
+from json_stream import (HashingStream, NoCitizensError, body_hash,
+                         iter_citizens)
+from my_parser import Parser, ValidationError
+from sql_manager import KeyReusedError, SQL_Manager
 
 
 app = Flask(__name__)
 parser = Parser()
 manager = SQL_Manager()
+jobs = ImportJobs(manager, parser)
+compressed = compression.CompressedCache()
+
+# Formats of citizens export, tags of their answers get the suffix.
+EXPORT_FORMATS = {'application/json': None,
+                  export.NDJSON_MIMETYPE: 'ndjson',
+                  export.COLUMNS_MIMETYPE: 'columns'}
+
+# Longer Idempotency-Key headers are rejected.
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+
+
+def export_mimetype():
+    '''Format of citizens asked for by the Accept header.'''
+
+    return request.accept_mimetypes.best_match(list(EXPORT_FORMATS),
+                                               'application/json')
+
+
+@app.before_request
+def start_request():
+    '''Start collecting statistics of the request.'''
+
+    metrics.start_request()
+
+
+@app.after_request
+def compress(response):
+    '''Compress successful answers if the client accepts it.'''
+
+    if response.status_code in (200, 201, 202) and\
+            'Content-Encoding' not in response.headers and\
+            not response.direct_passthrough:
+        encoding = compression.choose_encoding(
+            request.headers.get('Accept-Encoding'))
+        if encoding is not None:
+            compression.compress_response(response, encoding)
+    return response
+
+
+@app.after_request
+def finish_request(response):
+    '''Add statistics of the request to the metrics.
+
+    Statistics are added when the response is closed, so statements
+    executed while a response is streamed are counted too.
+    '''
+
+    stats = metrics.current_stats()
+    if stats is not None:
+        stats.status = response.status_code
+        method = request.method
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+
+        def observe():
+            metrics.finish_request()
+            metrics.observe_request(method, route, stats,
+                                    metrics.SLOW_REQUEST_SECONDS,
+                                    manager.pool.reader)
+
+        response.call_on_close(observe)
+    return response
+
+
+def conditional(daily=False, formats=False):
+    '''Answer with ETag and Last-Modified of the import version.
+
+    A client sending the tag it already has in If-None-Match (or
+    a time not before the last change in If-Modified-Since) gets 304
+    without the answer being built. Times have a precision of one
+    second, so If-Modified-Since is not used for an import changed in
+    the current second, it may be changed again after the client's
+    time. Compressed answers are tagged with
+    their encoding and kept in `compressed` until the import changes.
+
+    Args:
+        daily (bool): the answer also changes every day
+        formats (bool): the answer has formats chosen by Accept
+    '''
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(import_id, **kwargs):
+            etag, modified = manager.get_validators(import_id, daily)
+            if etag is None:
+                return view(import_id, **kwargs)
+
+            mimetype = export_mimetype() if formats else None
+            if EXPORT_FORMATS.get(mimetype) is not None:
+                etag += '-' + EXPORT_FORMATS[mimetype]
+
+            encoding = compression.choose_encoding(
+                request.headers.get('Accept-Encoding'))
+            tag = etag if encoding is None else f'{etag}-{encoding}'
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(tag) or\
+                    request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                now = datetime.now(timezone.utc).replace(microsecond=0)
+                not_modified = since is not None and modified < now and\
+                    since.replace(tzinfo=timezone.utc) >= modified
+
+            key = (request.full_path, mimetype, encoding)
+            body = None if not_modified or encoding is None else\
+                compressed.get(key, tag)
+
+            if not_modified:
+                response = Response(status=304)
+            elif body is not None:
+                response = Response(body,
+                                    mimetype=mimetype or 'application/json')
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+            else:
+                response = view(import_id, **kwargs)
+                if encoding is not None and response.status_code == 200:
+                    compression.compress_response(
+                        response, encoding,
+                        lambda body: compressed.put(key, tag, body),
+                        compressed.max_answer_bytes)
+
+            if response.status_code in (200, 304):
+                if formats:
+                    response.vary.add('Accept')
+                response.set_etag(tag)
+                response.last_modified = modified
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
 
 
 @app.route('/')
@@ -18,18 +159,95 @@ def main():
 def import_data():
     '''Retrieves data from request and adds it to the database.
 
+    Citizens are read from the request stream, checked and inserted
+    by batches, the import is committed only if all of them are correct.
+    With `Prefer: respond-async` the import is run by a background job
+    if jobs are turned on. A request repeating the Idempotency-Key and
+    the body of an earlier import gets its import_id, the body is only
+    hashed then.
+
     Returns:
         import_id & 201-status_code: data was imported
+        job_id & 202-status_code: import is queued
         message & 404/400-status_code: import failed
+        message & 422-status_code: Idempotency-Key was sent with
+            another body
+        message & 503-status_code: queue of jobs is full
     '''
 
-    data = json.loads(request.data)
-    check = parser.check(data)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None:
+        if len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            return parser.process_bad_request('Idempotency-Key is too '
+                                              'long.')
+        stream = HashingStream(request.stream)
+        try:
+            import_id = manager.find_import(idempotency_key,
+                                            key_hash=stream.digest_all)
+        except KeyReusedError as error:
+            return parser.process_bad_request(str(error), 422)
+        if import_id is not None:
+            return manager.build_good_request({'import_id': import_id}, 201)
+
+    if jobs.enabled and\
+            'respond-async' in request.headers.get('Prefer', ''):
+        body = request.get_data()
+
+        # The whole body is read already, so a repeated one is found
+        # before it is queued.
+        if manager.DEDUPLICATE_IMPORTS:
+            import_id = manager.find_import(content_hash=body_hash(body))
+            if import_id is not None:
+                return manager.build_good_request({'import_id': import_id},
+                                                  201)
+
+        try:
+            job_id = jobs.submit(body, idempotency_key)
+        except QueueFullError:
+            response = parser.process_bad_request('Too many imports are '
+                                                  'waiting, try later.', 503)
+            response.headers['Retry-After'] = '5'
+            return response
+
+        response = jsonify({'data': {'job_id': job_id}})
+        response.status_code = 202
+        response.headers['Location'] = f'/imports/jobs/{job_id}'
+        response.headers['Preference-Applied'] = 'respond-async'
+        return response
+
+    stream = HashingStream(request.stream)
+    citizens = parser.iter_checked(iter_citizens(stream))
+
+    try:
+        return manager.import_data(citizens,
+                                   idempotency_key=idempotency_key,
+                                   content_hash=stream.digest)
+    except (NoCitizensError, ValidationError) as error:
+        return parser.process_bad_request(str(error))
+    except KeyReusedError as error:
+        return parser.process_bad_request(str(error), 422)
+    except ValueError:
+        return parser.process_bad_request('Data is not a correct json.')
+
+
+@app.route('/imports/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    '''State of a background import.
 
-    if check is not True:
-        return check
+    Args:
+        job_id (str): id returned by `POST /imports`
 
-    return manager.import_data(data)
+    Returns:
+        job: status (queued/running/done/failed), number of checked
+        citizens, import_id of a done job and message of a failed one
+        message & 404-status_code: there is no such job
+    '''
+
+    job = jobs.get(job_id)
+    if job is None:
+        return parser.process_bad_request(f'No such "job_id" = {job_id}.',
+                                          404)
+    return jsonify({'data': job})
 
 
 @app.route('/imports/<int:import_id>/citizens/<int:citizen_id>',
@@ -47,7 +265,11 @@ def update_data(import_id, citizen_id):
     '''
 
     data = json.loads(request.data)
-    relatives = manager.get_relatives(import_id)
+
+    # Only the new relatives of the citizen are checked here, their
+    # presence in the import is checked while updating.
+    relatives = {citizen_id: data['relatives']} if\
+        type(data) == dict and 'relatives' in data else {}
     check = parser.check(data, 'replace', relatives)
 
     if check is not True:
@@ -56,21 +278,64 @@ def update_data(import_id, citizen_id):
     return manager.replace_data(import_id, citizen_id, data)
 
 
+@app.route('/imports/<int:import_id>/citizens', methods=['PATCH'])
+def update_many(import_id):
+    '''Update data of several citizens in one transaction.
+
+    Args:
+        import_id (int): id of an import where citizens are located
+
+    Returns:
+        citizens & 200-status_code: data was updated
+        message & 404/400-status_code: update failed
+    '''
+
+    try:
+        data = json.loads(request.data)
+    except ValueError:
+        return parser.process_bad_request('Data is not a correct json.')
+
+    check = parser.check_many(data)
+    if check is not True:
+        return check
+
+    return manager.replace_many(import_id, data['citizens'])
+
+
 @app.route('/imports/<int:import_id>/citizens', methods=['GET'])
+@conditional(formats=True)
 def get_data(import_id):
     '''Returns data for a given `import_id`.
 
+    Query arguments `after_citizen_id` and `limit` select a page of
+    citizens ordered by citizen_id, `fields` is a comma separated list
+    of fields to return. The Accept header chooses one json document,
+    json lines or the columnar layout of `export`.
+
     Args:
         import_id (int): id of a requested import
 
     Returns:
-        citizens: all data about citizens in import `import_id`
+        citizens: data about citizens in import `import_id`
+        message & 400-status_code: query arguments are not correct
     '''
 
-    return manager.get_data(import_id)
+    check = parser.check_page(request.args)
+    if check is not True:
+        return check
+
+    after_citizen_id = request.args.get('after_citizen_id', -1, type=int)
+    limit = request.args.get('limit', type=int)
+    fields = request.args.get('fields')
+    if fields is not None:
+        fields = fields.split(',')
+
+    return manager.get_data(import_id, after_citizen_id, limit, fields,
+                            export_mimetype())
 
 
 @app.route('/imports/<int:import_id>/birthdays', methods=['GET'])
+@conditional()
 def get_birthdays(import_id):
     '''Returns data about who and how many presents will buy in each month.
 
@@ -86,6 +351,7 @@ def get_birthdays(import_id):
 
 @app.route('/imports/<int:import_id>/towns/stat/percentile/age',
            methods=['GET'])
+@conditional(daily=True)
 def get_percentile_age(import_id):
     '''Age percentiles (50, 75, 99) for each town.
 
@@ -99,5 +365,39 @@ def get_percentile_age(import_id):
     return manager.get_percentile_age(import_id)
 
 
+@app.route('/cache/snapshots', methods=['GET'])
+def get_cache_stats():
+    '''Counters of the in-memory cache of imports.
+
+    Returns:
+        stats: hits, misses, evictions and size of the cache
+    '''
+
+    return jsonify(manager.snapshots.stats())
+
+
+@app.route('/cache/compressed', methods=['GET'])
+def get_compressed_stats():
+    '''Counters of the cache of compressed answers.
+
+    Returns:
+        stats: hits, misses and size of the cache
+    '''
+
+    return jsonify(compressed.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    '''Timings of requests and SQL statements of this process.
+
+    Returns:
+        metrics: metrics in the Prometheus text format
+    '''
+
+    return Response(metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8080)
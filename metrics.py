@@ -0,0 +1,427 @@
+'''Timing of requests and SQL statements in the Prometheus text format.
+
+Every request of a thread collects statistics of its statements in
+`RequestStats`: connections of the pool are opened with
+`TracedConnection`, so all their cursors are `TracedCursor` and report
+to the statistics of the current request. Counters live in the process,
+so every gunicorn worker reports its own requests.
+'''
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+
+# Upper bounds of histogram buckets in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# A statement executed more times in one request looks like N+1 queries.
+REPEATED_STATEMENTS = 50
+
+# Requests taking longer (in seconds) are logged with plans of their
+# slowest statements, 0 turns the log off.
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
+
+local = threading.local()
+
+
+class StatementStats:
+    '''Executions of one statement during a request.'''
+
+    def __init__(self):
+        '''Initialize statistics instance.'''
+
+        self.count = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+        # Parameters of the last single execution, for EXPLAIN.
+        self.params = None
+
+
+class RequestStats:
+    '''Statements executed while a request is handled.'''
+
+    def __init__(self):
+        '''Initialize statistics instance.'''
+
+        self.start = time.perf_counter()
+        self.statements = defaultdict(StatementStats)
+        self.status = None
+
+    @property
+    def queries(self):
+        '''Number of executed statements.'''
+
+        return sum(stats.count for stats in self.statements.values())
+
+    @property
+    def rows(self):
+        '''Number of fetched or changed rows.'''
+
+        return sum(stats.rows for stats in self.statements.values())
+
+    @property
+    def seconds(self):
+        '''Time spent in SQLite.'''
+
+        return sum(stats.seconds for stats in self.statements.values())
+
+    def repeated(self):
+        '''Statements executed more than `REPEATED_STATEMENTS` times.
+
+        Returns:
+            statements: list of (sql, count)
+        '''
+
+        return [(sql, stats.count) for sql, stats in self.statements.items()
+                if stats.count > REPEATED_STATEMENTS]
+
+    def slowest(self, number=5):
+        '''Statements which took most time.
+
+        Returns:
+            statements: list of (sql, statistics) sorted by time
+        '''
+
+        return sorted(self.statements.items(),
+                      key=lambda item: item[1].seconds, reverse=True)[:number]
+
+
+def start_request():
+    '''Start collecting statistics of the current thread's request.'''
+
+    local.stats = RequestStats()
+
+
+def finish_request():
+    '''Stop collecting statistics of the current thread's request.
+
+    Returns:
+        stats: statistics of the request or None if it was not started
+    '''
+
+    stats = getattr(local, 'stats', None)
+    local.stats = None
+    return stats
+
+
+def current_stats():
+    '''Statistics of the current thread's request or None.'''
+
+    return getattr(local, 'stats', None)
+
+
+class TracedCursor(sqlite3.Cursor):
+    '''Cursor reporting its statements to the current request.'''
+
+    statement = None
+
+    def execute(self, sql, parameters=()):
+        '''Execute a statement and count it.'''
+
+        stats = current_stats()
+        if stats is None:
+            self.statement = None
+            return super().execute(sql, parameters)
+
+        self.statement = statement = stats.statements[sql]
+        statement.count += 1
+        statement.params = parameters
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            statement.seconds += time.perf_counter() - start
+            statement.rows += max(self.rowcount, 0)
+
+    def executemany(self, sql, seq_of_parameters):
+        '''Execute a statement for every set of parameters and count it.'''
+
+        stats = current_stats()
+        self.statement = None
+        if stats is None:
+            return super().executemany(sql, seq_of_parameters)
+
+        statement = stats.statements[sql]
+        statement.count += 1
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            statement.seconds += time.perf_counter() - start
+            statement.rows += max(self.rowcount, 0)
+
+    def __next__(self):
+        # Rows read one by one are only counted, timing every row
+        # would cost more than reading it.
+        row = super().__next__()
+        if self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+    def fetch(self, method, *args):
+        '''Call a fetch method of the cursor and count its rows.'''
+
+        statement = self.statement
+        if statement is None:
+            return method(*args)
+
+        start = time.perf_counter()
+        rows = method(*args)
+        statement.seconds += time.perf_counter() - start
+        statement.rows += len(rows) if type(rows) == list else\
+            int(rows is not None)
+        return rows
+
+    def fetchone(self):
+        '''Next row of the result or None.'''
+
+        return self.fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        '''Next rows of the result.'''
+
+        return self.fetch(super().fetchmany,
+                          self.arraysize if size is None else size)
+
+    def fetchall(self):
+        '''All remaining rows of the result.'''
+
+        return self.fetch(super().fetchall)
+
+
+class TracedConnection(sqlite3.Connection):
+    '''Connection with cursors reporting to the current request.'''
+
+    def cursor(self, factory=TracedCursor):
+        '''New cursor of the connection.'''
+
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        '''Execute a statement with a new cursor.'''
+
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        '''Execute a statement for every set of parameters.'''
+
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class Histogram:
+    '''Histogram with cumulative buckets for every set of labels.'''
+
+    def __init__(self, name, documentation, buckets=BUCKETS):
+        '''Initialize histogram instance.
+
+        Args:
+            name (str): name of the metric
+            documentation (str): help line of the metric
+            buckets: upper bounds of the buckets
+        '''
+
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        '''Add one observation.
+
+        Args:
+            labels: tuple of (name, value) pairs
+            value (float): observed value
+        '''
+
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [[0] * len(self.buckets),
+                                                0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        '''Lines of the metric in the Prometheus text format.'''
+
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        with self.lock:
+            for labels, (counts, count, total) in sorted(self.series.items()):
+                for bound, bucket in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket'
+                                 f'{format_labels(labels + (("le", bound),))}'
+                                 f' {bucket}')
+                lines.append(f'{self.name}_bucket'
+                             f'{format_labels(labels + (("le", "+Inf"),))}'
+                             f' {count}')
+                lines.append(f'{self.name}_sum{format_labels(labels)} '
+                             f'{total}')
+                lines.append(f'{self.name}_count{format_labels(labels)} '
+                             f'{count}')
+        return lines
+
+
+class Counter:
+    '''Counter for every set of labels.'''
+
+    def __init__(self, name, documentation):
+        '''Initialize counter instance.
+
+        Args:
+            name (str): name of the metric
+            documentation (str): help line of the metric
+        '''
+
+        self.name = name
+        self.documentation = documentation
+        self.series = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        '''Add the value to the counter.
+
+        Args:
+            labels: tuple of (name, value) pairs
+            value (float): value to add
+        '''
+
+        with self.lock:
+            self.series[labels] += value
+
+    def render(self):
+        '''Lines of the metric in the Prometheus text format.'''
+
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} counter']
+        with self.lock:
+            for labels, value in sorted(self.series.items()):
+                lines.append(f'{self.name}{format_labels(labels)} {value}')
+        return lines
+
+
+def format_labels(labels):
+    '''Labels in the Prometheus text format.'''
+
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (name, str(value)
+                                       .replace('\\', '\\\\')
+                                       .replace('"', '\\"')
+                                       .replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+# Upper bounds of buckets of the number of statements per request.
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds',
+                            'Time of handling requests in seconds.')
+REQUEST_QUERIES = Histogram('http_request_sql_queries',
+                            'SQL statements executed by one request.',
+                            QUERY_BUCKETS)
+SQL_QUERIES = Counter('sql_queries_total', 'Executed SQL statements.')
+SQL_ROWS = Counter('sql_rows_total', 'Rows fetched or changed by SQL '
+                   'statements.')
+SQL_SECONDS = Counter('sql_seconds_total', 'Time of executing SQL '
+                      'statements in seconds.')
+REPEATED_REQUESTS = Counter('sql_repeated_statement_requests_total',
+                            'Requests executing one statement more than '
+                            f'{REPEATED_STATEMENTS} times (N+1 queries).')
+SLOW_REQUESTS = Counter('http_slow_requests_total',
+                        'Requests slower than the slow log threshold.')
+
+METRICS = [REQUEST_SECONDS, REQUEST_QUERIES, SQL_QUERIES, SQL_ROWS,
+           SQL_SECONDS, REPEATED_REQUESTS, SLOW_REQUESTS]
+
+logger = logging.getLogger('slow_requests')
+
+
+def observe_request(method, route, stats, slow_seconds=0, connect=None):
+    '''Add statistics of a finished request to the metrics.
+
+    Args:
+        method (str): method of the request
+        route (str): rule of the route which handled the request
+        stats: statistics of the request
+        slow_seconds (float): requests taking longer are logged,
+            0 turns the log off
+        connect: function returning a connection to explain
+            statements of slow requests with
+    '''
+
+    seconds = time.perf_counter() - stats.start
+    status = stats.status or 500
+    REQUEST_SECONDS.observe((('method', method), ('route', route),
+                             ('status', status)), seconds)
+
+    labels = (('route', route),)
+    REQUEST_QUERIES.observe(labels, stats.queries)
+    SQL_QUERIES.inc(labels, stats.queries)
+    SQL_ROWS.inc(labels, stats.rows)
+    SQL_SECONDS.inc(labels, stats.seconds)
+
+    repeated = stats.repeated()
+    if repeated:
+        REPEATED_REQUESTS.inc(labels)
+
+    if slow_seconds and seconds > slow_seconds:
+        SLOW_REQUESTS.inc(labels)
+        log_slow_request(method, route, stats, seconds, repeated,
+                         connect() if connect is not None else None)
+
+
+def explain(connection, sql, params):
+    '''Query plan of a statement.
+
+    Returns:
+        plan: list of lines of EXPLAIN QUERY PLAN, empty if the
+        statement can not be explained
+    '''
+
+    if params is None or not sql.lstrip().upper().startswith(
+            ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+        return []
+    try:
+        rows = connection.execute('EXPLAIN QUERY PLAN ' + sql,
+                                  params).fetchall()
+    except sqlite3.Error:
+        return []
+    return [row[-1] for row in rows]
+
+
+def log_slow_request(method, route, stats, seconds, repeated, connection):
+    '''Write a slow request with its slowest statements to the log.'''
+
+    lines = [f'{method} {route} {stats.status or 500} took {seconds:.3f} s: '
+             f'{stats.queries} queries, {stats.rows} rows, '
+             f'{stats.seconds:.3f} s in SQLite']
+    for sql, count in repeated:
+        lines.append(f'  repeated {count} times: {" ".join(sql.split())}')
+    for sql, statement in stats.slowest():
+        lines.append(f'  {statement.seconds:.3f} s, {statement.count} times,'
+                     f' {statement.rows} rows: {" ".join(sql.split())}')
+        if connection is not None:
+            for step in explain(connection, sql, statement.params):
+                lines.append(f'    {step}')
+    logger.warning('\n'.join(lines))
+
+
+def render():
+    '''All metrics in the Prometheus text format.'''
+
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,283 @@
+'''Versioned schema of the citizens database.
+
+`MIGRATIONS[i]` holds the statements which upgrade the schema
+from version `i` to version `i + 1`, a statement is either an SQL
+string or a function called with the cursor. The current version
+is stored in the `schema_version` table, a database without this
+table is treated as version 1 if it already has the `citizens`
+table (databases created before versioning) and as version 0
+otherwise.
+'''
+
+import struct
+from collections import Counter
+
+
+def date_key(birth_date):
+    '''Key yyyymmdd of a date in d.m.yyyy or dd.mm.yyyy format.'''
+
+    day, month, year = birth_date.split('.')
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+
+# Index for lookups of the other side of a relation.
+CREATE_RELATIVES_INDEX = '''CREATE INDEX relatives_by_relative
+                            ON relatives (import_id, relative, citizen_id)'''
+
+
+def build_aggregates(cursor):
+    '''Compute aggregates for all existing imports.
+
+    The aggregates are computed here and not by `aggregates`, so later
+    changes of that module do not change what the step does.
+    '''
+
+    imports = cursor.execute('''SELECT import_id FROM imports''').fetchall()
+    for (import_id,) in imports:
+        citizens = cursor.execute('''SELECT citizen_id, town, birth_date
+                                     FROM citizens WHERE import_id = ?
+                                     ORDER BY citizen_id''',
+                                  (import_id,)).fetchall()
+        keys = {citizen_id: date_key(birth_date)
+                for citizen_id, _, birth_date in citizens}
+
+        # Each relation row is counted from both sides.
+        presents = Counter()
+        pairs = cursor.execute('''SELECT citizen_id, relative FROM relatives
+                                  WHERE import_id = ?''', (import_id,))
+        for first, second in pairs.fetchall():
+            for giver, taker in [(first, second), (second, first)]:
+                if taker in keys:
+                    presents[(keys[taker] // 100 % 100, giver)] += 1
+        cursor.executemany('''INSERT INTO presents VALUES (?, ?, ?, ?)''',
+                           [(import_id, month, giver, count) for
+                            (month, giver), count in presents.items()])
+
+        # Towns keep the id of their first citizen and sorted
+        # little-endian int64 keys of birth dates.
+        towns = {}
+        for citizen_id, town, birth_date in citizens:
+            towns.setdefault(town, [citizen_id, []])[1].append(
+                date_key(birth_date))
+        cursor.executemany('''INSERT INTO town_births VALUES (?, ?, ?, ?)''',
+                           [(import_id, town, position,
+                             struct.pack('<%dq' % len(town_keys),
+                                         *sorted(town_keys)))
+                            for town, (position, town_keys) in towns.items()])
+
+
+MIGRATIONS = [
+    # 0 -> 1: initial tables.
+    [
+        '''CREATE TABLE IF NOT EXISTS citizens
+           (import_id INTEGER,
+            citizen_id INTEGER,
+            town TEXT,
+            street TEXT,
+            building TEXT,
+            apartment INTEGER,
+            name TEXT,
+            birth_date TEXT,
+            gender TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS relatives
+           (import_id INTEGER,
+            citizen_id INTEGER,
+            relative INTEGER)''',
+    ],
+
+    # 1 -> 2: primary keys, indexes and the sequence of imports.
+    [
+        '''CREATE TABLE imports
+           (import_id INTEGER PRIMARY KEY)''',
+        '''INSERT INTO imports
+           SELECT DISTINCT import_id FROM citizens
+           WHERE import_id IS NOT NULL''',
+
+        '''ALTER TABLE citizens RENAME TO citizens_v1''',
+        '''CREATE TABLE citizens
+           (import_id INTEGER NOT NULL,
+            citizen_id INTEGER NOT NULL,
+            town TEXT,
+            street TEXT,
+            building TEXT,
+            apartment INTEGER,
+            name TEXT,
+            birth_date TEXT,
+            gender TEXT,
+            PRIMARY KEY (import_id, citizen_id))
+           WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO citizens
+           SELECT * FROM citizens_v1
+           WHERE import_id IS NOT NULL AND citizen_id IS NOT NULL''',
+        '''DROP TABLE citizens_v1''',
+
+        '''ALTER TABLE relatives RENAME TO relatives_v1''',
+        '''CREATE TABLE relatives
+           (import_id INTEGER NOT NULL,
+            citizen_id INTEGER NOT NULL,
+            relative INTEGER NOT NULL,
+            PRIMARY KEY (import_id, citizen_id, relative))
+           WITHOUT ROWID''',
+        '''INSERT OR IGNORE INTO relatives
+           SELECT * FROM relatives_v1
+           WHERE import_id IS NOT NULL
+           AND citizen_id IS NOT NULL
+           AND relative IS NOT NULL''',
+        '''DROP TABLE relatives_v1''',
+
+        CREATE_RELATIVES_INDEX,
+    ],
+
+    # 2 -> 3: precomputed aggregates of imports.
+    [
+        '''CREATE TABLE presents
+           (import_id INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            citizen_id INTEGER NOT NULL,
+            presents INTEGER NOT NULL,
+            PRIMARY KEY (import_id, month, citizen_id))
+           WITHOUT ROWID''',
+        '''CREATE TABLE town_births
+           (import_id INTEGER NOT NULL,
+            town TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            birth_keys BLOB NOT NULL,
+            PRIMARY KEY (import_id, town))''',
+        '''CREATE TABLE age_stats
+           (import_id INTEGER PRIMARY KEY,
+            day TEXT NOT NULL,
+            data TEXT NOT NULL)''',
+        build_aggregates,
+    ],
+
+    # 3 -> 4: versions of imports, bumped on every change.
+    [
+        '''ALTER TABLE imports
+           ADD COLUMN version INTEGER NOT NULL DEFAULT 0''',
+    ],
+
+    # 4 -> 5: time of the last change of imports (unix seconds).
+    [
+        '''ALTER TABLE imports
+           ADD COLUMN modified INTEGER''',
+        '''UPDATE imports SET modified = strftime('%s', 'now')''',
+    ],
+
+    # 5 -> 6: idempotency keys and hashes of bodies of imports.
+    [
+        '''ALTER TABLE imports
+           ADD COLUMN idempotency_key TEXT''',
+        '''ALTER TABLE imports
+           ADD COLUMN content_hash BLOB''',
+        '''CREATE UNIQUE INDEX imports_by_key
+           ON imports (idempotency_key)''',
+        '''CREATE INDEX imports_by_hash
+           ON imports (content_hash)''',
+    ],
+
+    # 6 -> 7: hashes of bodies sent with idempotency keys.
+    [
+        '''ALTER TABLE imports
+           ADD COLUMN key_hash BLOB''',
+    ],
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Schema of the separate database with states of import jobs.
+JOBS_MIGRATIONS = [
+    # 0 -> 1: jobs.
+    [
+        '''CREATE TABLE jobs
+           (job_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            citizens INTEGER NOT NULL DEFAULT 0,
+            import_id INTEGER,
+            message TEXT,
+            created INTEGER NOT NULL,
+            updated INTEGER NOT NULL)''',
+    ],
+
+    # 1 -> 2: processes running jobs and their heartbeats.
+    [
+        '''ALTER TABLE jobs ADD COLUMN owner TEXT''',
+        '''ALTER TABLE jobs ADD COLUMN heartbeat INTEGER''',
+        '''CREATE INDEX jobs_by_status ON jobs (status, owner)''',
+    ],
+]
+
+
+def table_exists(cursor, table):
+    '''Check if the table is in the database.
+
+    Args:
+        cursor: cursor of the database
+        table (str): name of the table
+
+    Returns:
+        exists (bool): table is in the database
+    '''
+
+    query = '''SELECT 1 FROM sqlite_master
+               WHERE type = 'table' AND name = ?'''
+    return cursor.execute(query, (table,)).fetchone() is not None
+
+
+def get_version(cursor):
+    '''Get the schema version of the database.
+
+    Args:
+        cursor: cursor of the database
+
+    Returns:
+        version (int): current schema version
+    '''
+
+    if table_exists(cursor, 'schema_version'):
+        query = '''SELECT version FROM schema_version'''
+        return cursor.execute(query).fetchone()[0]
+
+    return 1 if table_exists(cursor, 'citizens') else 0
+
+
+def migrate(connection, migrations=MIGRATIONS):
+    '''Upgrade the database in place up to the last version.
+
+    Every step runs in its own write transaction, so several processes
+    starting at once upgrade the database only one time.
+
+    Args:
+        connection: connection to the database
+        migrations: steps of the schema, `MIGRATIONS` of the citizens
+            database by default
+
+    Returns:
+        version (int): schema version after the upgrade
+    '''
+
+    cursor = connection.cursor()
+
+    while True:
+        cursor.execute('''BEGIN IMMEDIATE''')
+        try:
+            version = get_version(cursor)
+            if version >= len(migrations):
+                connection.commit()
+                return version
+
+            for statement in migrations[version]:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+
+            # Save the new version.
+            cursor.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                              (version INTEGER NOT NULL)''')
+            cursor.execute('''DELETE FROM schema_version''')
+            cursor.execute('''INSERT INTO schema_version VALUES (?)''',
+                           (version + 1,))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
@@ -1,8 +1,28 @@
+import os
+import re
+from array import array
 from collections import defaultdict
-from datetime import datetime
+from datetime import date, datetime
 
+import numpy as np
 from flask import jsonify
 
+from columnar import wrong_relations
+
+
+# Fields every imported citizen must have.
+CITIZEN_FIELDS = frozenset(['citizen_id', 'town', 'street', 'building',
+                            'apartment', 'name', 'birth_date', 'gender',
+                            'relatives'])
+
+# Birth dates in the usual dd.mm.yyyy form are checked without strptime.
+DATE_PATTERN = re.compile(r'(\d\d)\.(\d\d)\.(\d\d\d\d)', re.ASCII)
+MONTH_DAYS = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+class ValidationError(ValueError):
+    '''Data is not correct, the message describes what is wrong.'''
+
 
 class Parser:
 
@@ -15,11 +35,23 @@ class Parser:
                           'your citizens is not correct.'
     STRING_ERROR_MSG = '"string_value" = "%s" field not correct.'
     STUB_ERROR_MSG = 'You have some fields that are not supported.'
+    CITIZEN_ERROR_MSG = 'Every citizen must be a json object.'
+    FIELDS_NUMBER_ERROR_MSG = 'Number of fields not match ' +\
+                              'the allowed number of fields'
+    UNIQUE_ERROR_MSG = '"citizen_id" must be unique for upload.'
+    PAGE_ERROR_MSG = '"%s" = "%s" query argument is not correct.'
+    FIELDS_ERROR_MSG = '"fields" = "%s" query argument is not correct.'
+    CHANGE_ERROR_MSG = 'Every change must be a json object with "citizen_id".'
+    RELATIONS_ERROR_MSG = 'Relatives of citizens %s are not correct.'
+
+    # Relatives of imports must be citizens of the same import and
+    # relations must be given from both sides.
+    STRICT_RELATIVES = os.environ.get('STRICT_RELATIVES', '0') == '1'
 
     def __init__(self):
         '''Initialize parser instance and define check-functions.'''
 
-        self.check_functions = defaultdict(self.default_check)
+        self.check_functions = defaultdict(lambda: self.default_check)
         self.check_functions['citizen_id'] = self.check_citizen_id
         self.check_functions['town'] = self.check_string_value
         self.check_functions['street'] = self.check_string_value
@@ -44,7 +76,7 @@ class Parser:
         response.status_code = code
         return response
 
-    def check(self, data, action='import', relatives={}):
+    def check(self, data, action='import', relatives=None):
         '''Check correctness of the data.
 
         Args:
@@ -58,6 +90,9 @@ class Parser:
                         if some errors are found in the data
         '''
 
+        if relatives is None:
+            relatives = {}
+
         # If action = import, then data must have 'citizens' field.
         if action == 'import':
             if 'citizens' in data:
@@ -67,8 +102,7 @@ class Parser:
                 citizen_ids = [citizen['citizen_id'] for citizen in data]
 
                 if len(set(citizen_ids)) != len(citizen_ids):
-                    return self.process_bad_request(
-                        '"citizen_id" must be unique for upload.')
+                    return self.process_bad_request(self.UNIQUE_ERROR_MSG)
             else:
                 return self.process_bad_request('"citizens" ' +
                                                 'is not in json form.')
@@ -84,23 +118,9 @@ class Parser:
 
         # Check all fields for every citizen.
         for citizen in data:
-            # Number of fields must be 9 if action=import
-            if action == 'import' and len(set(citizen)) != 9:
-                return self.process_bad_request(
-                        'Number of fields not match ' +
-                        'the allowed number of fields')
-
-            for field in citizen:
-                if field == 'relatives':
-                    if type(citizen[field]) != list:
-                        return self.process_bad_request(
-                            '"relatives" field must be a list.')
-                    continue
-
-                # Check field using the relevant check-function.
-                result = self.check_functions[field](citizen[field])
-                if result is not True:
-                    return self.process_bad_request(result)
+            result = self.check_citizen(citizen, action)
+            if result is not True:
+                return self.process_bad_request(result)
 
             if action == 'import':
                 relatives[citizen['citizen_id']] = citizen['relatives']
@@ -109,6 +129,228 @@ class Parser:
         return True if check_relatives is True else\
             self.process_bad_request(check_relatives)
 
+    def check_many(self, data):
+        '''Check changes of several citizens sent together.
+
+        Every change must have `citizen_id` of the citizen to change,
+        relatives of citizens changed together must agree with each other.
+
+        Args:
+            data (dict): {"citizens": [...]} with changes of citizens
+
+        Returns:
+            True: if data is fully correct
+            response: message & bad-status_code
+                        if some errors are found in the data
+        '''
+
+        if type(data) != dict or type(data.get('citizens')) != list:
+            return self.process_bad_request('"citizens" ' +
+                                            'is not in json form.')
+
+        relatives = {}
+        for citizen in data['citizens']:
+            if type(citizen) != dict or 'citizen_id' not in citizen:
+                return self.process_bad_request(self.CHANGE_ERROR_MSG)
+
+            result = self.check_citizen(citizen, 'replace')
+            if result is not True:
+                return self.process_bad_request(result)
+
+            citizen_id = citizen['citizen_id']
+            if citizen_id in relatives:
+                return self.process_bad_request(self.UNIQUE_ERROR_MSG)
+            relatives[citizen_id] = citizen.get('relatives')
+
+        new_relatives = {citizen_id: relatives[citizen_id]
+                         for citizen_id in relatives
+                         if relatives[citizen_id] is not None}
+        check_relatives = self.check_relatives(new_relatives)
+        if check_relatives is not True:
+            return self.process_bad_request(check_relatives)
+
+        # Citizens changed together must agree on their relations.
+        new_relatives = {citizen_id: set(citizen_relatives) for
+                         citizen_id, citizen_relatives in
+                         new_relatives.items()}
+        for citizen_id, citizen_relatives in new_relatives.items():
+            for relative in citizen_relatives:
+                if relative in new_relatives and\
+                        citizen_id not in new_relatives[relative]:
+                    return self.process_bad_request(self.RELATIVES_ERROR_MSG)
+
+        return True
+
+    def check_page(self, args):
+        '''Check query arguments choosing a page of citizens.
+
+        Args:
+            args: query arguments of the request
+
+        Returns:
+            True: arguments are correct
+            response: message & bad-status_code otherwise
+        '''
+
+        for name, minimum in [('after_citizen_id', 0), ('limit', 1)]:
+            value = args.get(name)
+            if value is not None and (not value.isdecimal() or
+                                      not minimum <= int(value) < 2 ** 63):
+                return self.process_bad_request(self.PAGE_ERROR_MSG %
+                                                (name, value))
+
+        fields = args.get('fields')
+        if fields is not None and not all(fields.split(',')):
+            return self.process_bad_request(self.FIELDS_ERROR_MSG % fields)
+
+        return True
+
+    def check_citizen(self, citizen, action='import'):
+        '''Check all fields of one citizen.
+
+        Args:
+            citizen (dict): data of the citizen
+            action (str): action for which to check the data (import/replace)
+
+        Returns:
+            True: citizen is correct
+            error_msg: citizen is not correct
+        '''
+
+        if type(citizen) != dict:
+            return self.CITIZEN_ERROR_MSG
+
+        # Number of fields must be 9 if action=import
+        if action == 'import' and len(set(citizen)) != 9:
+            return self.FIELDS_NUMBER_ERROR_MSG
+
+        for field in citizen:
+            if field == 'relatives':
+                if type(citizen[field]) != list:
+                    return '"relatives" field must be a list.'
+                continue
+
+            # Check field using the relevant check-function.
+            result = self.check_functions[field](citizen[field])
+            if result is not True:
+                return result
+
+        return True
+
+    def compile_check(self, today=None):
+        '''Function checking a whole imported citizen at once.
+
+        Correct citizens pass without calls of the check-functions,
+        anything unusual is checked again by `check_citizen`, so errors
+        are the same.
+
+        Args:
+            today (date): birth dates must be before it, today by default
+
+        Returns:
+            check: function taking a citizen and returning True or
+            the error message of `check_citizen`
+        '''
+
+        today = today or date.today()
+        today = today.year * 10000 + today.month * 100 + today.day
+        fields = CITIZEN_FIELDS
+        match_date = DATE_PATTERN.fullmatch
+        slow_check = self.check_citizen
+
+        def check(citizen):
+            if type(citizen) is not dict or citizen.keys() != fields:
+                return slow_check(citizen)
+
+            citizen_id = citizen['citizen_id']
+            apartment = citizen['apartment']
+            name = citizen['name']
+            if type(citizen_id) is not int or citizen_id < 0 or\
+                    type(apartment) is not int or apartment < 0 or\
+                    type(name) is not str or not 0 < len(name) < 257 or\
+                    type(citizen['relatives']) is not list:
+                return slow_check(citizen)
+
+            gender = citizen['gender']
+            if gender != 'female' and gender != 'male':
+                return slow_check(citizen)
+
+            for field in ('town', 'street', 'building'):
+                value = citizen[field]
+                if type(value) is not str or len(value) > 256 or\
+                        value == 'null' or not (
+                            value[:1].isalnum() or
+                            any(c.isalnum() for c in value)):
+                    return slow_check(citizen)
+
+            match = match_date(citizen['birth_date']) if\
+                type(citizen['birth_date']) is str else None
+            if match is None:
+                return slow_check(citizen)
+            day, month, year = map(int, match.groups())
+            if not (0 < month < 13 and 0 < day <= MONTH_DAYS[month] and
+                    year > 0) or month == 2 and day == 29 and\
+                    (year % 4 or year % 100 == 0 and year % 400) or\
+                    year * 10000 + month * 100 + day >= today:
+                return slow_check(citizen)
+
+            return True
+
+        return check
+
+    def iter_checked(self, citizens):
+        '''Check citizens of an import one by one while passing them on.
+
+        Relatives are collected into arrays and the relations of the
+        whole import are checked after the last citizen.
+
+        Args:
+            citizens: iterable of citizens to import
+
+        Yields:
+            citizen: next checked citizen
+
+        Raises:
+            ValidationError: some citizen or relation is not correct
+        '''
+
+        check_citizen = self.compile_check()
+        seen = set()
+        citizen_ids = array('q')
+        pairs_from = array('q')
+        pairs_to = array('q')
+
+        for citizen in citizens:
+            result = check_citizen(citizen)
+            if result is not True:
+                raise ValidationError(result)
+
+            citizen_id = citizen['citizen_id']
+            if citizen_id in seen:
+                raise ValidationError(self.UNIQUE_ERROR_MSG)
+            seen.add(citizen_id)
+
+            relatives = citizen['relatives']
+            if any(type(relative) != int for relative in relatives):
+                raise ValidationError(self.RELATIVES_ERROR_MSG)
+
+            try:
+                citizen_ids.append(citizen_id)
+            except OverflowError:
+                raise ValidationError(self.CITIZEN_ID_ERROR_MSG % citizen_id)
+            try:
+                pairs_to.extend(relatives)
+            except OverflowError:
+                raise ValidationError(self.RELATIVES_ERROR_MSG)
+            pairs_from.extend([citizen_id] * len(relatives))
+
+            yield citizen
+
+        check_relations = self.check_relations(citizen_ids, pairs_from,
+                                               pairs_to)
+        if check_relations is not True:
+            raise ValidationError(check_relations)
+
     def check_citizen_id(self, citizen_id):
         '''Check correctness of the `citizen_id` field.
 
@@ -213,6 +455,32 @@ class Parser:
                     return self.RELATIVES_ERROR_MSG
         return True
 
+    def check_relations(self, citizen_ids, pairs_from, pairs_to):
+        '''Check relations between all citizens of an import.
+
+        Repeated relatives are always wrong, relatives which are not in
+        the import, citizens related to themselves and one-sided
+        relations are wrong if `STRICT_RELATIVES` is on.
+
+        Args:
+            citizen_ids: ids of all citizens of the import
+            pairs_from: citizens of the relations
+            pairs_to: relatives of the relations
+
+        Returns:
+            True: relations are correct
+            error_msg: ids of all citizens with wrong relatives
+        '''
+
+        wrong = wrong_relations(np.frombuffer(citizen_ids, dtype=np.int64),
+                                np.frombuffer(pairs_from, dtype=np.int64),
+                                np.frombuffer(pairs_to, dtype=np.int64),
+                                self.STRICT_RELATIVES)
+        if len(wrong):
+            return self.RELATIONS_ERROR_MSG %\
+                ', '.join(map(str, wrong.tolist()))
+        return True
+
     def check_string_value(self, value):
         '''Check correctness of a string field (e.g. town/street/building).
 
@@ -229,9 +497,12 @@ class Parser:
                 return True
         return self.STRING_ERROR_MSG % value
 
-    def default_check(self):
+    def default_check(self, value):
         '''Stub check-function for not yet supported fields.
 
+        Args:
+            value: value of the field
+
         Returns:
             error_msg: field is not supported
         '''
@@ -0,0 +1,178 @@
+'''SQL statements of the service.
+
+Values are always passed as bound parameters, so the text of every
+statement is constant: sqlite3 compiles it once per connection and
+then takes it from the statement cache of the connection.
+'''
+
+
+# Biggest integer SQLite can store.
+MAX_ID = 2 ** 63 - 1
+
+# Fields of a citizen which can be changed.
+CITIZEN_FIELDS = ('town', 'street', 'building', 'apartment', 'name',
+                  'birth_date', 'gender')
+
+
+# Imports.
+ALLOCATE_IMPORT_ID = '''INSERT INTO imports (import_id, modified)
+                        SELECT COALESCE(MAX(import_id) + 1, 0),
+                               strftime('%s', 'now')
+                        FROM imports'''
+IMPORT_EXISTS = '''SELECT 1 FROM imports WHERE import_id = ?'''
+IMPORT_VERSION = '''SELECT version FROM imports WHERE import_id = ?'''
+IMPORT_STATE = '''SELECT version, modified FROM imports
+                  WHERE import_id = ?'''
+BUMP_VERSION = '''UPDATE imports SET version = version + 1,
+                                   modified = strftime('%s', 'now'),
+                                   content_hash = NULL
+                  WHERE import_id = ?'''
+IMPORT_BY_KEY = '''SELECT import_id, key_hash FROM imports
+                   WHERE idempotency_key = ?'''
+IMPORT_BY_HASH = '''SELECT import_id FROM imports
+                    WHERE content_hash = ?
+                    ORDER BY import_id LIMIT 1'''
+SET_IMPORT_IDENTITY = '''UPDATE imports SET idempotency_key = ?,
+                                          key_hash = ?,
+                                          content_hash = ?
+                         WHERE import_id = ?'''
+
+
+# Citizens.
+TABLE_COLUMNS = '''SELECT name FROM pragma_table_info(?) ORDER BY cid'''
+INSERT_CITIZEN = '''INSERT INTO citizens
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+SELECT_CITIZEN = '''SELECT * FROM citizens
+                    WHERE import_id = ? AND citizen_id = ?'''
+SELECT_CITIZENS = '''SELECT * FROM citizens
+                     WHERE import_id = ?
+                     ORDER BY citizen_id'''
+# Page of citizens with the chosen columns, LIMIT -1 takes all.
+SELECT_CITIZENS_PAGE = '''SELECT %s FROM citizens
+                          WHERE import_id = ? AND citizen_id > ?
+                          ORDER BY citizen_id
+                          LIMIT ?'''
+# Ids are bound as one json array, so the text does not depend on
+# their number.
+FIND_CITIZENS = '''SELECT citizen_id FROM citizens
+                   WHERE import_id = ?
+                   AND citizen_id IN (SELECT value FROM json_each(?))'''
+# Fields bound to NULL are left as they are.
+UPDATE_CITIZEN = '''UPDATE citizens SET %s
+                    WHERE import_id = ? AND citizen_id = ?''' %\
+    ', '.join(f'{field} = COALESCE(?, {field})' for field in CITIZEN_FIELDS)
+
+CITIZEN_BIRTHS = '''SELECT citizen_id, town, birth_date FROM citizens
+                    WHERE import_id = ?
+                    ORDER BY citizen_id'''
+CITIZEN_BIRTH = '''SELECT town, birth_date FROM citizens
+                   WHERE import_id = ? AND citizen_id = ?'''
+BIRTH_DATES = '''SELECT citizen_id, birth_date FROM citizens
+                 WHERE import_id = ?
+                 AND citizen_id IN (SELECT value FROM json_each(?))'''
+
+
+# Relatives, every relation is stored from both sides.
+INSERT_RELATIVE = '''INSERT INTO relatives VALUES (?, ?, ?)'''
+DELETE_RELATIVE = '''DELETE FROM relatives
+                     WHERE import_id = ?
+                     AND citizen_id = ? AND relative = ?'''
+# Each side is looked up by its own index.
+CITIZEN_RELATIVES = '''SELECT relative
+                       FROM relatives
+                       WHERE import_id = ? AND citizen_id = ?
+                       UNION
+                       SELECT citizen_id
+                       FROM relatives
+                       WHERE import_id = ? AND relative = ?'''
+CITIZEN_RELATION_ROWS = '''SELECT citizen_id, relative
+                           FROM relatives
+                           WHERE import_id = ? AND citizen_id = ?
+                           UNION
+                           SELECT citizen_id, relative
+                           FROM relatives
+                           WHERE import_id = ? AND relative = ?'''
+RELATION_ROWS = '''SELECT citizen_id, relative
+                   FROM relatives
+                   WHERE import_id = ?'''
+IMPORT_RELATIVES = '''SELECT citizen_id, relative
+                      FROM relatives
+                      WHERE import_id = ?
+                      UNION
+                      SELECT relative, citizen_id
+                      FROM relatives
+                      WHERE import_id = ?
+                      ORDER BY 1, 2'''
+
+# Relatives of citizens with ids in (?, ?].
+PAGE_RELATIVES = '''SELECT citizen_id, relative
+                    FROM relatives
+                    WHERE import_id = ?
+                    AND citizen_id > ? AND citizen_id <= ?
+                    UNION
+                    SELECT relative, citizen_id
+                    FROM relatives
+                    WHERE import_id = ?
+                    AND relative > ? AND relative <= ?
+                    ORDER BY 1, 2'''
+
+
+# Presents aggregate.
+INSERT_PRESENTS = '''INSERT INTO presents VALUES (?, ?, ?, ?)'''
+ADD_PRESENTS_KEY = '''INSERT OR IGNORE INTO presents VALUES (?, ?, ?, 0)'''
+ADD_PRESENTS = '''UPDATE presents SET presents = presents + ?
+                  WHERE import_id = ?
+                  AND month = ? AND citizen_id = ?'''
+DELETE_NO_PRESENTS = '''DELETE FROM presents
+                        WHERE import_id = ?
+                        AND month = ? AND citizen_id = ?
+                        AND presents = 0'''
+SELECT_PRESENTS = '''SELECT month, citizen_id, presents FROM presents
+                     WHERE import_id = ?
+                     ORDER BY month, citizen_id'''
+
+
+# Town births aggregate.
+INSERT_TOWN_BIRTHS = '''INSERT INTO town_births VALUES (?, ?, ?, ?)'''
+SELECT_TOWN_BIRTHS = '''SELECT birth_keys FROM town_births
+                        WHERE import_id = ? AND town = ?'''
+UPDATE_TOWN_BIRTHS = '''UPDATE town_births SET birth_keys = ?
+                        WHERE import_id = ? AND town = ?'''
+DELETE_TOWN_BIRTHS = '''DELETE FROM town_births
+                        WHERE import_id = ? AND town = ?'''
+IMPORT_TOWN_BIRTHS = '''SELECT town, birth_keys FROM town_births
+                        WHERE import_id = ?
+                        ORDER BY position'''
+
+
+# Age percentiles answers.
+SELECT_AGE_STATS = '''SELECT data FROM age_stats
+                      WHERE import_id = ? AND day = ?'''
+SAVE_AGE_STATS = '''INSERT OR REPLACE INTO age_stats VALUES (?, ?, ?)'''
+DELETE_AGE_STATS = '''DELETE FROM age_stats WHERE import_id = ?'''
+
+
+# Import jobs, kept in their own database.
+INSERT_JOB = '''INSERT INTO jobs (job_id, status, owner, created, updated,
+                                  heartbeat)
+                VALUES (?, 'queued', ?, strftime('%s', 'now'),
+                        strftime('%s', 'now'), strftime('%s', 'now'))'''
+DELETE_JOB = '''DELETE FROM jobs WHERE job_id = ?'''
+START_JOB = '''UPDATE jobs SET status = 'running',
+                               updated = strftime('%s', 'now')
+               WHERE job_id = ?'''
+JOB_PROGRESS = '''UPDATE jobs SET citizens = ?,
+                                  updated = strftime('%s', 'now')
+                  WHERE job_id = ?'''
+FINISH_JOB = '''UPDATE jobs SET status = ?, citizens = ?, import_id = ?,
+                                message = ?, updated = strftime('%s', 'now')
+                WHERE job_id = ?'''
+SELECT_JOB = '''SELECT job_id, status, citizens, import_id, message
+                FROM jobs WHERE job_id = ?'''
+JOBS_HEARTBEAT = '''UPDATE jobs SET heartbeat = strftime('%s', 'now')
+                    WHERE status IN ('queued', 'running') AND owner = ?'''
+FAIL_ORPHANED_JOBS = '''UPDATE jobs SET status = 'failed', message = ?,
+                                        updated = strftime('%s', 'now')
+                        WHERE status IN ('queued', 'running')
+                        AND COALESCE(heartbeat, updated) <
+                            strftime('%s', 'now') - ?'''
@@ -0,0 +1,241 @@
+import threading
+from collections import OrderedDict
+
+
+class ImportSnapshot:
+    '''Columnar data of one import at some version.
+
+    Besides citizens and relations the snapshot keeps answers of the
+    statistics endpoints computed for this version, as encoded bodies
+    of responses. Their size counts in the size of the snapshot.
+    '''
+
+    def __init__(self, import_id, version, data):
+        '''Initialize snapshot instance.
+
+        Args:
+            import_id (int): id of the import
+            version (int): version of the import the data belongs to
+            data: finished `ColumnarImport` with the citizens
+        '''
+
+        self.import_id = import_id
+        self.version = version
+        self.data = data
+        self.size = data.size
+
+        self.birthdays = None
+        self.percentiles = None
+
+    def update_size(self):
+        '''Count the size of the data and of the saved answers.'''
+
+        self.size = self.data.size
+        if self.birthdays is not None:
+            self.size += len(self.birthdays)
+        if self.percentiles is not None:
+            self.size += len(self.percentiles[1])
+
+    def iter_citizens(self, after_citizen_id=-1, limit=None, fields=None):
+        '''Citizens with their relatives one citizen at a time.
+
+        Args:
+            after_citizen_id (int): only citizens with bigger ids are taken
+            limit (int): maximum number of citizens, all if None
+            fields: names of the fields to take, all if None
+
+        Yields:
+            citizen: dict with info about one citizen
+        '''
+
+        return self.data.iter_citizens(after_citizen_id, limit, fields)
+
+    def patched(self, version, changes):
+        '''New snapshot with updates of citizens applied.
+
+        The snapshot itself is not changed, so threads still reading
+        it see the import consistently at its old version.
+
+        Args:
+            version (int): version of the import after the updates
+            changes: list of (new tuple of the citizen fields,
+                new relatives of the citizen) in the order of updating
+
+        Returns:
+            snapshot: snapshot of the new version without answers
+        '''
+
+        data = self.data.copy()
+        for row, relatives in changes:
+            data.patch(row, relatives)
+
+        # Statistics have to be counted again.
+        return ImportSnapshot(self.import_id, version, data)
+
+
+class SnapshotCache:
+    '''Snapshots of imports with a limit on their total size.
+
+    The least recently used snapshots are evicted first.
+    '''
+
+    def __init__(self, max_bytes):
+        '''Initialize cache instance.
+
+        Args:
+            max_bytes (int): limit on the total size of snapshots
+        '''
+
+        self.max_bytes = max_bytes
+        self.snapshots = OrderedDict()
+        self.size = 0
+
+        # Versions of imports which did not fit into the cache.
+        self.too_big = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, import_id, version):
+        '''Snapshot of the import with the given version.
+
+        Args:
+            import_id (int): id of the import
+            version (int): current version of the import
+
+        Returns:
+            snapshot: snapshot or None if it is not in the cache
+        '''
+
+        with self.lock:
+            snapshot = self.snapshots.get(import_id)
+            if snapshot is None or snapshot.version != version:
+                self.misses += 1
+                return None
+
+            self.snapshots.move_to_end(import_id)
+            self.hits += 1
+            return snapshot
+
+    def put(self, snapshot):
+        '''Add the snapshot and evict old ones if over the limit.
+
+        Args:
+            snapshot: snapshot to add
+        '''
+
+        with self.lock:
+            self.remove(snapshot.import_id)
+            if snapshot.size > self.max_bytes:
+                return
+
+            self.snapshots[snapshot.import_id] = snapshot
+            self.size += snapshot.size
+            self.evict()
+
+    def is_too_big(self, import_id, version):
+        '''Check if the version of the import did not fit into the cache.'''
+
+        with self.lock:
+            return self.too_big.get(import_id) == version
+
+    def mark_too_big(self, import_id, version):
+        '''Remember that the version of the import does not fit, so it is
+        not read again.'''
+
+        with self.lock:
+            self.too_big[import_id] = version
+
+    def patch(self, import_id, version, changes):
+        '''Replace the cached snapshot by a patched copy of it.
+
+        The snapshot is patched only if it is one version behind,
+        otherwise it is dropped. Threads reading the old snapshot keep
+        it unchanged.
+
+        Args:
+            import_id (int): id of the import
+            version (int): version of the import after the update
+            changes: list of (new tuple of the citizen fields,
+                new relatives of the citizen) in the order of updating
+        '''
+
+        with self.lock:
+            snapshot = self.snapshots.get(import_id)
+            if snapshot is None:
+                return
+            if snapshot.version != version - 1:
+                self.remove(import_id)
+                return
+
+            patched = snapshot.patched(version, changes)
+            self.snapshots[import_id] = patched
+            self.size += patched.size - snapshot.size
+            self.evict()
+
+    def remember(self, snapshot, version, name, answer):
+        '''Save an answer of a statistics endpoint in the snapshot.
+
+        The answer is dropped if the snapshot was replaced by a newer
+        one or evicted since the answer started to be counted, or if
+        the snapshot would not fit into the cache with it.
+
+        Args:
+            snapshot: snapshot to save the answer in
+            version (int): version of the snapshot the answer is for
+            name (str): 'birthdays' (encoded body) or 'percentiles'
+                (date of the ages and encoded body)
+            answer: answer of the endpoint
+        '''
+
+        with self.lock:
+            if snapshot.version != version or\
+                    self.snapshots.get(snapshot.import_id) is not snapshot:
+                return
+
+            size = snapshot.size
+            old = getattr(snapshot, name)
+            setattr(snapshot, name, answer)
+            snapshot.update_size()
+            if snapshot.size > self.max_bytes:
+                setattr(snapshot, name, old)
+                snapshot.update_size()
+                return
+
+            self.size += snapshot.size - size
+            self.snapshots.move_to_end(snapshot.import_id)
+            self.evict()
+
+    def evict(self):
+        '''Drop least recently used snapshots while over the limit
+        (lock must be held).'''
+
+        while self.size > self.max_bytes:
+            _, evicted = self.snapshots.popitem(last=False)
+            self.size -= evicted.size
+            self.evictions += 1
+
+    def remove(self, import_id):
+        '''Drop the snapshot of the import (lock must be held).'''
+
+        snapshot = self.snapshots.pop(import_id, None)
+        if snapshot is not None:
+            self.size -= snapshot.size
+
+    def stats(self):
+        '''Counters of the cache.
+
+        Returns:
+            stats: dict with hits, misses, evictions and sizes
+        '''
+
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'snapshots': len(self.snapshots),
+                    'too_big': len(self.too_big),
+                    'bytes': self.size,
+                    'max_bytes': self.max_bytes}
@@ -1,64 +1,98 @@
 import json
-import sqlite3
-from collections import defaultdict
-from datetime import datetime
+import os
+import pickle
+import tempfile
+from datetime import datetime, timezone
+from itertools import islice
+from operator import itemgetter
 
-import numpy as np
-from dateutil.relativedelta import relativedelta
-from flask import jsonify
+from flask import Response, json as flask_json, jsonify, stream_with_context
+
+import aggregates
+import export
+import queries
+from columnar import ColumnarImport
+from connection_pool import ConnectionPool
+from snapshot_cache import ImportSnapshot, SnapshotCache
+
+
+class KeyReusedError(Exception):
+    '''Idempotency-Key of an earlier import is sent with another body.'''
 
 
 class SQL_Manager:
 
-    def __init__(self):
-        '''Initialize sql_manager instance. Connect to the database.'''
+    # Approximate number of characters in one piece of a streamed response.
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # Number of citizens inserted at once while importing.
+    IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+
+    # An import with the same body as an earlier unchanged import is not
+    # inserted, the id of the earlier one is returned.
+    DEDUPLICATE_IMPORTS = os.environ.get('DEDUPLICATE_IMPORTS', '0') == '1'
+
+    MISSING_RELATIVES_ERROR_MSG = 'Relatives %s are not in the import.'
+    KEY_REUSED_ERROR_MSG = 'Idempotency-Key was sent with another body.'
+
+    # Checked citizens of an import are kept in memory up to this size
+    # (in bytes) before they are inserted, the rest goes to a temporary
+    # file.
+    STAGING_MEMORY_BYTES = int(os.environ.get('STAGING_MEMORY_BYTES',
+                                              64 * 1024 * 1024))
 
-        self.connection = sqlite3.connect('citizens.db',
-                                          check_same_thread=False)
-        self.cursor = self.connection.cursor()
+    # Settings of the writer connection while data is imported.
+    IMPORT_PRAGMAS = {'cache_size': -256 * 1024}
 
-        main_create_query = '''CREATE TABLE IF NOT EXISTS citizens
-                          (import_id INTEGER,
-                           citizen_id INTEGER,
-                           town TEXT,
-                           street TEXT,
-                           building TEXT,
-                           apartment INTEGER,
-                           name TEXT,
-                           birth_date TEXT,
-                           gender TEXT)'''
+    # Limit on the size of cached imports in bytes.
+    SNAPSHOT_CACHE_BYTES = int(os.environ.get('SNAPSHOT_CACHE_BYTES',
+                                              256 * 1024 * 1024))
 
-        relatives_create_query = '''CREATE TABLE IF NOT EXISTS relatives
-                              (import_id INTEGER,
-                               citizen_id INTEGER,
-                               relative INTEGER)'''
+    def __init__(self, database='citizens.db',
+                 cache_bytes=SNAPSHOT_CACHE_BYTES):
+        '''Initialize sql_manager instance. Connect to the database.
 
-        self.cursor.execute(main_create_query)
-        self.cursor.execute(relatives_create_query)
+        Args:
+            database (str): path to the database file
+            cache_bytes (int): limit on the size of cached imports
+        '''
+
+        self.pool = ConnectionPool(database)
+        self.snapshots = SnapshotCache(cache_bytes)
+
+        # Schema does not change while the server works.
+        self.columns = self.get_columns()
 
     def __del__(self):
-        '''Commit changes and close the connection to the database.'''
+        '''Close the connections to the database.'''
 
-        self.connection.commit()
-        self.connection.close()
+        pool = getattr(self, 'pool', None)
+        if pool is not None:
+            pool.close()
 
-    def run_query(self, query):
-        '''Run the given query and commit.'''
+    @property
+    def cursor(self):
+        '''New cursor of the current thread's read connection.'''
 
-        self.cursor.execute(query)
-        self.connection.commit()
+        return self.pool.reader().cursor()
 
-    def get_import_id(self):
-        '''Get the import_id for the new session.
+    def get_import_id(self, cursor):
+        '''Allocate the import_id for the new session.
+
+        The id is taken from the imports table by a single statement
+        of the caller's write transaction, so concurrent uploads from
+        different processes never get the same id.
+
+        Args:
+            cursor: cursor of the write transaction
 
         Returns:
             import_id: id for new upload
         '''
 
-        get_query = '''SELECT MAX(import_id) FROM citizens'''
-        import_id = self.cursor.execute(get_query).fetchone()[0]
+        cursor.execute(queries.ALLOCATE_IMPORT_ID)
 
-        return import_id + 1 if import_id is not None else 0
+        return cursor.lastrowid
 
     def check_import_id(self, import_id):
         '''Extra check for the import_id.
@@ -72,7 +106,14 @@ class SQL_Manager:
             is not in the database
         '''
 
-        if import_id >= self.get_import_id():
+        try:
+            found = self.cursor.execute(queries.IMPORT_EXISTS,
+                                        (import_id,)).fetchone()
+        except OverflowError:
+            # Too big for SQLite integer, so surely not in the database.
+            found = None
+
+        if found is None:
             # Building response for a failed request.
             error_msg = f'No such "import_id" = {import_id} in database.'
             response = jsonify({'message': error_msg})
@@ -96,6 +137,50 @@ class SQL_Manager:
 
         return response
 
+    def build_saved_request(self, body, status_code=200):
+        '''Make request from the body of a saved good response.
+
+        Args:
+            body (bytes): body made by `build_good_request`
+            status_code (int): status_code for the response
+
+        Returns:
+            response: complete response from server
+        '''
+
+        return Response(body, status=status_code,
+                        mimetype='application/json')
+
+    def build_stream_request(self, items, status_code=200):
+        '''Make a streamed response with a json-array of items as data.
+
+        Args:
+            items: iterable of json-serializable elements
+            status_code (int): status_code for the response
+
+        Returns:
+            response: response sending the items as they are produced
+        '''
+
+        def generate():
+            chunk = ['{"data": [']
+            size = 0
+            for i, item in enumerate(items):
+                element = flask_json.dumps(item)
+                chunk.append(element if i == 0 else ', ' + element)
+                size += len(element)
+
+                # Send data by big enough pieces.
+                if size >= self.STREAM_CHUNK_SIZE:
+                    yield ''.join(chunk)
+                    chunk, size = [], 0
+            chunk.append(']}\n')
+            yield ''.join(chunk)
+
+        return Response(stream_with_context(generate()),
+                        status=status_code,
+                        mimetype='application/json')
+
     def get_columns(self, table='citizens'):
         '''Get column names of a given table.
 
@@ -106,121 +191,466 @@ class SQL_Manager:
             columns: column_names of table
         '''
 
-        columns = list(self.cursor.execute(f'''PRAGMA table_info({table})'''))
-        columns = [element[1] for element in columns]
+        columns = self.cursor.execute(queries.TABLE_COLUMNS, (table,))
+        columns = [element[0] for element in columns]
 
         return columns
 
-    def order_import_params(self, data, columns, import_id):
-        '''If data is shuffled function will order it.
+    def get_relatives_for_citizen(self, import_id, citizen_id, cursor=None):
+        '''Returns relatives for a given citizen.
 
         Args:
-            data: shuffled data to input
-            columns: columns names
-            import_id (int): id of upload
+            import_id (int): id of an import
+            citizen_id (int): id of citizen whose relatives to return
+            cursor: cursor to use instead of a read cursor
 
         Returns:
-            new_data: list of values in right order
+            relatives: list of relatives to given person
         '''
-        data['import_id'] = import_id
 
-        indexes = {column: i for i, column in enumerate(columns)}
-        new_data = [None] * len(indexes)
-        for column in data:
-            if column == 'relatives':
-                continue
-            idx = indexes[column]
-            new_data[idx] = data[column]
+        params = (import_id, citizen_id, import_id, citizen_id)
+        cursor = cursor or self.cursor
+        rel_data = cursor.execute(queries.CITIZEN_RELATIVES, params)
 
-        return new_data
+        return [relative[0] for relative in rel_data]
 
-    def get_relatives_for_citizen(self, import_id, citizen_id):
-        '''Returns relatives for a given citizen.
+    def get_import_version(self, import_id):
+        '''Current version of the import.
 
         Args:
             import_id (int): id of an import
-            citizen_id (int): id of citizen whose relatives to return
 
         Returns:
-            relatives: list of relatives to given person
+            version (int): version of the import, None if there is
+            no such import
         '''
 
-        rel_query = f'''SELECT citizen_id, relative
-                        FROM relatives
-                        WHERE import_id = {import_id}
-                        AND (citizen_id = {citizen_id}
-                        OR relative = {citizen_id})'''
-        rel_data = list(self.cursor.execute(rel_query))
+        row = self.cursor.execute(queries.IMPORT_VERSION,
+                                  (import_id,)).fetchone()
 
-        # Relatives are two-sided.
-        rel_data = [rel_data[i][j] for j in range(2)
-                    for i in range(len(rel_data))
-                    if rel_data[i][j] != citizen_id]
+        return row[0] if row is not None else None
 
-        return list(set(rel_data))
+    def get_validators(self, import_id, daily=False):
+        '''Validators of the current answers about the import.
 
-    def get_relatives(self, import_id):
-        '''Returns dict of citizens with relations.
+        Only the imports table is read, so a client which already has
+        the answer is told so without reading the citizens.
 
         Args:
-            import_id (int): id of upload
+            import_id (int): id of an import
+            daily (bool): the answer also changes every day (ages)
+
+        Returns:
+            etag (str): tag of the import version, None if there is
+                no such import
+            modified (datetime): time of the last change of the answer
+        '''
+
+        try:
+            row = self.cursor.execute(queries.IMPORT_STATE,
+                                      (import_id,)).fetchone()
+        except OverflowError:
+            row = None
+        if row is None:
+            return None, None
+
+        version, modified = row
+        etag = f'{import_id}-{version}'
+        modified = datetime.fromtimestamp(modified or 0, timezone.utc)
+
+        if daily:
+            today = datetime.utcnow().date()
+            etag += f'-{today:%Y%m%d}'
+            modified = max(modified, datetime(today.year, today.month,
+                                              today.day,
+                                              tzinfo=timezone.utc))
+
+        return etag, modified
+
+    def load_snapshot(self, import_id):
+        '''Read the whole import in one read transaction.
+
+        Args:
+            import_id (int): id of an import
 
         Returns:
-            relatives: dict citizen -> relatives
+            snapshot: decoded import or None if it does not fit
+            into the cache
         '''
 
-        rel_query = f'''SELECT citizen_id, relative
-                        FROM relatives
-                        WHERE import_id = {import_id}'''
-        data = list(self.cursor.execute(rel_query))
+        data = ColumnarImport(self.columns[1:])
+        connection = self.pool.reader()
+        cursor = connection.cursor()
 
-        response = {}
-        for pair in data:
-            if pair[0] in response:
-                response[pair[0]].append(pair[1])
+        cursor.execute('''BEGIN''')
+        try:
+            version = cursor.execute(queries.IMPORT_VERSION,
+                                     (import_id,)).fetchone()[0]
+
+            # Stop reading as soon as the import is too big.
+            cursor.execute(queries.SELECT_CITIZENS, (import_id,))
+            for count, row in enumerate(cursor):
+                data.add(row[1:])
+                if count % 1024 == 0 and data.size > self.snapshots.max_bytes:
+                    return None
+
+            cursor.execute(queries.IMPORT_RELATIVES, (import_id, import_id))
+            for count, (citizen_id, relative) in enumerate(cursor):
+                data.add_relative(citizen_id, relative)
+                if count % 1024 == 0 and data.size > self.snapshots.max_bytes:
+                    return None
+        finally:
+            cursor.execute('''COMMIT''')
+
+        data.finish()
+        if data.size > self.snapshots.max_bytes:
+            return None
+
+        return ImportSnapshot(import_id, version, data)
+
+    def get_snapshot(self, import_id, load=True):
+        '''Snapshot of the import from the cache or from the database.
+
+        Args:
+            import_id (int): id of an import which is in the database
+            load (bool): read the import if it is not in the cache
+
+        Returns:
+            snapshot: current snapshot of the import or None
+            if the import is too big for the cache, which is read only
+            once for every version of the import
+        '''
+
+        version = self.get_import_version(import_id)
+        snapshot = self.snapshots.get(import_id, version)
+
+        if snapshot is None and load and\
+                not self.snapshots.is_too_big(import_id, version):
+            snapshot = self.load_snapshot(import_id)
+            if snapshot is not None:
+                self.snapshots.put(snapshot)
             else:
-                response[pair[0]] = [pair[1]]
+                self.snapshots.mark_too_big(import_id, version)
 
-        return response
+        return snapshot
+
+    def find_import(self, idempotency_key=None, content_hash=None,
+                    cursor=None, key_hash=None):
+        '''Find an earlier import by its key or by the hash of its body.
 
-    def import_data(self, data):
+        Args:
+            idempotency_key (str): Idempotency-Key of the import request
+            content_hash (bytes): hash of the body of an unchanged import
+            cursor: cursor of a transaction, a read cursor by default
+            key_hash: function returning the hash of the body of the
+                request, called only if an import with the key is found
+
+        Returns:
+            import_id (int): id of the found import or None
+
+        Raises:
+            KeyReusedError: import with the key has another hash of body
+        '''
+
+        cursor = cursor or self.cursor
+        row = None
+        if idempotency_key is not None:
+            row = cursor.execute(queries.IMPORT_BY_KEY,
+                                 (idempotency_key,)).fetchone()
+
+            # Imports saved before hashes of keys have no hash.
+            if row is not None and key_hash is not None and\
+                    row[1] is not None and row[1] != key_hash():
+                raise KeyReusedError(self.KEY_REUSED_ERROR_MSG)
+        if row is None and content_hash is not None:
+            row = cursor.execute(queries.IMPORT_BY_HASH,
+                                 (content_hash,)).fetchone()
+        return None if row is None else row[0]
+
+    def import_data(self, citizens, batch_size=None, idempotency_key=None,
+                    content_hash=None):
         '''Imports new data to the database.
 
         Args:
-            data: data to import
+            citizens: iterable of citizens to import
+            batch_size (int): number of citizens inserted at once,
+                `IMPORT_BATCH_SIZE` by default
+            idempotency_key (str): Idempotency-Key of the request
+            content_hash: function returning the hash of the body
+                when all citizens are read
 
         Returns:
             response: complete response for a query
         '''
 
-        data = data['citizens']
-        import_id = self.get_import_id()
+        import_id = self.insert_import(citizens, batch_size, idempotency_key,
+                                       content_hash)
 
-        main_import_query = '''INSERT INTO citizens
-                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+        # Build response.
+        return self.build_good_request({'import_id': import_id}, 201)
 
-        relatives_query = '''INSERT INTO relatives
-                             VALUES (?, ?, ?)'''
+    def stage_import(self, citizens, batch_size):
+        '''Read and check all citizens before the import is inserted.
 
-        # Insert main part of data.
-        columns = self.get_columns()
-        main_params = [self.order_import_params(citizen, columns, import_id)
-                       for citizen in data]
-        self.cursor.executemany(main_import_query, main_params)
-        self.connection.commit()
+        Rows are pickled by batches into a temporary file, which stays
+        in memory up to `STAGING_MEMORY_BYTES`, so a slow upload does
+        not hold the write lock while it is read.
 
-        # Loop over all citizens.
-        for citizen in data:
-            # Add relatives.
-            citizen_id = citizen['citizen_id']
-            values = citizen['relatives']
-            rel_params = [[import_id, citizen_id, value]
-                          for value in values]
-            self.cursor.executemany(relatives_query, rel_params)
-        self.connection.commit()
+        Args:
+            citizens: iterable of citizens to import
+            batch_size (int): number of citizens in a batch
 
-        # Build response.
-        return self.build_good_request({'import_id': import_id}, 201)
+        Returns:
+            staged: file with batches of citizen and relative rows,
+            positioned at its start
+        '''
+
+        citizens = iter(citizens)
+        fields = itemgetter(*self.columns[1:])
+        staged = tempfile.SpooledTemporaryFile(self.STAGING_MEMORY_BYTES)
+
+        try:
+            while True:
+                batch = list(islice(citizens, batch_size))
+                if not batch:
+                    break
+                rows = [fields(citizen) for citizen in batch]
+                relatives = [(citizen['citizen_id'], value)
+                             for citizen in batch
+                             for value in citizen['relatives']]
+                pickle.dump((rows, relatives), staged,
+                            pickle.HIGHEST_PROTOCOL)
+        except BaseException:
+            staged.close()
+            raise
+
+        staged.seek(0)
+        return staged
+
+    @staticmethod
+    def iter_staged(staged):
+        '''Batches of rows saved by `stage_import`.
+
+        Yields:
+            rows, relatives: lists of citizen rows and of
+            (citizen_id, relative) pairs
+        '''
+
+        while True:
+            try:
+                yield pickle.load(staged)
+            except EOFError:
+                return
+
+    def insert_import(self, citizens, batch_size=None, idempotency_key=None,
+                      content_hash=None):
+        '''Insert a new import.
+
+        All citizens are read from `citizens` and checked first, an
+        exception raised by `citizens` leaves the database untouched.
+        Then they are inserted by batches in one transaction. An import
+        saved with the same `idempotency_key` and hash of the body is
+        returned instead of inserting the new one. With
+        `DEDUPLICATE_IMPORTS` so is an unchanged import with the same
+        hash of the body.
+
+        Args:
+            citizens: iterable of citizens to import
+            batch_size (int): number of citizens inserted at once,
+                `IMPORT_BATCH_SIZE` by default
+            idempotency_key (str): Idempotency-Key of the request
+            content_hash: function returning the hash of the body
+                when all citizens are read
+
+        Returns:
+            import_id (int): id of the new import or of the same
+            earlier one
+
+        Raises:
+            KeyReusedError: import with the key has another hash of body
+        '''
+
+        batch_size = batch_size or self.IMPORT_BATCH_SIZE
+
+        with self.stage_import(citizens, batch_size) as staged:
+            # The whole body is read, so its hash is known.
+            digest = key_hash = None
+            if self.DEDUPLICATE_IMPORTS and content_hash is not None:
+                digest = content_hash()
+            if idempotency_key is not None and content_hash is not None:
+                key_hash = content_hash()
+
+            with self.pool.writer() as connection,\
+                    self.pool.pragmas(connection, self.IMPORT_PRAGMAS):
+                cursor = connection.cursor()
+
+                # Same import may have been committed meanwhile.
+                import_id = self.find_import(idempotency_key, digest,
+                                             cursor=cursor,
+                                             key_hash=content_hash)
+                if import_id is not None:
+                    return import_id
+
+                import_id = self.get_import_id(cursor)
+                if idempotency_key is not None or digest is not None:
+                    cursor.execute(queries.SET_IMPORT_IDENTITY,
+                                   (idempotency_key, key_hash, digest,
+                                    import_id))
+
+                for rows, relatives in self.iter_staged(staged):
+                    # Insert main part of data.
+                    cursor.executemany(queries.INSERT_CITIZEN,
+                                       ((import_id,) + row for row in rows))
+
+                    # Add relatives.
+                    cursor.executemany(queries.INSERT_RELATIVE,
+                                       ((import_id,) + pair
+                                        for pair in relatives))
+
+                # Precompute statistics of the import.
+                aggregates.build(cursor, import_id)
+
+        return import_id
+
+    def missing_citizens(self, cursor, import_id, citizen_ids):
+        '''Citizens which are not in the import.
+
+        Args:
+            cursor: cursor of the database
+            import_id (int): id of an import
+            citizen_ids: ids of citizens to look for
+
+        Returns:
+            missing: sorted list of ids which are not in the import
+        '''
+
+        citizen_ids = set(citizen_ids)
+        if not citizen_ids:
+            return []
+
+        found = cursor.execute(queries.FIND_CITIZENS,
+                               (import_id, json.dumps(list(citizen_ids))))
+
+        return sorted(citizen_ids.difference(row[0] for row in found))
+
+    def update_relatives(self, cursor, import_id, citizen_id, old, new):
+        '''Change relatives of the citizen touching only changed relations.
+
+        Args:
+            cursor: cursor of a write transaction
+            import_id (int): id of an import
+            citizen_id (int): id of a citizen
+            old: current relatives of the citizen
+            new: relatives the citizen must have
+        '''
+
+        old = set(old)
+        new = set(new)
+
+        # Relations are stored from both sides.
+        def rows(relatives):
+            return {row for relative in relatives
+                    for row in [(import_id, citizen_id, relative),
+                                (import_id, relative, citizen_id)]}
+
+        cursor.executemany(queries.DELETE_RELATIVE, rows(old - new))
+        cursor.executemany(queries.INSERT_RELATIVE, rows(new - old))
+
+    def update_citizen(self, cursor, import_id, citizen_id, new_data):
+        '''Change one citizen and correct the aggregates.
+
+        The citizen and its new relatives must be in the import.
+
+        Args:
+            cursor: cursor of a write transaction
+            import_id (int): id of an import
+            citizen_id (int): id of a citizen
+            new_data (dict): fields to replace
+
+        Returns:
+            row: new tuple of the citizen fields
+            relatives: sorted list of the citizen's relatives
+        '''
+
+        # Presents depend on birth dates and relations, ages of towns
+        # on towns and birth dates.
+        update_presents = 'birth_date' in new_data or\
+            'relatives' in new_data
+        update_births = 'town' in new_data or 'birth_date' in new_data
+        aggregates.exclude_citizen(cursor, import_id, citizen_id,
+                                   update_presents, update_births)
+
+        # Update table, fields which are not given stay the same.
+        values = [new_data.get(field) for field in queries.CITIZEN_FIELDS]
+        if any(value is not None for value in values):
+            cursor.execute(queries.UPDATE_CITIZEN,
+                           values + [import_id, citizen_id])
+
+        # Only neighbours of the citizen are read and changed.
+        relatives = self.get_relatives_for_citizen(import_id, citizen_id,
+                                                   cursor)
+        if 'relatives' in new_data:
+            self.update_relatives(cursor, import_id, citizen_id, relatives,
+                                  new_data['relatives'])
+            relatives = sorted(set(new_data['relatives']))
+
+        aggregates.include_citizen(cursor, import_id, citizen_id,
+                                   update_presents, update_births)
+
+        # Get updated data.
+        row = cursor.execute(queries.SELECT_CITIZEN,
+                             (import_id, citizen_id)).fetchone()[1:]
+
+        return row, relatives
+
+    def check_citizens_exist(self, cursor, import_id, citizens):
+        '''Check that updated citizens and their relatives are in the import.
+
+        Args:
+            cursor: cursor of the database
+            import_id (int): id of an import
+            citizens: dict citizen_id -> fields to replace
+
+        Returns:
+            True: all citizens are in the import
+            response: message & 404/400-status_code otherwise
+        '''
+
+        missing = self.missing_citizens(cursor, import_id, citizens)
+        if missing:
+            error_msg = f'citizen with "citizen_id" = ' +\
+                f'{missing[0]} is not in database.'
+            response = jsonify({'message': error_msg})
+            response.status_code = 404
+            return response
+
+        relatives = {relative for new_data in citizens.values()
+                     for relative in new_data.get('relatives', ())}
+        missing = self.missing_citizens(cursor, import_id,
+                                        relatives.difference(citizens))
+        if missing:
+            error_msg = self.MISSING_RELATIVES_ERROR_MSG %\
+                ', '.join(map(str, missing))
+            response = jsonify({'message': error_msg})
+            response.status_code = 400
+            return response
+
+        return True
+
+    def bump_version(self, cursor, import_id):
+        '''Make a new version of the changed import.
+
+        Args:
+            cursor: cursor of a write transaction
+            import_id (int): id of an import
+
+        Returns:
+            version (int): new version of the import
+        '''
+
+        cursor.execute(queries.BUMP_VERSION, (import_id,))
+        return cursor.execute(queries.IMPORT_VERSION,
+                              (import_id,)).fetchone()[0]
 
     def replace_data(self, import_id, citizen_id, new_data):
         '''Replaces data for a given citizen.
@@ -239,70 +669,103 @@ class SQL_Manager:
         if check_answer is not True:
             return check_answer
 
-        # Set new_data for SQL UPDATE query form.
-        new = ', '.join([name + ' = "' + str(new_data[name]) + '"'
-                         for name in new_data if name != 'relatives'])
+        columns = self.columns
 
-        # Update table.
-        update_query = f'''UPDATE citizens SET {new}
-                           WHERE import_id = {import_id}
-                           AND citizen_id = {citizen_id}'''
-        self.run_query(update_query)
+        with self.pool.writer() as connection:
+            cursor = connection.cursor()
 
-        # Update relatives table.
-        rel_delete_query = f'''DELETE FROM relatives
-                               WHERE import_id = {import_id}
-                               AND citizen_id = {citizen_id}
-                               OR relative = {citizen_id}'''
-        self.run_query(rel_delete_query)
+            check_answer = self.check_citizens_exist(cursor, import_id,
+                                                     {citizen_id: new_data})
+            if check_answer is not True:
+                return check_answer
 
-        if 'relatives' in new_data:
-            # Insert new relatives data.
-            rel_insert_query = '''INSERT INTO relatives
-                                  VALUES (?, ?, ?)'''
-            params = [[import_id, citizen_id, value]
-                      for value in new_data['relatives']]
-            params += [[import_id, value, citizen_id]
-                       for value in new_data['relatives']]
-            self.cursor.executemany(rel_insert_query, params)
-        self.connection.commit()
+            row, relatives = self.update_citizen(cursor, import_id,
+                                                 citizen_id, new_data)
+            version = self.bump_version(cursor, import_id)
 
-        # Get updated data.
-        query = f'''SELECT * FROM citizens
-                    WHERE import_id = {import_id}
-                    AND citizen_id = {citizen_id}'''
-        data = self.cursor.execute(query)
-
-        if data is not None:
-            data = data.fetchone()
-
-            # Generate the answer.
-            columns = self.get_columns()
-            answer = {columns[i]: data[i] for i in range(1, len(columns))}
-            answer['relatives'] =\
-                self.get_relatives_for_citizen(import_id, citizen_id)
-        else:
+        # Bring the cached import up to date.
+        self.snapshots.patch(import_id, version, [(row, relatives)])
 
-            error_msg = f'citizen with "citizen_id" = ' +\
-                   f'{citizen_id} is not in database.'
-            response = jsonify({'message': error_msg})
-            response.status_code = 404
-            return response
+        # Generate the answer.
+        answer = dict(zip(columns[1:], row))
+        answer['relatives'] = relatives
 
         # Build response for the completed query.
         response = jsonify(answer)
         response.status_code = 200
         return response
 
-    def get_data(self, import_id):
-        '''Retrieves all data from database for a given `import_id`.
+    def replace_many(self, import_id, citizens):
+        '''Replaces data of several citizens in one transaction.
+
+        Citizens are changed in the given order, nothing is changed
+        if some of them or their relatives are not in the import.
+
+        Args:
+            import_id (int): id of upload where to seek citizens
+            citizens: list of dicts with citizen_id and fields to replace
+
+        Returns:
+            response: complete response with updated info about citizens
+        '''
+
+        # Extra check for import_id.
+        check_answer = self.check_import_id(import_id)
+        if check_answer is not True:
+            return check_answer
+
+        columns = self.columns
+
+        with self.pool.writer() as connection:
+            cursor = connection.cursor()
+
+            check_answer = self.check_citizens_exist(
+                cursor, import_id,
+                {citizen['citizen_id']: citizen for citizen in citizens})
+            if check_answer is not True:
+                return check_answer
+
+            changes = [self.update_citizen(cursor, import_id,
+                                           citizen['citizen_id'], citizen)
+                       for citizen in citizens]
+            version = self.bump_version(cursor, import_id)
+
+            # Relatives of a citizen may be changed by later citizens.
+            answer = []
+            for row, _ in changes:
+                citizen = dict(zip(columns[1:], row))
+                citizen['relatives'] = self.get_relatives_for_citizen(
+                    import_id, row[0], cursor)
+                answer.append(citizen)
+
+        # Bring the cached import up to date.
+        self.snapshots.patch(import_id, version, changes)
+
+        return self.build_good_request(answer)
+
+    def get_data(self, import_id, after_citizen_id=-1, limit=None,
+                 fields=None, mimetype='application/json'):
+        '''Retrieves data from database for a given `import_id`.
+
+        Citizens and their relatives are fetched with two set-based queries
+        (both ordered by citizen_id) and merged while the response is
+        streamed, so no per-citizen query is issued. A page of citizens
+        is found by the primary key and relatives are not read at all
+        if they are not requested.
 
         Args:
             import_id (int): id of upload to return
+            after_citizen_id (int): only citizens with bigger ids are
+                returned
+            limit (int): maximum number of citizens, all if None
+            fields: names of the fields to return, all if None,
+                repeated ones are returned once in the order of the table
+            mimetype (str): format of the answer, one json document,
+                json lines or the columnar layout of `export`
 
         Returns:
             response: complete response with info
-            about all citizens from a given import
+            about citizens from a given import
         '''
 
         # Extra check for import_id.
@@ -310,27 +773,136 @@ class SQL_Manager:
         if check_answer is not True:
             return check_answer
 
-        # Get column names.
-        columns = self.get_columns()
+        columns = self.columns[1:]
+        if fields is not None:
+            unknown = sorted(set(fields) - set(columns) - {'relatives'})
+            if unknown:
+                error_msg = f'No such fields: {", ".join(unknown)}.'
+                response = jsonify({'message': error_msg})
+                response.status_code = 400
+                return response
+
+            # Both hot and cold imports give fields in the same order.
+            fields = [field for field in columns + ['relatives']
+                      if field in fields]
+            columns = [column for column in columns if column in fields]
+        with_relatives = fields is None or 'relatives' in fields
+
+        # Hot imports are served from memory, a part of a cold import
+        # is read from the database alone.
+        whole = after_citizen_id < 0 and limit is None and fields is None
+        snapshot = self.get_snapshot(import_id, load=whole)
+        if snapshot is not None:
+            return self.build_export(snapshot.iter_citizens(
+                after_citizen_id, limit, fields),
+                fields or self.columns[1:] + ['relatives'], mimetype)
+
+        answer = self.iter_page(import_id, columns, after_citizen_id, limit,
+                                with_relatives)
+        return self.build_export(answer, columns + ['relatives'] *
+                                 with_relatives, mimetype)
+
+    def iter_page(self, import_id, columns, after_citizen_id=-1, limit=None,
+                  with_relatives=True):
+        '''Read a page of citizens of an import in one read transaction.
+
+        The transaction starts when the first citizen is taken and ends
+        when the page is read or closed, so citizens and relatives are
+        read from the same state of the import.
+
+        Args:
+            import_id (int): id of an import which is in the database
+            columns: names of the fields after citizen_id to read
+            after_citizen_id (int): only citizens with bigger ids are read
+            limit (int): maximum number of citizens, all if None
+            with_relatives (bool): add relatives of the citizens
+
+        Yields:
+            citizen: dict with info about one citizen
+        '''
+
+        connection = self.pool.reader()
+        cursor = connection.cursor()
+
+        cursor.execute('''BEGIN''')
+        try:
+            # Only requested columns are read, citizen_id is always needed.
+            query = queries.SELECT_CITIZENS_PAGE % ', '.join(['citizen_id'] +
+                                                             columns)
+            params = (import_id, after_citizen_id,
+                      -1 if limit is None else limit)
+            citizens = cursor.execute(query, params)
+
+            relatives = None
+            if with_relatives:
+                last_citizen_id = queries.MAX_ID
+                if limit is not None:
+                    citizens = citizens.fetchall()
+                    last_citizen_id = citizens[-1][0] if citizens else -1
+
+                # Relatives are two-sided, so take pairs in both directions.
+                params = (import_id, after_citizen_id, last_citizen_id) * 2
+                relatives = connection.cursor().execute(
+                    queries.PAGE_RELATIVES, params)
+
+            yield from self.iter_citizens(columns, citizens, relatives)
+        finally:
+            cursor.execute('''COMMIT''')
+
+    def build_export(self, citizens, fields, mimetype):
+        '''Make a streamed response with citizens in the given format.
 
-        # Get all rows with needed import_id.
-        query = f'''SELECT * FROM citizens
-                    WHERE import_id = {import_id}'''
-        data = list(self.cursor.execute(query))
+        Args:
+            citizens: iterable of dicts with info about citizens
+            fields: names of the fields of every citizen
+            mimetype (str): json, json lines or the columnar layout
 
-        # Generate the answer.
-        answer = []
-        for citizen in data:
-            # Start collecting values from 1-index
-            # because 0-index is import_id.
-            values = {columns[i]: citizen[i] for i in range(1, len(columns))}
+        Returns:
+            response: response sending citizens as they are produced
+        '''
+
+        if mimetype == export.NDJSON_MIMETYPE:
+            pieces = export.iter_ndjson(citizens, self.STREAM_CHUNK_SIZE)
+        elif mimetype == export.COLUMNS_MIMETYPE:
+            pieces = export.iter_columns(citizens, fields)
+        else:
+            return self.build_stream_request(citizens)
 
-            citizen_id = citizen[1]
-            values['relatives'] =\
-                self.get_relatives_for_citizen(import_id, citizen_id)
-            answer.append(values)
+        return Response(stream_with_context(pieces), mimetype=mimetype)
 
-        return self.build_good_request(answer)
+    def iter_citizens(self, columns, citizens, relatives=None):
+        '''Merge citizens with their relatives one citizen at a time.
+
+        Args:
+            columns: names of the fields after citizen_id in the rows
+            citizens: rows of citizen_id and `columns` ordered by citizen_id
+            relatives: (citizen_id, relative) pairs ordered by citizen_id,
+                None if relatives are not needed
+
+        Yields:
+            citizen: dict with info about one citizen
+        '''
+
+        pairs = iter(relatives or ())
+        pair = next(pairs, None)
+
+        for citizen in citizens:
+            values = dict(zip(columns, citizen[1:]))
+            if relatives is None:
+                yield values
+                continue
+            citizen_id = citizen[0]
+
+            # Skip pairs of citizens which are not in the import.
+            while pair is not None and pair[0] < citizen_id:
+                pair = next(pairs, None)
+
+            values['relatives'] = []
+            while pair is not None and pair[0] == citizen_id:
+                values['relatives'].append(pair[1])
+                pair = next(pairs, None)
+
+            yield values
 
     def get_birthdays(self, import_id):
         '''Returns who and how many presents will buy in each month.
@@ -347,35 +919,28 @@ class SQL_Manager:
         if check_answer is not True:
             return check_answer
 
-        # Get all pairs of getter-takers.
-        rel_query = f'''SELECT citizen_id, relative
-                        FROM relatives
-                        WHERE import_id={import_id}'''
-        relatives = self.cursor.execute(rel_query).fetchall()
-
-        answer = {month: defaultdict(int) for month in range(1, 13)}
-        for pair in relatives:
-            # If replace pair[0] and pair[1] -> SOLUTION.
-            for (giver, taker) in [(pair[0], pair[1]), (pair[1], pair[0])]:
-                # Retrieve month of takers birthday.
-                birthday_query = f'''SELECT birth_date FROM citizens
-                                    WHERE import_id = {import_id}
-                                    AND citizen_id = {taker}'''
-                date = self.cursor.execute(birthday_query).fetchone()
-
-                # Increment getters counter for the searched month.
-                if date:
-                    date = datetime.strptime(date[0], '%d.%m.%Y')
-                    month = date.month
-                    answer[month][giver] += 1
+        # Answers are kept only with snapshots which are cached anyway,
+        # reading the whole import is not worth it for them.
+        snapshot = self.get_snapshot(import_id, load=False)
+        if snapshot is not None:
+            if snapshot.birthdays is not None:
+                return self.build_saved_request(snapshot.birthdays)
+            version = snapshot.version
+
+        # Presents are counted when data is imported or changed.
+        presents = aggregates.read_presents(self.cursor, import_id)
 
         # Compile the answer by adding labels.
-        for month in answer:
-            buyers = [{'citizen_id': who, 'presents': answer[month][who]}
-                      for who in answer[month]]
-            answer[month] = buyers
+        answer = {month: [] for month in range(1, 13)}
+        for month, giver, count in presents:
+            answer[month].append({'citizen_id': giver, 'presents': count})
 
-        return self.build_good_request(answer)
+        response = self.build_good_request(answer)
+        if snapshot is not None:
+            self.snapshots.remember(snapshot, version, 'birthdays',
+                                    response.get_data())
+
+        return response
 
     def get_percentile_age(self, import_id):
         '''Returns age percentiles (50, 75, 99) for each town.
@@ -392,38 +957,38 @@ class SQL_Manager:
         if check_answer is not True:
             return check_answer
 
-        towns_query = f'''SELECT DISTINCT town FROM citizens
-                          WHERE import_id = {import_id}'''
-        towns = self.cursor.execute(towns_query)
-
-        answer = []
+        # Ages change every day, so answer is cached for a day.
         today = datetime.utcnow().date()
+        # Answers are kept only with snapshots which are cached anyway.
+        snapshot = self.get_snapshot(import_id, load=False)
+        if snapshot is not None:
+            percentiles = snapshot.percentiles
+            if percentiles is not None and percentiles[0] == today:
+                return self.build_saved_request(percentiles[1])
+            version = snapshot.version
+
+        cursor = self.cursor
+        answer = aggregates.cached_age_percentiles(cursor, import_id, today)
+        if answer is None:
+            # Counted on the read connection, so the answer never waits
+            # for a running import.
+            counted = self.get_import_version(import_id)
+            answer = aggregates.age_percentiles(cursor, import_id, today)
+
+            # Saved only if the writer is free and nothing has changed
+            # since the birth dates were read.
+            with self.pool.try_writer() as connection:
+                if connection is not None:
+                    cursor = connection.cursor()
+                    current = cursor.execute(queries.IMPORT_VERSION,
+                                             (import_id,)).fetchone()
+                    if current is not None and current[0] == counted:
+                        aggregates.cache_age_percentiles(cursor, import_id,
+                                                         today, answer)
+
+        response = self.build_good_request(answer)
+        if snapshot is not None:
+            self.snapshots.remember(snapshot, version, 'percentiles',
+                                    (today, response.get_data()))
 
-        # Compute percentiles for each town.
-        towns = [town[0] for town in towns.fetchall()]
-        for town in towns:
-            births_query = f'''SELECT birth_date FROM citizens
-                              WHERE import_id = {import_id}
-                              AND town = {json.dumps(town,
-                               ensure_ascii=False)}'''
-            dates = self.cursor.execute(births_query)
-
-            # Format the date.
-            dates = [datetime.strptime(date[0], '%d.%m.%Y').date()
-                     for date in dates.fetchall()]
-
-            # Compute ages.
-            ages = [relativedelta(today, date).years
-                    for date in dates]
-
-            percentiles = [round(np.percentile(ages, p,
-                           interpolation='linear'), 2)
-                           for p in [50, 75, 99]]
-
-            town_output = {'town': town,
-                           'p50': percentiles[0],
-                           'p75': percentiles[1],
-                           'p99': percentiles[2]}
-            answer.append(town_output)
-
-        return self.build_good_request(answer)
+        return response